@@ -1,97 +1,120 @@
 # config/myid_config.py
-from pydantic import BaseSettings
-from typing import Dict, List
+import os
+import re
+from dataclasses import dataclass
+from enum import IntEnum
+from dotenv import load_dotenv
+from typing import Final, Mapping, Tuple
 
-class MyIDSettings(BaseSettings):
+load_dotenv()
+
+# Service IDs mapping
+SERVICE_IDS: Final[Mapping[str, str]] = {
+    "DAILY": "SERVICE_NAME_DAILY",
+    "WEEKLY": "SERVICE_NAME_WEEKLY",
+    "MONTHLY": "SERVICE_NAME_MONTHLY",
+    "OTP": "SERVICE_NAME_OTP"
+}
+
+# Package pricing (MMK)
+class PackagePrice(IntEnum):
+    DAILY = 149
+    WEEKLY = 599
+    MONTHLY = 1999
+    OTP = 99
+
+PACKAGE_PRICES: Final[Mapping[str, int]] = {m.name: m for m in PackagePrice}
+
+# Valid channels
+VALID_CHANNELS: Final[Tuple[str, ...]] = ("SMS", "USSD", "CP", "APP", "WEB", "WAP")
+
+# Status codes
+class StatusCode(IntEnum):
+    INACTIVE = 0
+    ACTIVE = 1
+    PENDING = 2
+    CANCELLED = 3
+
+# Charging status codes
+class ChargingStatus(IntEnum):
+    RENEWAL = 0
+    REGISTER = 1
+    PENDING_CONFIRM = 2
+    CANCEL = 3
+
+STATUS_BY_NAME: Final[Mapping[str, StatusCode]] = {m.name: m for m in StatusCode}
+CHARGING_STATUS_BY_NAME: Final[Mapping[str, ChargingStatus]] = {m.name: m for m in ChargingStatus}
+
+# Giữ tên cũ cho code đang tra theo dict
+STATUS_CODES = STATUS_BY_NAME
+CHARGING_STATUS = CHARGING_STATUS_BY_NAME
+
+
+@dataclass(frozen=True, slots=True)
+class MyIDSettings:
+    """Các giá trị có thể override qua env / .env"""
     # MPS Authentication
-    MPS_USERNAME: str = "your_username"
-    MPS_PASSWORD: str = "your_password"
-    
-    # Service IDs mapping
-    SERVICE_IDS: Dict[str, str] = {
-        "DAILY": "SERVICE_NAME_DAILY",
-        "WEEKLY": "SERVICE_NAME_WEEKLY", 
-        "MONTHLY": "SERVICE_NAME_MONTHLY",
-        "OTP": "SERVICE_NAME_OTP"
-    }
-    
-    # Package pricing (MMK)
-    PACKAGE_PRICES: Dict[str, int] = {
-        "DAILY": 149,
-        "WEEKLY": 599,
-        "MONTHLY": 1999,
-        "OTP": 99
-    }
-    
-    # Valid channels
-    VALID_CHANNELS: List[str] = ["SMS", "USSD", "CP", "APP", "WEB", "WAP"]
-    
-    # Status codes
-    STATUS_CODES: Dict[str, int] = {
-        "INACTIVE": 0,
-        "ACTIVE": 1, 
-        "PENDING": 2,
-        "CANCELLED": 3
-    }
-    
-    # Charging status codes
-    CHARGING_STATUS: Dict[str, int] = {
-        "RENEWAL": 0,
-        "REGISTER": 1,
-        "PENDING_CONFIRM": 2,
-        "CANCEL": 3
-    }
-    
+    MPS_USERNAME: str = os.getenv("MPS_USERNAME", "your_username")
+    MPS_PASSWORD: str = os.getenv("MPS_PASSWORD", "your_password")
+
     # Timeout settings
-    MPS_TIMEOUT: int = 30  # seconds
-    
+    MPS_TIMEOUT: int = int(os.getenv("MPS_TIMEOUT", 30))  # seconds
+
     # Logging
-    ENABLE_REQUEST_LOGGING: bool = True
-    LOG_LEVEL: str = "INFO"
-    
-    class Config:
-        env_file = ".env"
+    ENABLE_REQUEST_LOGGING: bool = os.getenv("ENABLE_REQUEST_LOGGING", "true").lower() in ("1", "true", "yes")
+    LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
 
 # Global settings instance
 myid_settings = MyIDSettings()
 
+# Bảng tra cứu đã chuẩn hóa upper-case, build một lần khi import
+_PACKAGE_PRICES_U = {k.upper(): v for k, v in PACKAGE_PRICES.items()}
+_SERVICE_IDS_U = {k.upper(): v for k, v in SERVICE_IDS.items()}
+_VALID_CHANNELS_SET = frozenset(c.upper() for c in VALID_CHANNELS)
+
 # Helper functions
 def get_package_price(package_name: str) -> int:
     """Get price for a package"""
-    return myid_settings.PACKAGE_PRICES.get(package_name.upper(), 0)
+    price = _PACKAGE_PRICES_U.get(package_name)
+    if price is None:
+        price = _PACKAGE_PRICES_U.get(package_name.upper(), 0)
+    return price
 
 def get_service_id(package_name: str) -> str:
     """Get service ID for a package"""
-    return myid_settings.SERVICE_IDS.get(package_name.upper(), package_name)
+    service_id = _SERVICE_IDS_U.get(package_name)
+    if service_id is None:
+        service_id = _SERVICE_IDS_U.get(package_name.upper(), package_name)
+    return service_id
 
 def is_valid_channel(channel: str) -> bool:
     """Check if channel is valid"""
-    return channel.upper() in myid_settings.VALID_CHANNELS
+    return channel in _VALID_CHANNELS_SET or channel.upper() in _VALID_CHANNELS_SET
 
 # Package configuration
 PACKAGE_CONFIGS = {
     "DAILY": {
         "name": "Daily Package",
         "duration_days": 1,
-        "price": 149,
+        "price": PackagePrice.DAILY,
         "description": "1 day unlimited access"
     },
     "WEEKLY": {
         "name": "Weekly Package", 
         "duration_days": 7,
-        "price": 599,
+        "price": PackagePrice.WEEKLY,
         "description": "7 days unlimited access"
     },
     "MONTHLY": {
         "name": "Monthly Package",
         "duration_days": 30,
-        "price": 1999,
+        "price": PackagePrice.MONTHLY,
         "description": "30 days unlimited access"
     },
     "OTP": {
         "name": "One-Time Package",
         "duration_days": 0,
-        "price": 99,
+        "price": PackagePrice.OTP,
         "description": "One-time purchase"
     }
 }
@@ -108,10 +131,18 @@ RESPONSE_MESSAGES = {
     "OTP_FAILED": "Mua goi that bai"
 }
 
+# (ACTION, success) -> message, tách sẵn từ RESPONSE_MESSAGES
+_RESP = {
+    (key.rsplit("_", 1)[0], key.endswith("_SUCCESS")): msg
+    for key, msg in RESPONSE_MESSAGES.items()
+}
+
 def get_response_message(action: str, success: bool = True) -> str:
     """Get localized response message"""
-    key = f"{action.upper()}_{'SUCCESS' if success else 'FAILED'}"
-    return RESPONSE_MESSAGES.get(key, "")
+    msg = _RESP.get((action, success))
+    if msg is None:
+        msg = _RESP.get((action.upper(), success), "")
+    return msg
 
 # Validation rules
 MSISDN_PATTERNS = {
@@ -125,19 +156,25 @@ TRANSACTION_ID_PATTERNS = {
     "RENEWAL": r"^04000002\d{14,20}$"
 }
 
+# Compile sẵn regex một lần khi import
+_MSISDN_RE = {k: re.compile(v) for k, v in MSISDN_PATTERNS.items()}
+_TXN_RE = {k: re.compile(v) for k, v in TRANSACTION_ID_PATTERNS.items()}
+
+# Channel -> key trong TRANSACTION_ID_PATTERNS
+_TXN_CHANNEL_KEYS = {
+    "SMS": "SMS",
+    "USSD": "USSD",
+    "CP": "RENEWAL"
+}
+
 def validate_msisdn(msisdn: str, country: str = "MYANMAR") -> bool:
     """Validate phone number format"""
-    import re
-    pattern = MSISDN_PATTERNS.get(country.upper(), MSISDN_PATTERNS["MYANMAR"])
-    return bool(re.match(pattern, msisdn))
+    pattern = _MSISDN_RE.get(country.upper(), _MSISDN_RE["MYANMAR"])
+    return bool(pattern.match(msisdn))
 
 def validate_transaction_id(transaction_id: str, channel: str) -> bool:
     """Validate transaction ID format"""
-    import re
-    if channel.upper() == "SMS":
-        return bool(re.match(TRANSACTION_ID_PATTERNS["SMS"], transaction_id))
-    elif channel.upper() == "USSD":
-        return bool(re.match(TRANSACTION_ID_PATTERNS["USSD"], transaction_id))
-    elif channel.upper() == "CP":
-        return bool(re.match(TRANSACTION_ID_PATTERNS["RENEWAL"], transaction_id))
-    return True  # Allow other formats
\ No newline at end of file
+    key = _TXN_CHANNEL_KEYS.get(channel.upper())
+    if key is None:
+        return True  # Allow other formats
+    return bool(_TXN_RE[key].match(transaction_id))
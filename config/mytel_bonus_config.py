@@ -1,5 +1,6 @@
 # config/mytel_bonus_config.py
 import os
+from types import MappingProxyType
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -11,16 +12,17 @@ class MytelBonusConfig:
     ENVIRONMENT = os.getenv("MYTEL_BONUS_ENV", "PRODUCTION")
     
     # Base URLs
-    # BASE_URL_UAT = "https://mytelapigw.mytel.com.mm/uat/vas-gw/"
+    BASE_URL_UAT = "https://mytelapigw.mytel.com.mm/uat/vas-gw/"
     # Production hiện dùng IP nội bộ theo Mytel cung cấp
     BASE_URL_PROD = "http://10.201.5.123:9350/vas-gw/"
     
+    # Resolve một lần khi import (ENVIRONMENT không đổi lúc runtime)
+    _BASE_URL = BASE_URL_PROD if ENVIRONMENT == "PRODUCTION" else BASE_URL_UAT
+    
     @classmethod
     def get_base_url(cls) -> str:
         """Get base URL based on environment"""
-        if cls.ENVIRONMENT == "PRODUCTION":
-            return cls.BASE_URL_PROD
-        return cls.BASE_URL_UAT
+        return cls._BASE_URL
     
     # Authentication credentials (production)
     USERNAME = os.getenv("MYTEL_BONUS_USERNAME", "HERO_SAGA")
@@ -32,7 +34,7 @@ class MytelBonusConfig:
     API_SEARCH = "api/v1/search"
     
     # Package codes for loyalty points
-    LOYALTY_PACKAGES = {
+    LOYALTY_PACKAGES = MappingProxyType({
         300: "LOYALTY_300",
         500: "LOYALTY_500",
         700: "LOYALTY_700",
@@ -43,7 +45,11 @@ class MytelBonusConfig:
         7000: "LOYALTY_7000",
         8000: "LOYALTY_8000",
         10000: "LOYALTY_10000"
-    }
+    })
+    _UNSUPPORTED_POINTS_MSG = (
+        "Unsupported loyalty points: {points}. "
+        f"Available: {list(LOYALTY_PACKAGES.keys())}"
+    )
     
     # Timeout settings
     REQUEST_TIMEOUT = 30  # seconds
@@ -62,9 +68,8 @@ class MytelBonusConfig:
         Raises:
             ValueError: If points amount is not supported
         """
-        if points not in cls.LOYALTY_PACKAGES:
-            raise ValueError(
-                f"Unsupported loyalty points: {points}. "
-                f"Available: {list(cls.LOYALTY_PACKAGES.keys())}"
-            )
-        return cls.LOYALTY_PACKAGES[points]
+        code = cls.LOYALTY_PACKAGES.get(points)
+        if code is None:
+            raise ValueError(cls._UNSUPPORTED_POINTS_MSG.format(points=points))
+        return code
+
@@ -1,6 +1,6 @@
 import os
 from dotenv import load_dotenv
-from datetime import timedelta, timezone
+from zoneinfo import ZoneInfo
 
 load_dotenv()
 
@@ -14,5 +14,16 @@ REDIS_HOST = "localhost"
 REDIS_PORT = 6381
 REDIS_DB = int(os.getenv("REDIS_DB", 0))
 
-MYANMAR_TZ = timezone(timedelta(hours=6, minutes=30))
+# Một instance ZoneInfo dùng chung cho toàn app (UTC+6:30, không DST)
+MYANMAR_TZ = ZoneInfo("Asia/Yangon")
 
+# /gameplay-stats đọc rollup gameplay_best_per_level thay vì GROUP BY gameplay_history.
+# Chỉ bật sau khi đã backfill rollup (POST /admin/gameplay/best-per-level/backfill)
+GAMEPLAY_STATS_FROM_ROLLUP = os.getenv("GAMEPLAY_STATS_FROM_ROLLUP", "0") == "1"
+
+# BXH period=all đọc leaderboard_best_per_level thay vì GROUP BY gameplay_history.
+# Chỉ bật sau khi đã backfill (POST /admin/leaderboard/best-per-level/backfill)
+LB_ALL_TIME_FROM_ROLLUP = os.getenv("LB_ALL_TIME_FROM_ROLLUP", "0") == "1"
+
+# Token cho các endpoint CMS/admin (header X-Admin-Token); chưa cấu hình thì mọi request bị từ chối
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
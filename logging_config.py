@@ -1,10 +1,22 @@
 # logging_config.py - Đúng theo thiết kế ban đầu
+import atexit
 import logging
 import logging.handlers
 import os
+import queue
 from datetime import datetime
 from pathlib import Path
 
+# Listener ghi log ở background thread, event loop chỉ enqueue record
+_queue_listener = None
+
+def _stop_queue_listener():
+    """Flush và dừng QueueListener (an toàn khi gọi nhiều lần)"""
+    global _queue_listener
+    if _queue_listener is not None:
+        _queue_listener.stop()
+        _queue_listener = None
+
 def setup_logging():
     """Cấu hình logging cho toàn bộ ứng dụng"""
     
@@ -52,9 +64,24 @@ def setup_logging():
     console_handler.setLevel(logging.INFO)
     console_handler.setFormatter(formatter)
     
-    # Thêm handlers
-    root_logger.addHandler(file_handler)
-    root_logger.addHandler(console_handler)
+    # Thêm handlers: root chỉ enqueue, QueueListener ghi file/console
+    global _queue_listener
+    # Lần start đầu mới đăng ký atexit; gọi lại setup_logging chỉ thay listener cũ,
+    # không đăng ký thêm handler trùng
+    if _queue_listener is None:
+        atexit.register(_stop_queue_listener)
+    _stop_queue_listener()
+
+    log_queue = queue.SimpleQueue()
+    root_logger.addHandler(logging.handlers.QueueHandler(log_queue))
+
+    _queue_listener = logging.handlers.QueueListener(
+        log_queue,
+        file_handler,
+        console_handler,
+        respect_handler_level=True
+    )
+    _queue_listener.start()
     
     # Cấu hình specific loggers
     logging.getLogger("uvicorn.access").setLevel(logging.INFO)
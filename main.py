@@ -1,31 +1,28 @@
 # main.py - Updated with Gameplay History API
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from routers import (
     status, statement, spin, leaderboard, shop, myid_web_charge,
     gameplay_history, admin_leaderboard, terms_and_conditions  # NEW: Gameplay history router
 )
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.cron import CronTrigger
-from datetime import datetime, timedelta, timezone
-from database import get_db
-from sqlalchemy.ext.asyncio import AsyncSession
-from tasks.leaderboard_etl import snapshot_leaderboard
+from datetime import datetime
+from config_sys import MYANMAR_TZ
 from logging_config import setup_logging
 import logging
-import traceback
+import time
 from scheduler_setup import start_scheduler, shutdown_scheduler
+from services.myid_crypto import preload_keys
 
 # Setup comprehensive logging
 log_file = setup_logging()
 logger = logging.getLogger(__name__)
 
-MYANMAR_TZ = timezone(timedelta(hours=6, minutes=30))
-
 app = FastAPI(
     title="Hero Saga API",
     description="Game API with MyID Integration + Shop + Dashboard + Gameplay History",
-    version="2.4.0"  # Updated version
+    version="2.4.0",  # Updated version
+    default_response_class=ORJSONResponse  # serialize response bằng orjson (C) thay cho json stdlib
 )
 
 # ====== CORS middleware ======
@@ -38,38 +35,37 @@ app.add_middleware(
 )
 
 # ====== Middleware to log all requests ======
+SENSITIVE_HEADERS = frozenset({"authorization", "access-token", "auth"})
+
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
-    start_time = datetime.now()
-    
-    # Log request
-    logger.info(f"REQUEST: {request.method} {request.url}")
-    logger.info(f"Client IP: {request.client.host if request.client else 'unknown'}")
+    start = time.perf_counter()
     
-    # Log headers (mask sensitive data)
-    headers_to_log = {}
-    for k, v in request.headers.items():
-        if k.lower() in ['authorization', 'access-token', 'auth']:
+    # Log request (chỉ build header dict khi INFO đang bật)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("REQUEST: %s %s", request.method, request.url)
+        logger.info("Client IP: %s", request.client.host if request.client else "unknown")
+        
+        # Log headers (mask sensitive data)
+        # Starlette đã lowercase key, chỉ cần mask các key nhạy cảm có mặt
+        headers_to_log = dict(request.headers)
+        for k in SENSITIVE_HEADERS.intersection(headers_to_log):
+            v = headers_to_log[k]
             headers_to_log[k] = f"{v[:10]}...***" if len(v) > 10 else "***"
-        else:
-            headers_to_log[k] = v
-    logger.info(f"Headers: {headers_to_log}")
+        logger.info("Headers: %s", headers_to_log)
     
     try:
         response = await call_next(request)
         
         # Log response
-        process_time = (datetime.now() - start_time).total_seconds()
-        logger.info(f"RESPONSE: {response.status_code} - {process_time:.3f}s")
+        process_time = time.perf_counter() - start
+        logger.info("RESPONSE: %s - %.3fs", response.status_code, process_time)
         
         return response
-    except Exception as e:
-        # Log errors
-        process_time = (datetime.now() - start_time).total_seconds()
-        logger.error(f"ERROR in request {request.method} {request.url}")
-        logger.error(f"Error: {str(e)}")
-        logger.error(f"Traceback: {traceback.format_exc()}")
-        logger.error(f"Process time: {process_time:.3f}s")
+    except Exception:
+        # Log errors (traceback chỉ format khi handler thực sự ghi)
+        process_time = time.perf_counter() - start
+        logger.exception("ERROR in request %s %s (%.3fs)", request.method, request.url, process_time)
         raise
 
 # ====== Include API routers ======
@@ -84,45 +80,36 @@ app.include_router(admin_leaderboard.router, prefix="/herosaga", tags=["admin"])
 app.include_router(terms_and_conditions.router, prefix="/herosaga")
 
 # ====== Health check ======
+HEALTH_PAYLOAD = {
+    "status": "healthy", 
+    "services": ["game", "myid", "shop", "dashboard", "gameplay", "revenue"],
+    "version": "2.4.0"
+}
+
 @app.get("/api/health")
 def health_check():
-    logger.info("Health check requested")
-    return {
-        "status": "healthy", 
-        "services": ["game", "myid", "shop", "dashboard", "gameplay", "revenue"],
-        "version": "2.4.0"
-    }
+    logger.debug("Health check requested")
+    return HEALTH_PAYLOAD
+
+# Timestamp độ phân giải 1s -> chỉ build lại payload khi sang giây mới
+_CACHED_TS = {"t": -1, "payload": None}
+
+def _current_ts() -> dict:
+    tick = int(time.time())
+    if tick != _CACHED_TS["t"]:
+        now = datetime.fromtimestamp(tick, MYANMAR_TZ)
+        _CACHED_TS["payload"] = {
+            "timestamp": tick,
+            "datetime": now.isoformat()
+        }
+        _CACHED_TS["t"] = tick
+    return _CACHED_TS["payload"]
 
 @app.get("/api/server-timestamp")
 def server_timestamp():
-    now = datetime.now(MYANMAR_TZ)
-    logger.info(f"Server timestamp requested: {now.isoformat()}")
-    return {
-        "timestamp": int(now.timestamp()),
-        "datetime": now.isoformat()
-    }
-
-# ====== Scheduler setup ======
-scheduler = AsyncIOScheduler(timezone=MYANMAR_TZ)
-
-async def snapshot_job(period: str):
-    logger.info(f"Starting {period} snapshot job")
-    try:
-        async for db in get_db():
-            await snapshot_leaderboard(db, period)
-        logger.info(f"Completed {period} snapshot job successfully")
-    except Exception as e:
-        logger.error(f"Error in {period} snapshot job: {str(e)}")
-        logger.error(traceback.format_exc())
-
-# Daily snapshot: 00:05 Myanmar time
-scheduler.add_job(snapshot_job, CronTrigger(hour=0, minute=5), args=["daily"])
-
-# Weekly snapshot: Monday 00:10 Myanmar time
-scheduler.add_job(snapshot_job, CronTrigger(day_of_week="mon", hour=0, minute=10), args=["weekly"])
-
-# Monthly snapshot: Day 1 00:20 Myanmar time
-scheduler.add_job(snapshot_job, CronTrigger(day=1, hour=0, minute=20), args=["monthly"])
+    payload = _current_ts()
+    logger.debug("Server timestamp requested: %s", payload["datetime"])
+    return payload
 
 @app.on_event("startup")
 async def startup_event():
@@ -133,16 +120,19 @@ async def startup_event():
     logger.info(f"Startup time: {datetime.now(MYANMAR_TZ).isoformat()}")
     logger.info(f"Python version: {__import__('sys').version}")
     logger.info(f"FastAPI running on port 8113")
-    
+
+    # Nạp sẵn RSA key MPS cho các gói (lượt charge đầu không phải đọc/parse PEM)
     try:
-        scheduler.start()
-        logger.info("Scheduler started successfully")
-        logger.info("Scheduled jobs:")
-        for job in scheduler.get_jobs():
-            logger.info(f"  - {job.id}: {job.next_run_time}")
-    except Exception as e:
-        logger.error(f"Error starting scheduler: {str(e)}")
-        logger.error(traceback.format_exc())
+        count = preload_keys({p["sub_service"] for p in myid_web_charge.PACKAGE_CONFIG.values()})
+        logger.info(f"Preloaded MPS keys for {count} sub-services")
+    except Exception:
+        logger.exception("Error preloading MPS keys")
+
+    # Scheduler duy nhất của app (scheduler_setup.py): mlog BXH, snapshot admin, partition
+    try:
+        start_scheduler()
+    except Exception:
+        logger.exception("Error starting leaderboard scheduler")
     
     logger.info("="*50)
 
@@ -154,20 +144,14 @@ async def shutdown_event():
     logger.info(f"Shutdown time: {datetime.now(MYANMAR_TZ).isoformat()}")
     
     try:
-        scheduler.shutdown()
-        logger.info("Scheduler stopped successfully")
-    except Exception as e:
-        logger.error(f"Error stopping scheduler: {str(e)}")
+        shutdown_scheduler()
+    except Exception:
+        logger.exception("Error stopping leaderboard scheduler")
+
+    try:
+        await myid_web_charge.close_mps_client()
+    except Exception:
+        logger.exception("Error closing MPS HTTP client")
     
     logger.info("Application shutdown complete")
     logger.info("="*50)
-    
-@app.on_event("startup")
-async def startup_event():
-    logger.info("Application starting up...")
-    start_scheduler()
-
-@app.on_event("shutdown")
-async def shutdown_event():
-    logger.info("Application shutting down...")
-    shutdown_scheduler()
\ No newline at end of file
@@ -1,14 +1,38 @@
 from sqlalchemy import (
     Column, BigInteger, String, Enum, DateTime, ForeignKey,
-    Integer, UniqueConstraint, Date, Computed, Float
+    Integer, UniqueConstraint, Date, Computed, Float, Index
 )
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy.dialects.mysql import LONGTEXT, SMALLINT
 from database import Base
-from datetime import datetime
+from utils import json_utils
 import enum
 
+
+class JSONText(TypeDecorator):
+    """
+    LONGTEXT chứa JSON, encode/decode bằng orjson
+    - Ghi: nhận dict/list (str đã encode thì giữ nguyên)
+    - Đọc: trả về dict/list, JSON lỗi -> None
+    """
+    impl = LONGTEXT
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, str):
+            return value
+        return json_utils.dumps(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        try:
+            return json_utils.loads(value)
+        except json_utils.JSONDecodeError:
+            return None
+
 # --- Enums giữ lại nếu dùng cho log hoặc API ---
 class ChannelEnum(str, enum.Enum):
     SMS = "SMS"
@@ -43,11 +67,23 @@ class User(Base):
     display_name = Column(String(100), nullable=False)
     country = Column(String(2), nullable=True)
     api_token = Column(String(64), unique=True, nullable=True)
+    # SĐT đã ẩn cho BXH (giữ 3 số đầu + 3 số cuối), MySQL tự sinh khi ghi msisdn
+    # -> API chỉ SELECT cột này, không cắt chuỗi từng row trong Python
+    #   ALTER TABLE users ADD COLUMN masked_msisdn VARCHAR(20) GENERATED ALWAYS AS (...) STORED;
+    masked_msisdn = Column(
+        String(20),
+        Computed(
+            "CASE WHEN msisdn IS NULL OR CHAR_LENGTH(msisdn) <= 6 THEN '****' "
+            "ELSE CONCAT(LEFT(msisdn, 3), '***', RIGHT(msisdn, 3)) END",
+            persisted=True
+        ),
+        comment="SĐT đã ẩn (tự động sinh từ msisdn)"
+    )
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
-    # Relationships
-    gameplays = relationship("GameplayHistory", back_populates="user", lazy="select")
+    # Relationships: không lazy-load cả lịch sử chơi; cần thì select(GameplayHistory)...limit(N)
+    gameplays = relationship("GameplayHistory", back_populates="user", lazy="raise_on_sql")
 
 
 class GameStatement(Base):
@@ -59,6 +95,11 @@ class GameStatement(Base):
     file_name = Column(String(255), nullable=True)
     payload_version = Column(Integer, nullable=True, default=1)
     statement_json = Column(LONGTEXT, nullable=False)
+    # Tách sẵn từ statement_json khi ghi để BXH không phải parse JSON mỗi row
+    # Backfill: UPDATE game_statements SET name = statement_json->>'$.name',
+    #           avatar = statement_json->'$.avatar'
+    name = Column(String(100), nullable=True, comment="Tên hiển thị (từ statement_json.name)")
+    avatar = Column(SMALLINT, nullable=True, comment="Avatar (từ statement_json.avatar)")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
@@ -79,8 +120,8 @@ class GameStatementSummary(Base):
     achie_count = Column(Integer, default=0)
     server_last_login = Column(DateTime, nullable=True)
     spin_count = Column(Integer, default=0)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
 
 
 class SpinReward(Base):
@@ -92,8 +133,8 @@ class SpinReward(Base):
     amount = Column(Integer, nullable=False, default=1)
     weight = Column(Integer, nullable=False, default=1)
     position = Column(SMALLINT(unsigned=True), nullable=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
-    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime, server_default=func.now())
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
 
 
 class LeaderboardHistory(Base):
@@ -102,6 +143,13 @@ class LeaderboardHistory(Base):
     Bổ sung 6 cột mới để hỗ trợ xếp hạng đa tiêu chí
     """
     __tablename__ = "leaderboard_history"
+    __table_args__ = (
+        # Đọc BXH: WHERE period=? AND date=? ORDER BY rank / scores
+        Index("ix_lb_period_date_scores", "period", "date", "scores"),
+        Index("ix_lb_period_date_rank", "period", "date", "rank"),
+        # Khóa cho ON DUPLICATE KEY UPDATE trong snapshot, chống trùng khi chạy lại
+        UniqueConstraint("user_id", "period", "date", name="uq_lb_user_period_date"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
@@ -117,6 +165,10 @@ class LeaderboardHistory(Base):
     avg_stars = Column(Float, default=0.0, comment="Trung bình số sao")
     total_duration = Column(BigInteger, default=0, comment="Tổng thời gian chơi (giây)")
     first_played_at = Column(DateTime, nullable=True, comment="Thời gian chơi đầu tiên")
+    # Tổng sao / số lượt có sao: job mlog cộng dồn 2 cột này rồi suy ra avg_stars chính xác
+    # (lượt chơi stars NULL không tính vào trung bình, giống AVG(stars) lúc rebuild)
+    stars_sum = Column(BigInteger, default=0, comment="Tổng số sao")
+    stars_count = Column(Integer, default=0, comment="Số lượt chơi có sao")
 
     # Thứ hạng
     rank = Column(Integer, default=0, comment="Thứ hạng đã tính")
@@ -126,12 +178,66 @@ class LeaderboardHistory(Base):
     level_played = Column(Integer, default=0)
 
 
+class LeaderboardSnapshot(Base):
+    """
+    BXH "best per level" đã chốt cho các kỳ đã kết thúc (dữ liệu không đổi)
+    Cùng công thức với /admin/leaderboard/full: mỗi level chỉ tính điểm cao nhất
+    """
+    __tablename__ = "leaderboard_snapshot"
+    __table_args__ = (
+        UniqueConstraint("period", "date", "user_id", name="uq_lb_snapshot_period_date_user"),
+        Index("ix_lb_snapshot_period_date_scores", "period", "date", "total_scores"),
+    )
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    period = Column(String(20), nullable=False)
+    date = Column(Date, nullable=False, comment="Ngày bắt đầu kỳ")
+    user_id = Column(BigInteger, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    total_scores = Column(Integer, nullable=False, default=0)
+    games_played = Column(Integer, nullable=False, default=0)
+    max_level = Column(Integer, nullable=False, default=0)
+    avg_stars = Column(Float, nullable=False, default=0.0)
+    total_duration = Column(BigInteger, nullable=False, default=0)
+    created_at = Column(DateTime, server_default=func.now())
+
+
 class GameplayHistory(Base):
     """
     Simplified GameplayHistory model theo plan mới
     Loại bỏ các trường không cần thiết, tập trung vào dữ liệu core
     """
     __tablename__ = "gameplay_history"
+    __table_args__ = (
+        Index("ix_gameplay_started_date_user", "started_date", "user_id"),
+        # BXH: game_mode = ? AND started_at range, GROUP BY user_id, level_code,
+        # aggregate score/stars/duration/level_num -> covering index, không phải đọc lại row
+        # (level_num là cột STORED nên index được; thiếu nó thì best_per_level_agg
+        # của ETL/admin phải lookup PK từng dòng chỉ để lấy MAX(level_num))
+        # MySQL không có INCLUDE / partial index: cột phụ nối cuối key, nhánh
+        # period=all đọc leaderboard_best_per_level nên không cần index riêng
+        #   ALTER TABLE gameplay_history DROP INDEX ix_gameplay_lb_covering,
+        #     ADD INDEX ix_gameplay_lb_covering (game_mode, started_at, user_id,
+        #       level_code, score, stars, duration_seconds, level_num), ALGORITHM=INPLACE, LOCK=NONE;
+        Index(
+            "ix_gameplay_lb_covering",
+            "game_mode", "started_at", "user_id", "level_code",
+            "score", "stars", "duration_seconds", "level_num"
+        ),
+        # Keyset pagination ORDER BY started_at DESC, id DESC (InnoDB tự gắn PK id
+        # vào cuối secondary index nên (started_at) đã đủ cho (started_at, id))
+        Index("ix_gameplay_started_at", "started_at"),
+        Index("ix_gameplay_user_started_at", "user_id", "started_at"),
+        # play_attempt tính bằng INSERT ... SELECT MAX()+1: unique để 2 lượt ghi
+        # đồng thời không ra cùng số, lượt thua bị lỗi duplicate và thử lại
+        UniqueConstraint(
+            "user_id", "level_code", "play_attempt", name="uq_gameplay_user_level_attempt"
+        ),
+        # BXH theo màn: level_code = ? GROUP BY user_id, MAX(score)/MAX(stars)/MIN(duration)
+        Index(
+            "ix_gameplay_level_user_score",
+            "level_code", "user_id", "score", "stars", "duration_seconds"
+        ),
+    )
 
     id = Column(BigInteger, primary_key=True, autoincrement=True)
     user_id = Column(BigInteger, ForeignKey("users.id", ondelete="CASCADE", onupdate="CASCADE"), nullable=False)
@@ -139,6 +245,18 @@ class GameplayHistory(Base):
 
     # Thông tin màn chơi
     level_code = Column(String(50), nullable=True, comment="Mã màn chơi (level_001...)")
+    level_num = Column(
+        Integer,
+        # Chỉ CAST khi đuôi toàn số (tối đa 9 chữ số, vừa INT): mã kiểu level_boss
+        # CAST sẽ báo "Truncated incorrect INTEGER value" -> strict mode làm hỏng INSERT
+        Computed(
+            "CASE WHEN level_code REGEXP '^level_[0-9]{1,9}$' "
+            "THEN CAST(SUBSTRING_INDEX(level_code, '_', -1) AS UNSIGNED) END",
+            persisted=True
+        ),
+        nullable=True,
+        comment="Số level (tự động sinh từ level_code, NULL nếu không phải level_xxx)"
+    )
     play_attempt = Column(Integer, nullable=False, default=1, comment="Số lần người chơi chơi màn này")
 
     # Kết quả
@@ -151,29 +269,123 @@ class GameplayHistory(Base):
     duration_seconds = Column(Integer, nullable=True, comment="Thời gian chơi (giây)")
 
     # Items (JSON as TEXT for compatibility)
-    items_start = Column(LONGTEXT, nullable=True, comment="JSON: Vật phẩm có lúc bắt đầu")
-    items_used = Column(LONGTEXT, nullable=True, comment="JSON: Vật phẩm tiêu hao")
-    items_earned = Column(LONGTEXT, nullable=True, comment="JSON: Vật phẩm nhặt được")
+    items_start = Column(JSONText, nullable=True, comment="JSON: Vật phẩm có lúc bắt đầu")
+    items_used = Column(JSONText, nullable=True, comment="JSON: Vật phẩm tiêu hao")
+    items_earned = Column(JSONText, nullable=True, comment="JSON: Vật phẩm nhặt được")
 
     # Metadata
-    game_mode = Column(String(50), default='normal', comment="Chế độ chơi: normal, event")
+    # ENUM 1 byte thay VARCHAR(50): key ix_gameplay_lb_covering (đứng đầu là game_mode) gọn hơn,
+    # giá trị lạ bị MySQL chặn ngay khi ghi (API cũng đã validate ^(normal|event)$)
+    game_mode = Column(
+        Enum('normal', 'event', name='game_mode'),
+        default='normal',
+        server_default='normal',
+        comment="Chế độ chơi: normal, event"
+    )
 
     # Timestamp
-    created_at = Column(DateTime, nullable=False, default=datetime.utcnow, comment="Thời gian ghi log")
+    created_at = Column(DateTime, nullable=False, server_default=func.now(), comment="Thời gian ghi log")
 
-    # Computed column
+    # Computed column (STORED để index được, không tính lại mỗi lần đọc);
+    # lọc theo ngày dùng ix_gameplay_started_date_user (started_date là cột đầu)
     started_date = Column(
         Date,
-        Computed("DATE(started_at)"),
+        Computed("DATE(started_at)", persisted=True),
         nullable=False,
         comment="Ngày chơi (tự động sinh từ started_at)"
     )
 
-    # Relationship
-    user = relationship("User", back_populates="gameplays", lazy="joined")
+    # Relationship: không tự JOIN users; cần user thì selectinload(GameplayHistory.user)
+    user = relationship("User", back_populates="gameplays", lazy="raise")
 
     def __repr__(self):
         return (
             f"<GameplayHistory(user_id={self.user_id}, level={self.level_code}, "
             f"attempt={self.play_attempt}, score={self.score})>"
         )
+
+
+class GameplayBestPerLevel(Base):
+    """
+    Rollup điểm tốt nhất mỗi (user, ngày, level), cập nhật ngay khi log gameplay
+    -> thống kê theo kỳ chỉ đọc range nhỏ thay vì aggregate lại gameplay_history
+    Giữ theo ngày (không gộp all-time) để thống kê daily/weekly/monthly vẫn đúng kỳ
+
+    Thứ tự triển khai:
+    1. Tạo bảng, deploy code (log gameplay bắt đầu upsert vào rollup)
+    2. Backfill dữ liệu cũ: POST /admin/gameplay/best-per-level/backfill
+       (backfill_gameplay_best_per_level, idempotent, chạy lại được)
+    3. Bật GAMEPLAY_STATS_FROM_ROLLUP=1 -> /gameplay-stats chuyển sang đọc rollup
+    """
+    __tablename__ = "gameplay_best_per_level"
+
+    user_id = Column(BigInteger, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    played_date = Column(Date, primary_key=True)
+    level_code = Column(String(50), primary_key=True)
+    best_score = Column(Integer, nullable=False, default=0)
+    best_coins = Column(Integer, nullable=False, default=0)
+    best_stars = Column(SMALLINT, nullable=True)
+    best_duration = Column(Integer, nullable=True)
+    last_played_at = Column(DateTime, nullable=False)
+
+
+class LeaderboardBestPerLevel(Base):
+    """
+    Điểm tốt nhất all-time mỗi (user, level) ở game_mode normal, cập nhật ngay khi log
+    gameplay -> BXH period=all gộp bảng này (users × levels) thay vì GROUP BY lại
+    toàn bộ gameplay_history mỗi request
+
+    Thứ tự triển khai:
+    1. Tạo bảng, deploy code (log gameplay bắt đầu upsert vào bảng)
+    2. Backfill dữ liệu cũ: POST /admin/leaderboard/best-per-level/backfill
+       (backfill_leaderboard_best_per_level, idempotent, chạy lại được)
+    3. Bật LB_ALL_TIME_FROM_ROLLUP=1 -> BXH period=all chuyển sang đọc bảng này
+    """
+    __tablename__ = "leaderboard_best_per_level"
+
+    user_id = Column(BigInteger, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    level_code = Column(String(50), primary_key=True)
+    # max_level = MAX(level_num) theo số, không MAX(level_code) kiểu chuỗi ("level_9" > "level_10")
+    level_num = Column(
+        Integer,
+        # Chỉ CAST khi đuôi toàn số (tối đa 9 chữ số, vừa INT): mã kiểu level_boss
+        # CAST sẽ báo "Truncated incorrect INTEGER value" -> strict mode làm hỏng INSERT
+        Computed(
+            "CASE WHEN level_code REGEXP '^level_[0-9]{1,9}$' "
+            "THEN CAST(SUBSTRING_INDEX(level_code, '_', -1) AS UNSIGNED) END",
+            persisted=True
+        ),
+        nullable=True,
+        comment="Số level (tự động sinh từ level_code, NULL nếu không phải level_xxx)"
+    )
+    best_score = Column(Integer, nullable=False, default=0)
+    best_stars = Column(SMALLINT, nullable=True)
+    best_duration = Column(Integer, nullable=True)
+
+
+class GameplayHistoryLog(Base):
+    """
+    Change-log (mlog) các lượt chơi mới, ghi cùng transaction với gameplay_history
+    Job apply_leaderboard_mlog gộp delta vào leaderboard_history theo lô rồi xóa các dòng
+    đã áp dụng -> chi phí cập nhật BXH kỳ tỉ lệ với số lượt chơi mới, không phải toàn bảng
+
+    Thứ tự triển khai:
+    1. Tạo bảng, deploy code (log gameplay bắt đầu ghi mlog, job mlog chạy mỗi vài phút)
+    2. POST /admin/leaderboard/seed-current: tính lại các kỳ đang chạy từ gameplay_history
+    3. Các kỳ cũ (nếu cần): POST /admin/leaderboard/backfill
+    Rebuild (snapshot_leaderboard) giữ lock chung với job mlog và tự xóa các dòng mlog
+    của kỳ nên chạy lúc nào cũng không bị cộng trùng
+    """
+    __tablename__ = "gameplay_history_mlog"
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    gameplay_id = Column(BigInteger, nullable=False, comment="gameplay_history.id")
+    user_id = Column(BigInteger, nullable=False)
+    level_code = Column(String(50), nullable=True)
+    score = Column(Integer, nullable=False, default=0)
+    coins_earned = Column(Integer, nullable=False, default=0)
+    stars = Column(SMALLINT, nullable=True)
+    duration_seconds = Column(Integer, nullable=True)
+    started_at = Column(DateTime, nullable=False)
+    dmltype = Column(String(1), nullable=False, default="I", comment="I = insert")
+    inserted_at = Column(DateTime, nullable=False, server_default=func.now())
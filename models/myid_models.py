@@ -3,6 +3,7 @@ from sqlalchemy import (
     Column, BigInteger, String, DateTime, Integer, 
     SmallInteger, UniqueConstraint, Text, Enum
 )
+from sqlalchemy import insert
 from sqlalchemy.sql import func
 from database import Base
 from datetime import datetime
@@ -11,12 +12,14 @@ from datetime import datetime
 class MyIDCustomer(Base):
     """Bảng khách hàng MyID đang hoạt động"""
     __tablename__ = "myid_customers"
+    # Unique (msisdn, package_name) là index tra cứu chính: lookup theo cặp là 1 lần
+    # seek, lookup chỉ theo msisdn dùng prefix trái -> không cần index riêng cho msisdn
     __table_args__ = (
         UniqueConstraint('msisdn', 'package_name', name='uq_myid_customer_msisdn_package'),
     )
 
     id = Column(BigInteger, primary_key=True, autoincrement=True)
-    msisdn = Column(String(20), nullable=False, index=True, comment="Số điện thoại")
+    msisdn = Column(String(20), nullable=False, comment="Số điện thoại")
     info = Column(String(100), default="DK", comment="Mã gói cước (DK, FT, etc)")
     create_date = Column(DateTime, nullable=False, comment="Ngày tạo")
     last_update = Column(
@@ -46,13 +49,18 @@ class MyIDCustomer(Base):
 class MyIDCustomerHistory(Base):
     """Lịch sử giao dịch MyID"""
     __tablename__ = "myid_customer_history"
+    # Bảng append-only, chỉ scan theo khoảng -> nén trang để giảm I/O
+    __table_args__ = {
+        "mysql_row_format": "COMPRESSED",
+        "mysql_key_block_size": "8",
+    }
 
     id = Column(BigInteger, primary_key=True, autoincrement=True)
     msisdn = Column(String(20), nullable=False, index=True, comment="Số điện thoại")
-    info = Column(String(100), default="DK", comment="Mã gói cước")
+    info = Column(String(30), default="DK", comment="Mã gói cước (tên gói / HUY / OTP)")
     create_date = Column(DateTime, nullable=False, comment="Ngày tạo")
     last_update = Column(DateTime, nullable=False, default=datetime.now, onupdate=datetime.now)
-    channel = Column(String(20), default="0", comment="Kênh đăng ký/hủy/gia hạn")
+    channel = Column(String(10), default="0", comment="Kênh đăng ký/hủy/gia hạn")
     current_charged_date = Column(DateTime, nullable=True)
     next_charge_date = Column(DateTime, nullable=True)
     package_name = Column(String(30), nullable=False, index=True)
@@ -61,7 +69,11 @@ class MyIDCustomerHistory(Base):
     transaction_id = Column(String(100), nullable=True, index=True, comment="ID giao dịch từ MPS")
     mps_command = Column(String(20), nullable=True, comment="Lệnh từ MPS (YES, OFF, 1, 0, MONFEE)")
     created_at = Column(DateTime, server_default=func.now())
-    action = Column(String(20), nullable=True, comment="register/renew/cancel/one_time")
+    action = Column(
+        Enum('register', 'cancel', 'renew', 'one_time', name='history_action'),
+        nullable=True,
+        comment="register/renew/cancel/one_time"
+    )
     result = Column(SmallInteger, nullable=False, default=0, comment="0=success,1=failed")
 
 
@@ -114,4 +126,8 @@ class MyIDLogCharging(Base):
     mode = Column(String(20), default="REAL", comment="REAL hoặc PROMOTION")
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
-    is_success = Column(SmallInteger, default=0, comment="0:Success, 1:Failed")
\ No newline at end of file
+    is_success = Column(SmallInteger, default=0, comment="0:Success, 1:Failed")
+
+
+# Core INSERT dựng sẵn một lần; execute(stmt, [dict, ...]) dùng insertmanyvalues của SA 2.0
+INSERT_LOG_CHARGING_STMT = insert(MyIDLogCharging)
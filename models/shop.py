@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, DECIMAL, Boolean, TIMESTAMP
+from sqlalchemy import Column, Integer, String, DECIMAL, Boolean, TIMESTAMP, cast
+from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.sql import func
 from database import Base
 
@@ -15,12 +16,18 @@ class ShopItem(Base):
     created_at = Column(TIMESTAMP, default=func.now())
     updated_at = Column(TIMESTAMP, default=func.now(), onupdate=func.now())
 
-    @property
+    # hybrid: dùng được cả trên instance lẫn trong SQL (WHERE / ORDER BY final_amount)
+    @hybrid_property
     def final_amount(self):
         """Tính giá sau khi giảm giá"""
         return int(self.base_amount * (1 - self.sales_percent / 100))
+
+    @final_amount.expression
+    def final_amount(cls):
+        # TRUNCATE cho khớp int() bên Python (cắt phần thập phân, không làm tròn)
+        return cast(func.truncate(cls.base_amount * (100 - cls.sales_percent) / 100, 0), Integer)
     
-    @property 
+    @hybrid_property
     def on_sale(self):
         """Item có đang sale không"""
-        return self.sales_percent > 0
\ No newline at end of file
+        return self.sales_percent > 0
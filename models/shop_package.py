@@ -30,19 +30,3 @@ class ShopPackage(Base):
     sort_order = Column(Integer, default=0, comment="Thứ tự sắp xếp")
     created_at = Column(TIMESTAMP, default=func.now())
     updated_at = Column(TIMESTAMP, default=func.now(), onupdate=func.now())
-    
-    def to_dict(self):
-        """Convert to dictionary for API response"""
-        return {
-            "id": self.id,
-            "package_name": self.package_name,
-            "package_type": self.package_type.value if isinstance(self.package_type, PackageType) else self.package_type,
-            "duration_days": self.duration_days,
-            "price": self.price,
-            "benefits": self.benefits,
-            "description": self.description,
-            "is_active": self.is_active,
-            "sort_order": self.sort_order,
-            "created_at": self.created_at.isoformat() if self.created_at else None,
-            "updated_at": self.updated_at.isoformat() if self.updated_at else None
-        }
\ No newline at end of file
@@ -1,34 +1,47 @@
 # routers/admin_leaderboard.py
 from fastapi import APIRouter, Depends, Query, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import func, and_, select as sa_select, case, cast, Integer
+from sqlalchemy import select as sa_select
 from datetime import datetime, date, timedelta
 from database import get_db
-from tasks.leaderboard_etl import snapshot_leaderboard, backfill_leaderboard
-from models.models import GameplayHistory, User, GameStatement
+from tasks.leaderboard_etl import (
+    snapshot_leaderboard, backfill_leaderboard, seed_current_periods, best_per_level_agg,
+    snapshot_best_per_level,
+    backfill_gameplay_best_per_level, backfill_leaderboard_best_per_level
+)
+from models.models import User, LeaderboardSnapshot
+from utils.redis_cache import cache_get_json, cache_set_json
+from utils.period_utils import period_bounds
+from utils.profile_helper import fetch_profiles, DEFAULT_PROFILE
+from utils.auth_helper import require_admin
 import logging
-import json
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-def extract_name(statement_json: str) -> str:
-    """Lấy name từ statement_json"""
-    try:
-        data = json.loads(statement_json) if isinstance(statement_json, str) else (statement_json or {})
-        return data.get("name", "Player")
-    except Exception:
-        return "Player"
 
-def extract_avatar(statement_json: str) -> int:
-    """Lấy avatar từ statement_json"""
-    try:
-        data = json.loads(statement_json) if isinstance(statement_json, str) else (statement_json or {})
-        return data.get("avatar", 0)
-    except Exception:
-        return 0
+# TTL cache BXH admin: kỳ còn đang chạy thì ngắn, kỳ đã kết thúc thì dữ liệu không đổi
+LB_CACHE_TTL_CURRENT = 30
+LB_CACHE_TTL_PAST = 3600
+
+async def _best_snapshot_source(db: AsyncSession, period: str, start_date: date, start_dt, end_dt):
+    """
+    Subquery đọc leaderboard_snapshot của kỳ (chỉ đọc)
+    Kỳ chưa được chốt (job snapshot_finished_periods / POST snapshot-best) hoặc không có
+    lượt chơi -> aggregate trực tiếp từ gameplay_history
+    """
+    snap = LeaderboardSnapshot
+    exists = await db.execute(
+        sa_select(snap.id).where(snap.period == period, snap.date == start_date).limit(1)
+    )
+    if exists.first() is None:
+        return best_per_level_agg(start_dt, end_dt)
+    return sa_select(
+        snap.user_id, snap.total_scores, snap.games_played,
+        snap.max_level, snap.avg_stars, snap.total_duration
+    ).where(snap.period == period, snap.date == start_date).subquery()
 
-@router.post("/admin/leaderboard/snapshot")
+@router.post("/admin/leaderboard/snapshot", dependencies=[Depends(require_admin)])
 async def admin_snapshot_leaderboard(
     period: str = Query(..., regex="^(daily|weekly|monthly)$"),
     date_str: str = Query(None, description="YYYY-MM-DD, default today"),
@@ -58,7 +71,56 @@ async def admin_snapshot_leaderboard(
         logger.error(f"Error in snapshot: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.post("/admin/leaderboard/backfill")
+@router.post("/admin/leaderboard/seed-current", dependencies=[Depends(require_admin)])
+async def admin_seed_current_leaderboard(db: AsyncSession = Depends(get_db)):
+    """
+    Tính lại BXH daily/weekly/monthly đang chạy từ gameplay_history
+    Chạy 1 lần sau khi deploy gameplay_history_mlog (trước đó kỳ hiện tại chỉ có lượt chơi mới)
+    """
+    try:
+        count = await seed_current_periods(db)
+        return {
+            "status": "success",
+            "message": "Current periods rebuilt",
+            "records_processed": count
+        }
+    except Exception as e:
+        logger.error(f"Error seeding current leaderboard periods: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/admin/leaderboard/snapshot-best", dependencies=[Depends(require_admin)])
+async def admin_snapshot_best_per_level(
+    period: str = Query(..., regex="^(daily|weekly|monthly)$"),
+    date_str: str = Query(..., description="YYYY-MM-DD, ngày bất kỳ trong kỳ đã kết thúc"),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Chốt leaderboard_snapshot (best-per-level) cho 1 kỳ đã kết thúc
+    Job hằng ngày chỉ chốt các kỳ vừa kết thúc; dùng endpoint này cho các kỳ cũ
+    """
+    try:
+        target_date = datetime.strptime(date_str, "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format")
+
+    start_dt, end_dt, start_date, end_date = period_bounds(period, target_date)
+    if end_date >= datetime.now().date():
+        raise HTTPException(status_code=400, detail="Period has not ended yet")
+
+    try:
+        count = await snapshot_best_per_level(db, period, start_date, start_dt, end_dt)
+        return {
+            "status": "success",
+            "period": period,
+            "start_date": str(start_date),
+            "end_date": str(end_date),
+            "records_processed": count
+        }
+    except Exception as e:
+        logger.error(f"Error in best-per-level snapshot: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/admin/leaderboard/backfill", dependencies=[Depends(require_admin)])
 async def admin_backfill_leaderboard(
     start_date: str = Query(..., description="YYYY-MM-DD"),
     end_date: str = Query(..., description="YYYY-MM-DD"),
@@ -94,6 +156,56 @@ async def admin_backfill_leaderboard(
         logger.error(f"Error in backfill: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/admin/leaderboard/best-per-level/backfill", dependencies=[Depends(require_admin)])
+async def admin_backfill_leaderboard_best_per_level(db: AsyncSession = Depends(get_db)):
+    """
+    Backfill leaderboard_best_per_level (nguồn BXH period=all) từ toàn bộ gameplay_history
+    Idempotent: chạy lại không làm sai số liệu
+    Warning: quét cả gameplay_history (theo lô user), có thể mất nhiều thời gian
+    """
+    try:
+        total = await backfill_leaderboard_best_per_level(db)
+        return {
+            "status": "success",
+            "message": "Backfill completed",
+            "total_records": total
+        }
+    except Exception as e:
+        logger.error(f"Error in all-time best-per-level backfill: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/admin/gameplay/best-per-level/backfill", dependencies=[Depends(require_admin)])
+async def admin_backfill_gameplay_best_per_level(
+    start_date: str = Query(..., description="YYYY-MM-DD"),
+    end_date: str = Query(..., description="YYYY-MM-DD"),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Backfill rollup gameplay_best_per_level (nguồn của /gameplay-stats) từ gameplay_history
+    Idempotent: chạy lại trên cùng khoảng ngày không làm sai số liệu
+    """
+    try:
+        start = datetime.strptime(start_date, "%Y-%m-%d").date()
+        end = datetime.strptime(end_date, "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format")
+
+    if start > end:
+        raise HTTPException(status_code=400, detail="start_date must be before end_date")
+
+    try:
+        total = await backfill_gameplay_best_per_level(db, start, end)
+        return {
+            "status": "success",
+            "message": "Backfill completed",
+            "start_date": str(start),
+            "end_date": str(end),
+            "total_records": total
+        }
+    except Exception as e:
+        logger.error(f"Error in best-per-level backfill: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/admin/leaderboard/full")
 async def get_admin_full_leaderboard(
     period: str = Query("daily", regex="^(daily|weekly|monthly)$"),
@@ -114,103 +226,70 @@ async def get_admin_full_leaderboard(
     else:
         target_date = datetime.now().date()
 
-    # Khoảng thời gian
-    if period == "weekly":
-        weekday = target_date.weekday()
-        start_date = target_date - timedelta(days=weekday)
-        end_date = start_date + timedelta(days=6)
-    elif period == "monthly":
-        start_date = target_date.replace(day=1)
-        if target_date.month == 12:
-            end_date = date(target_date.year + 1, 1, 1) - timedelta(days=1)
-        else:
-            end_date = date(target_date.year, target_date.month + 1, 1) - timedelta(days=1)
+    # Khoảng thời gian (nửa mở [start_dt, end_dt), memo theo (period, ngày))
+    start_dt, end_dt, start_date, end_date = period_bounds(period, target_date)
+
+    cache_key = f"lb:admin:{period}:{target_date}:{limit}"
+    cached = await cache_get_json(cache_key)
+    if cached is not None:
+        return cached
+
+    today = datetime.now().date()
+    if end_date < today:
+        # Kỳ đã kết thúc: đọc snapshot đã chốt (GET chỉ đọc, chưa chốt thì aggregate trực tiếp)
+        src = await _best_snapshot_source(db, period, start_date, start_dt, end_dt)
     else:
-        start_date = target_date
-        end_date = target_date
-
-    start_dt = datetime.combine(start_date, datetime.min.time())
-    end_dt = datetime.combine(end_date, datetime.max.time())
-
-    # --- Subquery 1: best score per level per user ---
-    best_score_q = sa_select(
-        GameplayHistory.user_id.label("user_id"),
-        GameplayHistory.level_code.label("level_code"),
-        func.max(GameplayHistory.score).label("best_score"),
-        func.max(GameplayHistory.stars).label("best_stars"),
-        func.min(GameplayHistory.duration_seconds).label("best_duration")
-    ).where(
-        and_(
-            GameplayHistory.started_at >= start_dt,
-            GameplayHistory.started_at <= end_dt,
-            GameplayHistory.game_mode == 'normal'
-        )
-    ).group_by(GameplayHistory.user_id, GameplayHistory.level_code).subquery()
-
-    # --- Subquery 2: aggregate by user ---
-    agg_q = sa_select(
-        best_score_q.c.user_id,
-        func.sum(best_score_q.c.best_score).label("total_scores"),
-        func.count(best_score_q.c.level_code).label("games_played"),
-        func.max(
-            case(
-                (best_score_q.c.level_code.like('level_%'),
-                cast(func.substring_index(best_score_q.c.level_code, '_', -1), Integer)),
-                else_=0
-            )
-        ).label("max_level"),
-        func.avg(best_score_q.c.best_stars).label("avg_stars"),
-        func.sum(best_score_q.c.best_duration).label("total_duration")
-    ).group_by(best_score_q.c.user_id).subquery()
-
-
-    # Join với User và GameStatement
+        # Kỳ đang chạy: aggregate trực tiếp từ gameplay_history
+        src = best_per_level_agg(start_dt, end_dt)
+
+    # Join với User (GameStatement lấy riêng sau khi đã có top-N)
     q = sa_select(
-        agg_q.c.user_id,
-        agg_q.c.total_scores,
-        agg_q.c.games_played,
-        agg_q.c.max_level,  
-        agg_q.c.avg_stars,
-        agg_q.c.total_duration,
-        GameStatement.statement_json,
+        src.c.user_id,
+        src.c.total_scores,
+        src.c.games_played,
+        src.c.max_level,  
+        src.c.avg_stars,
+        src.c.total_duration,
         User.msisdn
-    ).join(User, User.id == agg_q.c.user_id)\
-     .outerjoin(GameStatement, GameStatement.user_id == agg_q.c.user_id)
+    ).join(User, User.id == src.c.user_id)\
+     .order_by(
+        src.c.total_scores.desc(),
+        src.c.games_played.desc(),
+        src.c.avg_stars.desc(),
+        src.c.total_duration.asc()
+    ).limit(limit)
 
+    # Sắp xếp + cắt top-N ngay trong SQL
     res = await db.execute(q)
-    players = res.all()
-
-    # Sắp xếp
-    sorted_players = sorted(players, key=lambda p: (
-        -(p.total_scores or 0),
-        -(p.games_played or 0),
-        -(p.avg_stars or 0),
-        (p.total_duration or 0)
-    ))
+    top_players = res.all()
 
-    top_players = sorted_players[:limit]
+    # 1 query IN (...) cho đúng `limit` user thay vì LEFT JOIN vào mọi row aggregate
+    profiles = await fetch_profiles(db, [p.user_id for p in top_players])
 
     leaderboard = [
         {
-            "rank": idx + 1,
+            "rank": rank,
             "user_id": row.user_id,
-            "name": extract_name(row.statement_json),
-            "avatar": extract_avatar(row.statement_json),
+            "name": profiles.get(row.user_id, DEFAULT_PROFILE)[0],
+            "avatar": profiles.get(row.user_id, DEFAULT_PROFILE)[1],
             "msisdn": row.msisdn,
-            "scores": int(row.total_scores or 0),
-            "games_played": int(row.games_played or 0),
-            "max_level": row.max_level or 0,
-            "avg_stars": round(float(row.avg_stars or 0), 2),
-            "total_duration": int(row.total_duration or 0)
+            "scores": row.total_scores,
+            "games_played": row.games_played,
+            "max_level": row.max_level,
+            "avg_stars": round(float(row.avg_stars), 2),
+            "total_duration": row.total_duration
         }
-        for idx, row in enumerate(top_players)
+        for rank, row in enumerate(top_players, start=1)
     ]
 
-    return {
+    response = {
         "status": "success",
         "period": period,
         "start_date": str(start_date),
         "end_date": str(end_date),
         "source": "admin_full_best_per_level",
         "leaderboard": leaderboard
-    }
\ No newline at end of file
+    }
+    ttl = LB_CACHE_TTL_CURRENT if end_date >= today else LB_CACHE_TTL_PAST
+    await cache_set_json(cache_key, response, ttl)
+    return response
\ No newline at end of file
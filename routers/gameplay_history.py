@@ -2,12 +2,14 @@
 from fastapi import APIRouter, Depends, Query, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import desc, func, and_, text
+from sqlalchemy import desc, func, and_, text, tuple_, case
 from datetime import datetime, date, timedelta, timezone
 from typing import Optional
-import json
+import asyncio
+import base64
+import binascii
 
-from models.models import GameplayHistory, User, GameStatement
+from models.models import GameplayHistory, GameplayBestPerLevel, User, GameStatement
 from schemas.gameplay_schemas import (
     GameplayLogRequest,
     GameplayLogSuccessResponse,
@@ -15,14 +17,131 @@ from schemas.gameplay_schemas import (
     GameplayStatsResponse,
     LevelLeaderboardResponse
 )
-from database import get_db
-from utils.auth_helper import get_user_from_auth
-from fastapi.responses import JSONResponse
-from config_sys import MYANMAR_TZ
+from database import get_db, get_read_db, read_session
+from services.gameplay_service import GameplayService
+from utils.auth_helper import get_user_from_auth, require_admin
+from utils import json_utils
+from utils.redis_cache import cache_get_json, cache_set_json
+from utils.period_utils import period_range
+from fastapi.responses import JSONResponse, StreamingResponse
+from config_sys import MYANMAR_TZ, GAMEPLAY_STATS_FROM_ROLLUP
 
 router = APIRouter()
 UTC = MYANMAR_TZ
 
+# BXH theo màn đọc nhiều, giống nhau giữa các user -> cache ngắn, hết TTL tự làm mới
+LEVEL_LB_CACHE_TTL = 45
+# Export stream: số dòng mỗi lần fetch từ server-side cursor
+EXPORT_CHUNK_SIZE = 500
+# Giới hạn 1 lần export: khoảng ngày tối đa + số dòng tối đa
+EXPORT_MAX_DAYS = 31
+EXPORT_MAX_ROWS = 200000
+
+# Cột trả về cho list lịch sử: select cột (Core) + .mappings(), không dựng ORM instance
+HISTORY_COLUMNS = (
+    GameplayHistory.id,
+    GameplayHistory.user_id,
+    GameplayHistory.level_code,
+    GameplayHistory.play_attempt,
+    GameplayHistory.score,
+    GameplayHistory.coins_earned,
+    GameplayHistory.stars,
+    GameplayHistory.duration_seconds,
+    GameplayHistory.items_start,
+    GameplayHistory.items_used,
+    GameplayHistory.items_earned,
+    GameplayHistory.game_mode,
+    GameplayHistory.started_at,
+    GameplayHistory.created_at,
+)
+
+
+def masked_msisdn(col):
+    """
+    Ẩn 4 số cuối ngay trong SQL (msisdn gốc không rời DB):
+    NULL/<= 4 ký tự -> '****', còn lại giữ phần đầu + '****'
+    """
+    return case(
+        (func.coalesce(func.char_length(col), 0) <= 4, "****"),
+        else_=func.concat(func.substring(col, 1, func.char_length(col) - 4), "****")
+    )
+
+
+# ============ Filters ============
+def _history_filters(
+    user_id: Optional[int] = None,
+    level_code: Optional[str] = None,
+    game_mode: Optional[str] = None,
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None
+) -> list:
+    """
+    Điều kiện lọc dùng chung cho các list lịch sử (count + query lấy trang)
+    Chỉ thêm điều kiện khi có filter -> WHERE luôn sargable, không dùng `:p IS NULL OR ...`
+    """
+    conds = []
+    if user_id is not None:
+        conds.append(GameplayHistory.user_id == user_id)
+    if level_code:
+        conds.append(GameplayHistory.level_code == level_code)
+    if game_mode:
+        conds.append(GameplayHistory.game_mode == game_mode)
+    if from_date:
+        conds.append(GameplayHistory.started_at >= from_date)
+    if to_date:
+        conds.append(GameplayHistory.started_at <= to_date)
+    return conds
+
+
+# ============ Keyset pagination ============
+def _encode_cursor(started_at: datetime, row_id: int) -> str:
+    """Cursor = base64(started_at|id) của dòng cuối trang"""
+    raw = f"{started_at.isoformat()}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        ts, row_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(ts), int(row_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _keyset_page(query, limit: int, offset: int, cursor: Optional[str]):
+    """
+    ORDER BY started_at DESC, id DESC + LIMIT
+    - Có cursor: WHERE (started_at, id) < cursor, bỏ OFFSET (không scan bỏ offset dòng)
+    - Không cursor: giữ OFFSET cho client cũ
+    """
+    query = query.order_by(desc(GameplayHistory.started_at), desc(GameplayHistory.id)).limit(limit)
+    if cursor:
+        cursor_ts, cursor_id = _decode_cursor(cursor)
+        return query.where(
+            tuple_(GameplayHistory.started_at, GameplayHistory.id) < tuple_(cursor_ts, cursor_id)
+        )
+    return query.offset(offset)
+
+
+async def _count_and_fetch(db: AsyncSession, count_query, page_query) -> tuple:
+    """
+    Chạy count và query lấy trang song song: count trên session riêng (connection
+    khác trong pool) vì 1 AsyncSession không execute đồng thời được
+    """
+    async def _count() -> int:
+        async with read_session() as count_db:
+            return (await count_db.execute(count_query)).scalar() or 0
+
+    return await asyncio.gather(_count(), db.execute(page_query))
+
+
+def _next_cursor(rows: list, limit: int) -> Optional[str]:
+    if len(rows) < limit:
+        return None
+    last = rows[-1]
+    return _encode_cursor(last["started_at"], last["id"])
+
 # ============ API: Log Gameplay ============
 @router.post("/log-gameplay", response_model=GameplayLogSuccessResponse)
 async def log_gameplay(
@@ -40,48 +159,34 @@ async def log_gameplay(
     if isinstance(user, JSONResponse):
         return user
 
-    # Tính play_attempt tự động
-    query = select(func.coalesce(func.max(GameplayHistory.play_attempt), 0) + 1).where(
-        and_(
-            GameplayHistory.user_id == user.id,
-            GameplayHistory.level_code == payload.level_code
-        )
-    )
-    result = await db.execute(query)
-    next_attempt = result.scalar() or 1
-
-    # Prepare JSON fields
-    items_start_json = json.dumps(payload.items_start) if payload.items_start else None
-    items_used_json = json.dumps(payload.items_used) if payload.items_used else None
-    items_earned_json = json.dumps(payload.items_earned) if payload.items_earned else None
-
-    # Tạo record mới (chỉ insert, không so sánh)
+    # Insert + tính play_attempt trong 1 câu INSERT ... SELECT (không đọc MAX trước)
+    # JSON fields: JSONText tự encode bằng orjson khi bind
     now = datetime.now(UTC)
-    gameplay = GameplayHistory(
+    values = dict(
         user_id=user.id,
         msisdn=user.msisdn or "",
         level_code=payload.level_code,
-        play_attempt=next_attempt,
         score=payload.score,
         coins_earned=payload.coins_earned,
         stars=payload.stars,
         started_at=now,
         duration_seconds=payload.duration_seconds,
-        items_start=items_start_json,
-        items_used=items_used_json,
-        items_earned=items_earned_json,
+        items_start=payload.items_start or None,
+        items_used=payload.items_used or None,
+        items_earned=payload.items_earned or None,
         game_mode=payload.game_mode,
         created_at=now
     )
 
-    db.add(gameplay)
+    gameplay_id = await GameplayService.insert_gameplay(db, values)
+    await GameplayService.upsert_best_per_level(db, values)
+    await GameplayService.append_change_log(db, gameplay_id, values)
     await db.commit()
-    await db.refresh(gameplay)
 
     return GameplayLogSuccessResponse(
         status="success",
         message="Gameplay logged successfully",
-        gameplay_id=gameplay.id
+        gameplay_id=gameplay_id
     )
 
 
@@ -90,111 +195,77 @@ async def log_gameplay(
 async def get_all_gameplay_history(
     limit: int = Query(50, ge=1, le=500),
     offset: int = Query(0, ge=0),
+    cursor: Optional[str] = Query(None, description="next_cursor của trang trước (thay cho offset)"),
     level_code: Optional[str] = None,
     user_id: Optional[int] = None,
     game_mode: Optional[str] = Query(None, regex="^(normal|event)$"),
-    from_date: Optional[str] = None,
-    to_date: Optional[str] = None,
-    db: AsyncSession = Depends(get_db)
+    # FastAPI/pydantic parse ISO datetime, sai format tự trả 422
+    from_date: Optional[datetime] = Query(None),
+    to_date: Optional[datetime] = Query(None),
+    db: AsyncSession = Depends(get_read_db)
 ):
     """
     Lấy toàn bộ lịch sử gameplay (main endpoint cho CMS)
     - Mặc định load tất cả records
     - Có thể filter theo user_id, level_code, ngày, game_mode
     """
-    sub_latest_statement = (
-        select(func.max(GameStatement.id))
-        .where(GameStatement.user_id == GameplayHistory.user_id)
-        .correlate(GameplayHistory)
-        .scalar_subquery()
+    # Statement mới nhất của mỗi user: gom 1 lần thành bảng dẫn xuất rồi join,
+    # thay vì subquery MAX tương quan chạy lại cho từng dòng gameplay
+    latest_statement = (
+        select(
+            GameStatement.user_id,
+            func.max(GameStatement.id).label("max_id")
+        )
+        .group_by(GameStatement.user_id)
+        .subquery()
     )
 
+    filter_conds = _history_filters(user_id, level_code, game_mode, from_date, to_date)
+
     query = (
         select(
-            GameplayHistory,
-            User.msisdn,
-            func.JSON_UNQUOTE(
-                func.JSON_EXTRACT(GameStatement.statement_json, "$.name")
-            ).label("player_name")
+            *HISTORY_COLUMNS,
+            # Giá trị mặc định "N/A" tính luôn trong SQL, row trả về dùng thẳng được
+            func.coalesce(func.nullif(User.msisdn, ""), "N/A").label("msisdn"),
+            # Cột name tách sẵn khi ghi statement, không parse statement_json mỗi dòng
+            func.coalesce(func.nullif(GameStatement.name, ""), "N/A").label("name")
         )
         .join(User, User.id == GameplayHistory.user_id)
+        .join(
+            latest_statement,
+            latest_statement.c.user_id == GameplayHistory.user_id,
+            isouter=True
+        )
         .join(
             GameStatement,
             and_(
-                GameStatement.user_id == GameplayHistory.user_id,
-                GameStatement.id == sub_latest_statement   # ✅ chỉ lấy dòng mới nhất
+                GameStatement.user_id == latest_statement.c.user_id,
+                GameStatement.id == latest_statement.c.max_id   # ✅ chỉ lấy dòng mới nhất
             ),
             isouter=True
         )
+        .where(*filter_conds)
     )
-    
-    # Optional filters
-    if user_id:
-        query = query.where(GameplayHistory.user_id == user_id)
-    if level_code:
-        query = query.where(GameplayHistory.level_code == level_code)
-    if game_mode:
-        query = query.where(GameplayHistory.game_mode == game_mode)
-    if from_date:
-        try:
-            from_dt = datetime.fromisoformat(from_date)
-            query = query.where(GameplayHistory.started_at >= from_dt)
-        except ValueError:
-            raise HTTPException(status_code=400, detail="Invalid from_date format")
-    if to_date:
-        try:
-            to_dt = datetime.fromisoformat(to_date)
-            query = query.where(GameplayHistory.started_at <= to_dt)
-        except ValueError:
-            raise HTTPException(status_code=400, detail="Invalid to_date format")
 
-    # Count total
-    count_query = select(func.count()).select_from(query.subquery())
-    total_result = await db.execute(count_query)
-    total = total_result.scalar() or 0
+    # Count total: chỉ đếm trên gameplay_history, bỏ join GameStatement (LEFT JOIN 1 dòng
+    # nên không đổi số dòng) và JSON_EXTRACT -> không materialize cả query như subquery
+    count_query = select(func.count(GameplayHistory.id)).where(*filter_conds)
 
-    # Get paginated results
-    result = await db.execute(
-        query.order_by(desc(GameplayHistory.started_at)).limit(limit).offset(offset)
+    # Count + paginated results song song
+    total, result = await _count_and_fetch(
+        db, count_query, _keyset_page(query, limit, offset, cursor)
     )
-    rows = result.all()
-
-    def _safe_json_load(val):
-        if val is None:
-            return None
-        if isinstance(val, (dict, list)):
-            return val
-        try:
-            return json.loads(val)
-        except Exception:
-            return None
+    rows = result.mappings().all()
 
     return GameplayHistoryResponse(
         status="success",
         total=total,
         limit=limit,
         offset=offset,
-        data=[
-            {
-                "id": h.GameplayHistory.id,
-                "user_id": h.GameplayHistory.user_id,
-                "name": h.player_name or "N/A",
-                "msisdn": h.msisdn or "N/A",
-                "level_code": h.GameplayHistory.level_code,
-                "play_attempt": h.GameplayHistory.play_attempt,
-                "score": h.GameplayHistory.score,
-                "coins_earned": h.GameplayHistory.coins_earned,
-                "stars": h.GameplayHistory.stars,
-                "duration_seconds": h.GameplayHistory.duration_seconds,
-                "items_start": _safe_json_load(h.GameplayHistory.items_start),
-                "items_used": _safe_json_load(h.GameplayHistory.items_used),
-                "items_earned": _safe_json_load(h.GameplayHistory.items_earned),
-                "game_mode": h.GameplayHistory.game_mode,
-                "started_at": h.GameplayHistory.started_at.isoformat() if h.GameplayHistory.started_at else None,
-                "created_at": h.GameplayHistory.created_at.isoformat() if h.GameplayHistory.created_at else None,
-            }
-            for h in rows
-        ]
+        # RowMapping đưa thẳng vào response model: items_* đã decode sẵn (JSONText),
+        # datetime để ORJSONResponse serialize, không dựng lại dict từng dòng
+        data=rows,
+        next_cursor=_next_cursor(rows, limit)
     )
 
 
@@ -204,95 +275,123 @@ async def get_user_gameplay_history(
     user_id: int,
     limit: int = Query(50, ge=1, le=500),
     offset: int = Query(0, ge=0),
+    cursor: Optional[str] = Query(None, description="next_cursor của trang trước (thay cho offset)"),
     level_code: Optional[str] = None,
-    from_date: Optional[str] = None,
-    to_date: Optional[str] = None,
+    from_date: Optional[datetime] = Query(None),
+    to_date: Optional[datetime] = Query(None),
     game_mode: Optional[str] = Query(None, regex="^(normal|event)$"),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """
     Lấy lịch sử gameplay của user cụ thể
     - Có thể filter theo level_code, ngày, game_mode
     """
-    query = select(GameplayHistory).where(GameplayHistory.user_id == user_id)
-
-    # Filters
-    if level_code:
-        query = query.where(GameplayHistory.level_code == level_code)
-
-    if game_mode:
-        query = query.where(GameplayHistory.game_mode == game_mode)
-
-    if from_date:
-        try:
-            from_dt = datetime.fromisoformat(from_date)
-            query = query.where(GameplayHistory.started_at >= from_dt)
-        except ValueError:
-            raise HTTPException(status_code=400, detail="Invalid from_date format")
-
-    if to_date:
-        try:
-            to_dt = datetime.fromisoformat(to_date)
-            query = query.where(GameplayHistory.started_at <= to_dt)
-        except ValueError:
-            raise HTTPException(status_code=400, detail="Invalid to_date format")
+    filter_conds = _history_filters(user_id, level_code, game_mode, from_date, to_date)
+    query = select(*HISTORY_COLUMNS, GameplayHistory.msisdn).where(*filter_conds)
 
-    # Count total
-    count_query = select(func.count()).select_from(query.subquery())
-    total_result = await db.execute(count_query)
-    total = total_result.scalar() or 0
+    # Count total: đếm thẳng trên gameplay_history, không bọc subquery
+    count_query = select(func.count(GameplayHistory.id)).where(*filter_conds)
 
-    # Get paginated results
-    query = query.order_by(desc(GameplayHistory.started_at)).limit(limit).offset(offset)
-    result = await db.execute(query)
-    histories = result.scalars().all()
-
-    def _safe_json_load(val):
-        """Safely load JSON, return None if invalid"""
-        if val is None:
-            return None
-        if isinstance(val, (dict, list)):
-            return val
-        try:
-            return json.loads(val)
-        except Exception:
-            return None
+    # Count + paginated results song song
+    total, result = await _count_and_fetch(
+        db, count_query, _keyset_page(query, limit, offset, cursor)
+    )
+    histories = result.mappings().all()
 
     return GameplayHistoryResponse(
         status="success",
         total=total,
         limit=limit,
         offset=offset,
-        data=[
-            {
-                "id": h.id,
-                "user_id": h.user_id,
-                "msisdn": h.msisdn,
-                "level_code": h.level_code,
-                "play_attempt": h.play_attempt,
-                "score": h.score,
-                "coins_earned": h.coins_earned,
-                "stars": h.stars,
-                "duration_seconds": h.duration_seconds,
-                "items_start": _safe_json_load(h.items_start),
-                "items_used": _safe_json_load(h.items_used),
-                "items_earned": _safe_json_load(h.items_earned),
-                "game_mode": h.game_mode,
-                "started_at": h.started_at.isoformat() if h.started_at else None,
-                "created_at": h.created_at.isoformat() if h.created_at else None
-            }
-            for h in histories
-        ]
+        data=histories,
+        next_cursor=_next_cursor(histories, limit)
     )
 
 
+# ============ API: Export Gameplay History (NDJSON stream) ============
+@router.get("/gameplay-history/export", dependencies=[Depends(require_admin)])
+async def export_gameplay_history(
+    from_date: datetime = Query(...),
+    to_date: datetime = Query(...),
+    level_code: Optional[str] = None,
+    user_id: Optional[int] = None,
+    game_mode: Optional[str] = Query(None, regex="^(normal|event)$"),
+    limit: int = Query(EXPORT_MAX_ROWS, ge=1, le=EXPORT_MAX_ROWS)
+):
+    """
+    Export lịch sử gameplay cho CMS dạng NDJSON (mỗi dòng 1 record)
+    - Chỉ CMS/admin (X-Admin-Token): dữ liệu có msisdn đầy đủ
+    - Bắt buộc from_date/to_date (tối đa EXPORT_MAX_DAYS ngày), tối đa `limit` dòng
+    - Stream qua server-side cursor, fetch từng EXPORT_CHUNK_SIZE dòng
+      -> bộ nhớ giữ O(chunk) thay vì cả danh sách
+    - Session riêng mở trong generator vì session của Depends có thể đóng trước khi stream xong
+    """
+    if from_date > to_date:
+        raise HTTPException(status_code=400, detail="from_date must be before to_date")
+    if to_date - from_date > timedelta(days=EXPORT_MAX_DAYS):
+        raise HTTPException(
+            status_code=400, detail=f"Date range must not exceed {EXPORT_MAX_DAYS} days"
+        )
+
+    filter_conds = _history_filters(user_id, level_code, game_mode, from_date, to_date)
+    query = (
+        select(*HISTORY_COLUMNS, GameplayHistory.msisdn)
+        .where(*filter_conds)
+        .order_by(desc(GameplayHistory.started_at), desc(GameplayHistory.id))
+        .limit(limit)
+        .execution_options(yield_per=EXPORT_CHUNK_SIZE)
+    )
+
+    async def _ndjson():
+        async with read_session() as db:
+            result = await db.stream(query)
+            async for chunk in result.mappings().partitions():
+                # orjson tự serialize datetime (ISO 8601), items_* đã là dict
+                yield "".join(json_utils.dumps(dict(row)) + "\n" for row in chunk)
+
+    return StreamingResponse(_ndjson(), media_type="application/x-ndjson")
+
+
+def _stats_best_per_level(user_id: int, period: str, dt: date):
+    """
+    Subquery điểm cao nhất của từng level trong kỳ (level_code, best_score, best_coins, best_duration)
+    Khoảng ngày lấy từ period_range (lru_cache), so sánh nửa mở [start, end + 1 ngày); "all" không lọc ngày
+    - GAMEPLAY_STATS_FROM_ROLLUP: đọc rollup gameplay_best_per_level (mỗi (user, ngày, level)
+      1 dòng, range scan thẳng trên PK) -> chỉ bật sau khi đã backfill rollup
+    - Ngược lại GROUP BY trên gameplay_history
+    Chỉ project cột mà phần tổng hợp bên ngoài dùng tới (stats không có sao)
+    """
+    if GAMEPLAY_STATS_FROM_ROLLUP:
+        b = GameplayBestPerLevel
+        level_code, day = b.level_code, b.played_date
+        best_score, best_coins, best_duration = b.best_score, b.best_coins, b.best_duration
+        user_cond = b.user_id == user_id
+    else:
+        g = GameplayHistory
+        level_code, day = g.level_code, g.started_date
+        best_score, best_coins, best_duration = g.score, g.coins_earned, g.duration_seconds
+        user_cond = g.user_id == user_id
+
+    date_conds = []
+    if period != "all":
+        start_date, end_date = period_range(period, dt)
+        date_conds = [day >= start_date, day < end_date + timedelta(days=1)]
+
+    return select(
+        level_code,
+        func.max(best_score).label("best_score"),
+        func.max(best_coins).label("best_coins"),
+        func.min(best_duration).label("best_duration")
+    ).where(user_cond, *date_conds).group_by(level_code).subquery()
+
+
 # ============ API: Stats theo ngày/tuần/tháng ============
 @router.get("/gameplay-stats/{user_id}", response_model=GameplayStatsResponse)
 async def get_gameplay_stats(
     user_id: int,
     period: str = Query("daily", regex="^(daily|weekly|monthly|all)$"),
     target_date: Optional[str] = None,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """
     ✅ Thống kê gameplay: mỗi level chỉ tính điểm cao nhất (tránh spam)
@@ -306,37 +405,7 @@ async def get_gameplay_stats(
     else:
         dt = date.today()
 
-    if period == "daily":
-        start_dt = datetime.combine(dt, datetime.min.time())
-        end_dt = datetime.combine(dt, datetime.max.time())
-    elif period == "weekly":
-        start_of_week = dt - timedelta(days=dt.weekday())
-        start_dt = datetime.combine(start_of_week, datetime.min.time())
-        end_dt = datetime.combine(start_of_week + timedelta(days=6), datetime.max.time())
-    elif period == "monthly":
-        start_dt = datetime.combine(dt.replace(day=1), datetime.min.time())
-        if dt.month == 12:
-            end_dt = datetime.combine(date(dt.year + 1, 1, 1) - timedelta(days=1), datetime.max.time())
-        else:
-            end_dt = datetime.combine(date(dt.year, dt.month + 1, 1) - timedelta(days=1), datetime.max.time())
-    else:
-        start_dt = datetime.min
-        end_dt = datetime.max
-
-    # --- Subquery: lấy điểm cao nhất của từng level ---
-    best_score_q = select(
-        GameplayHistory.level_code,
-        func.max(GameplayHistory.score).label("best_score"),
-        func.max(GameplayHistory.coins_earned).label("best_coins"),
-        func.max(GameplayHistory.stars).label("best_stars"),
-        func.min(GameplayHistory.duration_seconds).label("best_duration")
-    ).where(
-        and_(
-            GameplayHistory.user_id == user_id,
-            GameplayHistory.started_at >= start_dt,
-            GameplayHistory.started_at <= end_dt
-        )
-    ).group_by(GameplayHistory.level_code).subquery()
+    best_score_q = _stats_best_per_level(user_id, period, dt)
 
     # --- Tổng hợp ---
     query = select(
@@ -367,52 +436,63 @@ async def get_gameplay_stats(
 async def get_level_leaderboard(
     level_code: str,
     limit: int = Query(10, ge=1, le=100),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """
     Bảng xếp hạng theo từng màn chơi cụ thể
     """
-    def safe_mask_msisdn(msisdn: Optional[str]) -> str:
-        if not msisdn or len(msisdn) <= 4:
-            return "****"
-        return f"{msisdn[:-4]}****"
+    cache_key = f"lb:level:{level_code}:{limit}"
+    cached = await cache_get_json(cache_key)
+    if cached is not None:
+        return cached
+
+    # Gom top theo user_id trên index (level_code, user_id, score, ...) trước,
+    # rồi mới join users cho msisdn/display_name -> GROUP BY không kéo theo cột rộng
+    top = (
+        select(
+            GameplayHistory.user_id,
+            func.max(GameplayHistory.score).label('best_score'),
+            func.max(GameplayHistory.stars).label('best_stars'),
+            func.min(GameplayHistory.duration_seconds).label('fastest_time')
+        )
+        .where(GameplayHistory.level_code == level_code)
+        .group_by(GameplayHistory.user_id)
+        .order_by(desc('best_score'))
+        .limit(limit)
+        .subquery()
+    )
 
-    # Lấy top scores cho level này
-    query = select(
-        GameplayHistory.user_id,
-        User.msisdn,
-        User.display_name,
-        func.max(GameplayHistory.score).label('best_score'),
-        func.max(GameplayHistory.stars).label('best_stars'),
-        func.min(GameplayHistory.duration_seconds).label('fastest_time')
-    ).join(
-        User, User.id == GameplayHistory.user_id
-    ).where(
-        GameplayHistory.level_code == level_code
-    ).group_by(
-        GameplayHistory.user_id,
-        User.msisdn,
-        User.display_name
-    ).order_by(
-        desc('best_score')
-    ).limit(limit)
+    query = (
+        select(
+            top.c.user_id,
+            masked_msisdn(User.msisdn).label("msisdn"),
+            User.display_name,
+            top.c.best_score,
+            top.c.best_stars,
+            top.c.fastest_time
+        )
+        .join(User, User.id == top.c.user_id)
+        .order_by(desc(top.c.best_score))
+    )
 
     result = await db.execute(query)
     leaders = result.all()
 
-    return LevelLeaderboardResponse(
-        status="success",
-        level_code=level_code,
-        leaderboard=[
+    response = {
+        "status": "success",
+        "level_code": level_code,
+        "leaderboard": [
             {
                 "rank": idx + 1,
                 "user_id": row.user_id,
                 "display_name": row.display_name,
-                "msisdn": safe_mask_msisdn(row.msisdn),
+                "msisdn": row.msisdn,
                 "best_score": row.best_score,
                 "best_stars": row.best_stars,
                 "fastest_time_seconds": row.fastest_time
             }
             for idx, row in enumerate(leaders)
         ]
-    )
\ No newline at end of file
+    }
+    await cache_set_json(cache_key, response, LEVEL_LB_CACHE_TTL)
+    return response
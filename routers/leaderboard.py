@@ -1,44 +1,256 @@
 # routers/leaderboard.py - Enhanced với logic xếp hạng 6 tiêu chí
-import json
-from sqlalchemy import desc, func, and_, select as sa_select, case, cast, Integer
+from sqlalchemy import (
+    desc, func, and_, select as sa_select, case, cast, Integer, tuple_, literal, union_all,
+    bindparam, null
+)
 from sqlalchemy.future import select
-from fastapi import APIRouter, Depends, Query, HTTPException
+from fastapi import APIRouter, Depends, Query, HTTPException, Request, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta, timezone, date
-from models.models import LeaderboardHistory, GameplayHistory, User, GameStatement
-from database import get_db
+from models.models import LeaderboardHistory, LeaderboardBestPerLevel, User
+from database import get_db, db_session
 from utils.auth_helper import get_user_from_auth
 from fastapi.responses import JSONResponse
-from typing import Optional, List
+from typing import Any, NamedTuple, Optional, List
+from utils.redis_cache import cache_get_json, cache_set_json
+from tasks.leaderboard_etl import LB_SNAPSHOT_VERSION_KEY, best_per_level_agg
+from utils.profile_helper import fetch_profiles, DEFAULT_PROFILE
+from utils.period_utils import period_bounds
+from config_sys import LB_ALL_TIME_FROM_ROLLUP
+from operator import attrgetter
+from hashlib import blake2b
+import asyncio
+import time
 
 router = APIRouter()
 UTC = timezone.utc
 
-def mask_msisdn(msisdn: str) -> str:
-    """Ẩn số điện thoại: giữ 3 số đầu và 3 số cuối nếu đủ dài"""
-    if not msisdn or len(msisdn) <= 6:
-        return "****"
-    return f"{msisdn[:3]}***{msisdn[-3:]}"
-
-def extract_name(statement_json: str) -> str:
-    """Lấy name từ statement_json"""
-    try:
-        data = json.loads(statement_json) if isinstance(statement_json, str) else (statement_json or {})
-        return data.get("name", "Player")
-    except Exception:
-        return "Player"
-
-def extract_avatar(statement_json: str) -> int:
-    """Lấy avatar từ statement_json"""
-    try:
-        data = json.loads(statement_json) if isinstance(statement_json, str) else (statement_json or {})
-        return data.get("avatar", 0)
-    except Exception:
-        return 0
+# TTL cache top BXH (giây): realtime đổi liên tục, all-time đổi chậm
+LB_CACHE_TTL_REALTIME = 45
+LB_CACHE_TTL_ALL = 300
+# Khóa theo key (chia 16 ngăn cố định): cache miss thì chỉ 1 request tính lại,
+# các request khác chờ rồi đọc cache
+_LB_LOCKS = [asyncio.Lock() for _ in range(16)]
+# HTTP cache cho request không auth (BXH công khai giống nhau với mọi người xem)
+LB_HTTP_MAX_AGE = 30
+
+def _public_cache(request: Request, response: Response, auth: Optional[str], *parts) -> Optional[Response]:
+    """
+    Không auth: gắn ETag + Cache-Control public cho CDN/browser,
+    If-None-Match khớp -> trả 304 luôn (bỏ qua DB + serialize)
+    Có auth: your_rank là dữ liệu riêng -> chỉ private, không ETag
+    """
+    if auth:
+        response.headers["Cache-Control"] = "private, no-cache"
+        return None
+    raw = "|".join(map(str, parts)).encode()
+    etag = f'"{blake2b(raw, digest_size=16).hexdigest()}"'
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = f"public, max-age={LB_HTTP_MAX_AGE}, s-maxage={LB_HTTP_MAX_AGE}"
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=dict(response.headers))
+    return None
+
+
+def _time_bucket() -> int:
+    """Cửa sổ max-age hiện tại: dữ liệu realtime không có version -> ETag đổi mỗi cửa sổ"""
+    return int(time.time()) // LB_HTTP_MAX_AGE
+
+
+def _all_time_agg():
+    """Tổng hợp BXH all-time từ bảng best-per-level đã materialize (1 dòng / user-level)"""
+    b = LeaderboardBestPerLevel
+    return sa_select(
+        b.user_id,
+        func.sum(b.best_score).label("total_scores"),
+        func.count(b.level_code).label("games_played"),
+        func.coalesce(func.max(b.level_num), 0).label("max_level"),
+        func.avg(b.best_stars).label("avg_stars"),
+        func.sum(b.best_duration).label("total_duration")
+    ).group_by(b.user_id).subquery()
+
+
+def build_leaderboard_cte(agg_q):
+    """
+    CTE `agg` (1 dòng / user) dùng chung cho top-N và rank của user hiện tại:
+    cùng 1 cấu trúc SQL cho mọi endpoint BXH -> compiled cache / plan dùng lại được
+    """
+    return agg_q.element.cte("agg")
+
+
+def _ranked_cte(agg):
+    """
+    Xếp hạng ngay trong SQL bằng ROW_NUMBER() theo tiêu chí:
+    điểm DESC, số level DESC, sao TB DESC, tổng thời lượng ASC (NULL coi như 0),
+    cuối cùng user_id ASC để hòa điểm vẫn ra thứ tự cố định (khớp _rank_key)
+    """
+    rank_col = func.row_number().over(order_by=[
+        desc(func.coalesce(agg.c.total_scores, 0)),
+        desc(func.coalesce(agg.c.games_played, 0)),
+        desc(func.coalesce(agg.c.avg_stars, 0)),
+        func.coalesce(agg.c.total_duration, 0),
+        agg.c.user_id
+    ]).label("rank")
+    return sa_select(*agg.c, rank_col).cte("ranked")
+
+
+def _rank_key(c):
+    """
+    Khóa xếp hạng dạng tuple so sánh được, cùng thứ tự với ROW_NUMBER của _ranked_cte
+    (cột ASC -> đổi dấu); user_id cuối cùng nên không có 2 user trùng khóa
+    """
+    return tuple_(
+        func.coalesce(c.total_scores, 0),
+        func.coalesce(c.games_played, 0),
+        func.coalesce(c.avg_stars, 0),
+        -func.coalesce(c.total_duration, 0),
+        -c.user_id
+    )
+
+
+def _top_select(agg, limit: int):
+    ranked = _ranked_cte(agg)
+    return sa_select(ranked, User.masked_msisdn, literal(0).label("is_me"))\
+        .join(User, User.id == ranked.c.user_id)\
+        .where(ranked.c.rank <= limit)
+
+
+def _me_select(agg, user_id: int):
+    """
+    Dòng của user hiện tại, cùng thứ tự cột với _top_select (UNION ALL được)
+    rank = 1 + số user đứng trên (so sánh tuple trong SQL), không cần đánh số cả BXH;
+    khóa có user_id nên rank trùng với số thứ tự của user trong top list
+    """
+    me = sa_select(agg).where(agg.c.user_id == user_id).cte("me")
+    ahead = sa_select(func.count()).select_from(agg)\
+        .where(_rank_key(agg.c) > _rank_key(me.c))\
+        .scalar_subquery()
+    # Dòng của mình không hiển thị msisdn -> NULL giữ chỗ cột, bỏ JOIN users
+    return sa_select(
+        me, (ahead + 1).label("rank"),
+        null().label("masked_msisdn"), literal(1).label("is_me")
+    )
+
+
+# Thứ tự key cố định của 1 dòng BXH: dict(zip(keys, tuple)) thay dict literal từng row
+_LB_KEYS = (
+    "rank", "user_id", "name", "avatar", "msisdn",
+    "scores", "games_played", "max_level", "avg_stars", "total_duration"
+)
+_SNAPSHOT_KEYS = (
+    "rank", "user_id", "name", "avatar", "msisdn", "coins", "scores",
+    "level_played", "play_count", "max_level", "avg_stars", "total_duration"
+)
+
+
+def _leaderboard_rows(top_players, profiles: dict) -> list:
+    rows = []
+    for (user_id, total_scores, games_played, max_level, avg_stars, total_duration,
+         rank, masked_msisdn, _is_me) in top_players:
+        name, avatar = profiles.get(user_id, DEFAULT_PROFILE)
+        rows.append(dict(zip(_LB_KEYS, (
+            rank, user_id, name, avatar, masked_msisdn,
+            int(total_scores or 0), int(games_played or 0), max_level or 0,
+            round(float(avg_stars or 0), 2), int(total_duration or 0)
+        ))))
+    return rows
+
+
+class LeaderboardStatements(NamedTuple):
+    """Bộ statement BXH dựng sẵn 1 lần, tham số: lb_limit, me_id (+ bind của agg_q)"""
+    top: Any
+    top_me: Any
+    me: Any
+
+
+def _lb_statements(agg_q) -> LeaderboardStatements:
+    """
+    Dựng top / top+me (UNION ALL) / me từ cùng 1 CTE agg với bindparam
+    -> handler chỉ truyền giá trị, không dựng lại cây subquery mỗi request
+    (SQL đã compile nằm trong query cache của engine theo statement cố định này)
+    """
+    agg = build_leaderboard_cte(agg_q)
+    top = _top_select(agg, bindparam("lb_limit"))
+    me = _me_select(agg, bindparam("me_id"))
+    return LeaderboardStatements(top=top, top_me=union_all(top, me), me=me)
+
+
+# Realtime: khoảng nửa mở [start_dt, end_dt) truyền qua params
+_REALTIME_STMTS = _lb_statements(
+    best_per_level_agg(bindparam("start_dt"), bindparam("end_dt"))
+)
+# All-time: đọc bảng best-per-level khi đã backfill xong, chưa thì aggregate gameplay_history
+_ALL_TIME_STMTS = _lb_statements(
+    _all_time_agg() if LB_ALL_TIME_FROM_ROLLUP else best_per_level_agg()
+)
+
+
+async def _my_rank_row(
+    db: AsyncSession, stmts: LeaderboardStatements, params: dict, user_id: Optional[int]
+):
+    """Dòng xếp hạng của user hiện tại (không cache, luôn realtime)"""
+    if user_id is None:
+        return None
+    return (await db.execute(stmts.me, {**params, "me_id": user_id})).first()
+
+
+async def _auth_user(auth: Optional[str]):
+    """
+    get_user_from_auth trên session riêng (AsyncSession không chạy song song được)
+    -> gather cùng query/cache BXH trên session của request. Không auth -> None
+    """
+    if not auth:
+        return None
+    async with db_session() as session:
+        return await get_user_from_auth(auth, session)
+
+
+async def _top_and_me(
+    db: AsyncSession, cache_key: str, ttl: int, stmts: LeaderboardStatements, params: dict,
+    limit: int, user_id: Optional[int], cached=None
+):
+    """
+    (top `limit` đã format, dòng rank của user hiện tại)
+    - Top cache Redis theo cache_key; miss -> khóa theo key, kiểm tra lại cache rồi
+      mới query (tránh nhiều request cùng tính)
+    - Miss: top + rank user chung 1 câu WITH agg ... UNION ALL (1 round-trip)
+    - Hit: chỉ query rank user (không cache, luôn realtime)
+    cached: kết quả cache_get_json(cache_key) đã đọc trước (song song với auth)
+    """
+    if cached is None:
+        cached = await cache_get_json(cache_key)
+    if cached is not None:
+        return cached, await _my_rank_row(db, stmts, params, user_id)
+
+    async with _LB_LOCKS[hash(cache_key) % len(_LB_LOCKS)]:
+        cached = await cache_get_json(cache_key)
+        if cached is not None:
+            return cached, await _my_rank_row(db, stmts, params, user_id)
+
+        if user_id is None:
+            result = await db.execute(stmts.top, {**params, "lb_limit": limit})
+        else:
+            result = await db.execute(
+                stmts.top_me, {**params, "lb_limit": limit, "me_id": user_id}
+            )
+        rows = result.all()
+
+        # Tách theo cờ is_me; UNION không giữ thứ tự -> sort top theo rank (≤ limit dòng)
+        top_players = sorted((r for r in rows if not r.is_me), key=attrgetter("rank"))
+        me = next((r for r in rows if r.is_me), None)
+
+        # Tên/avatar: 1 query IN (...) cho top-N thay vì LEFT JOIN game_statements
+        profiles = await fetch_profiles(db, [p.user_id for p in top_players])
+        leaderboard = _leaderboard_rows(top_players, profiles)
+        await cache_set_json(cache_key, leaderboard, ttl)
+        return leaderboard, me
+
 
 # ============ API: Realtime Leaderboard với logic 6 tiêu chí ============
 @router.get("/leaderboard/realtime")
 async def get_realtime_leaderboard(
+    request: Request,
+    response: Response,
     period: str = Query("daily", regex="^(daily|weekly|monthly)$"),
     date_str: str = Query(None, description="YYYY-MM-DD"),
     limit: int = Query(10, ge=1, le=200),
@@ -60,111 +272,38 @@ async def get_realtime_leaderboard(
     else:
         target_date = datetime.now(UTC).date()
 
-    # --- Khoảng thời gian ---
-    if period == "weekly":
-        weekday = target_date.weekday()
-        start_date = target_date - timedelta(days=weekday)
-        end_date = start_date + timedelta(days=6)
-    elif period == "monthly":
-        start_date = target_date.replace(day=1)
-        if target_date.month == 12:
-            end_date = date(target_date.year + 1, 1, 1) - timedelta(days=1)
-        else:
-            end_date = date(target_date.year, target_date.month + 1, 1) - timedelta(days=1)
-    else:
-        start_date = target_date
-        end_date = target_date
-
-    start_dt = datetime.combine(start_date, datetime.min.time())
-    end_dt = datetime.combine(end_date, datetime.max.time())
-
-    # --- Subquery 1: lấy điểm cao nhất của từng level cho mỗi user ---
-    best_score_q = sa_select(
-        GameplayHistory.user_id.label("user_id"),
-        GameplayHistory.level_code.label("level_code"),
-        func.max(GameplayHistory.score).label("best_score"),
-        func.max(GameplayHistory.stars).label("best_stars"),
-        func.min(GameplayHistory.duration_seconds).label("best_duration")
-    ).where(
-        and_(
-            GameplayHistory.started_at >= start_dt,
-            GameplayHistory.started_at <= end_dt,
-            GameplayHistory.game_mode == 'normal'
-        )
-    ).group_by(GameplayHistory.user_id, GameplayHistory.level_code).subquery()
-
-    # --- Subquery 2: tổng hợp lại theo user ---
-    agg_q = sa_select(
-        best_score_q.c.user_id,
-        func.sum(best_score_q.c.best_score).label("total_scores"),
-        func.count(best_score_q.c.level_code).label("games_played"),
-        func.max(best_score_q.c.level_code).label("max_level"),
-        func.avg(best_score_q.c.best_stars).label("avg_stars"),
-        func.sum(best_score_q.c.best_duration).label("total_duration")
-    ).group_by(best_score_q.c.user_id).subquery()
-
-    # --- Join với User và GameStatement ---
-    q = sa_select(
-        agg_q.c.user_id,
-        agg_q.c.total_scores,
-        agg_q.c.games_played,
-        agg_q.c.max_level,  
-        agg_q.c.avg_stars,
-        agg_q.c.total_duration,
-        GameStatement.statement_json,
-        User.msisdn
-    ).join(User, User.id == agg_q.c.user_id)\
-     .outerjoin(GameStatement, GameStatement.user_id == agg_q.c.user_id)
+    # --- Khoảng thời gian (memo theo (period, ngày), nửa mở [start_dt, end_dt)) ---
+    start_dt, end_dt, start_date, end_date = period_bounds(period, target_date)
 
-    res = await db.execute(q)
-    players = res.all()
+    not_modified = _public_cache(
+        request, response, auth, period, start_date, end_date, limit, _time_bucket()
+    )
+    if not_modified:
+        return not_modified
 
-    # --- Sắp xếp theo tiêu chí ---
-    sorted_players = sorted(players, key=lambda p: (
-        -(p.total_scores or 0),
-        -(p.games_played or 0),
-        -(p.avg_stars or 0),
-        (p.total_duration or 0)
-    ))
+    # --- Xác thực (session riêng) song song với đọc cache top, cần user_id cho your_rank ---
+    cache_key = f"lb:{period}:{start_date}:{end_date}:{limit}"
+    user, cached = await asyncio.gather(_auth_user(auth), cache_get_json(cache_key))
+    if isinstance(user, JSONResponse):
+        return user
+    user_id = user.id if user else None
 
-    # --- Giới hạn top ---
-    top_players = sorted_players[:limit]
+    # --- Top (cache Redis) + rank của user hiện tại, xếp hạng trong SQL ---
+    leaderboard, me = await _top_and_me(
+        db, cache_key, LB_CACHE_TTL_REALTIME, _REALTIME_STMTS,
+        {"start_dt": start_dt, "end_dt": end_dt}, limit, user_id, cached
+    )
 
-    # --- Tính rank của user hiện tại (nếu có auth) ---
     your_rank = None
     your_stats = None
-    if auth:
-        user = await get_user_from_auth(auth, db)
-        if isinstance(user, JSONResponse):
-            return user
-        user_id = user.id
-        for idx, p in enumerate(sorted_players, start=1):
-            if p.user_id == user_id:
-                your_rank = idx
-                your_stats = {
-                    "total_scores": int(p.total_scores or 0),
-                    "games_played": int(p.games_played or 0),
-                    "avg_stars": round(float(p.avg_stars or 0), 2),
-                    "total_duration": int(p.total_duration or 0)
-                }
-                break
-
-    # --- Kết quả ---
-    leaderboard = [
-        {
-            "rank": idx + 1,
-            "user_id": row.user_id,
-            "name": extract_name(row.statement_json),
-            "avatar": extract_avatar(row.statement_json),
-            "msisdn": mask_msisdn(row.msisdn),
-            "scores": int(row.total_scores or 0),
-            "games_played": int(row.games_played or 0),
-            "max_level": row.max_level or 0,
-            "avg_stars": round(float(row.avg_stars or 0), 2),
-            "total_duration": int(row.total_duration or 0)
+    if me:
+        your_rank = me.rank
+        your_stats = {
+            "total_scores": int(me.total_scores or 0),
+            "games_played": int(me.games_played or 0),
+            "avg_stars": round(float(me.avg_stars or 0), 2),
+            "total_duration": int(me.total_duration or 0)
         }
-        for idx, row in enumerate(top_players)
-    ]
 
     return {
         "status": "success",
@@ -181,6 +320,8 @@ async def get_realtime_leaderboard(
 # ============ API: Cached Leaderboard với rank đã tính sẵn ============
 @router.get("/leaderboard")
 async def get_leaderboard(
+    request: Request,
+    response: Response,
     period: str = Query("all", regex="^(all|daily|weekly|monthly)$"),
     date_str: str = Query(None, description="YYYY-MM-DD (default today for daily/weekly/monthly)"),
     limit: int = Query(10, ge=1, le=200),
@@ -189,7 +330,7 @@ async def get_leaderboard(
 ):
     """
     ✅ Leaderboard chính:
-    - `all`      → realtime từ GameplayHistory, tính best score mỗi level
+    - `all`      → leaderboard_best_per_level (best score mỗi level, cập nhật khi log gameplay)
     - `daily`    → snapshot LeaderboardHistory
     - `weekly`   → snapshot LeaderboardHistory
     - `monthly`  → snapshot LeaderboardHistory
@@ -197,89 +338,34 @@ async def get_leaderboard(
 
     # ---------------------- CASE 1: ALL-TIME ----------------------
     if period == "all":
-        # --- Subquery 1: best score per level per user ---
-        best_score_q = sa_select(
-            GameplayHistory.user_id.label("user_id"),
-            GameplayHistory.level_code.label("level_code"),
-            func.max(GameplayHistory.score).label("best_score"),
-            func.max(GameplayHistory.stars).label("best_stars"),
-            func.min(GameplayHistory.duration_seconds).label("best_duration")
-        ).where(
-            GameplayHistory.game_mode == 'normal'
-        ).group_by(GameplayHistory.user_id, GameplayHistory.level_code).subquery()
-
-        # --- Subquery 2: tổng hợp theo user ---
-        agg_q = sa_select(
-            best_score_q.c.user_id,
-            func.sum(best_score_q.c.best_score).label("total_scores"),
-            func.count(best_score_q.c.level_code).label("games_played"),
-            func.max(best_score_q.c.level_code).label("max_level"),  # ✅ thêm max_level
-            func.avg(best_score_q.c.best_stars).label("avg_stars"),
-            func.sum(best_score_q.c.best_duration).label("total_duration")
-        ).group_by(best_score_q.c.user_id).subquery()
-
-        # --- Join với User và GameStatement ---
-        q = sa_select(
-            agg_q.c.user_id,
-            agg_q.c.total_scores,
-            agg_q.c.games_played,
-            agg_q.c.max_level,
-            agg_q.c.avg_stars,
-            agg_q.c.total_duration,
-            GameStatement.statement_json,
-            User.msisdn
-        ).join(User, User.id == agg_q.c.user_id)\
-         .outerjoin(GameStatement, GameStatement.user_id == agg_q.c.user_id)
-
-        res = await db.execute(q)
-        players = res.all()
-
-        # --- Sắp xếp ---
-        sorted_players = sorted(players, key=lambda p: (
-            -(p.total_scores or 0),
-            -(p.games_played or 0),
-            -(p.avg_stars or 0),
-            (p.total_duration or 0)
-        ))
-
-        top_players = sorted_players[:limit]
-
-        leaderboard = [
-            {
-                "rank": idx + 1,
-                "user_id": row.user_id,
-                "name": extract_name(row.statement_json),
-                "avatar": extract_avatar(row.statement_json),
-                "msisdn": mask_msisdn(row.msisdn),
-                "scores": int(row.total_scores or 0),
-                "games_played": int(row.games_played or 0),
-                "max_level": row.max_level or 0,
-                "avg_stars": round(float(row.avg_stars or 0), 2),
-                "total_duration": int(row.total_duration or 0)
-            }
-            for idx, row in enumerate(top_players)
-        ]
+        not_modified = _public_cache(request, response, auth, "all", limit, _time_bucket())
+        if not_modified:
+            return not_modified
+
+        # --- Xác thực (session riêng) song song với đọc cache top ---
+        cache_key = f"lb:all:{limit}"
+        user, cached = await asyncio.gather(_auth_user(auth), cache_get_json(cache_key))
+        if isinstance(user, JSONResponse):
+            return user
+        user_id = user.id if user else None
+
+        # --- Top (cache Redis) + rank của user hiện tại, xếp hạng trong SQL ---
+        # Đọc bảng best-per-level materialize sẵn, không GROUP BY lại gameplay_history
+        leaderboard, me = await _top_and_me(
+            db, cache_key, LB_CACHE_TTL_ALL, _ALL_TIME_STMTS, {}, limit, user_id, cached
+        )
 
-        # --- Tính your_rank nếu có auth ---
         your_rank = None
         your_stats = None
-        if auth:
-            user = await get_user_from_auth(auth, db)
-            if isinstance(user, JSONResponse):
-                return user
-            user_id = user.id
-
-            for idx, row in enumerate(sorted_players):
-                if row.user_id == user_id:
-                    your_rank = idx + 1
-                    your_stats = {
-                        "scores": int(row.total_scores or 0),
-                        "games_played": int(row.games_played or 0),
-                        "max_level": row.max_level or 0,
-                        "avg_stars": round(float(row.avg_stars or 0), 2),
-                        "total_duration": int(row.total_duration or 0)
-                    }
-                    break
+        if me:
+            your_rank = me.rank
+            your_stats = {
+                "scores": int(me.total_scores or 0),
+                "games_played": int(me.games_played or 0),
+                "max_level": me.max_level or 0,
+                "avg_stars": round(float(me.avg_stars or 0), 2),
+                "total_duration": int(me.total_duration or 0)
+            }
 
         return {
             "status": "success",
@@ -299,6 +385,12 @@ async def get_leaderboard(
     else:
         target_date = datetime.now(UTC).date()
 
+    # Snapshot chỉ đổi khi ETL ghi lại leaderboard_history (version tăng theo)
+    snap_version = await cache_get_json(LB_SNAPSHOT_VERSION_KEY) if not auth else None
+    not_modified = _public_cache(request, response, auth, period, target_date, limit, snap_version)
+    if not_modified:
+        return not_modified
+
     q = sa_select(
         LeaderboardHistory.user_id,
         LeaderboardHistory.rank,
@@ -309,47 +401,36 @@ async def get_leaderboard(
         LeaderboardHistory.max_level,
         LeaderboardHistory.avg_stars,
         LeaderboardHistory.total_duration,
-        GameStatement.statement_json,
-        User.msisdn
+        User.masked_msisdn
     ).join(User, User.id == LeaderboardHistory.user_id)\
-     .outerjoin(GameStatement, GameStatement.user_id == LeaderboardHistory.user_id)\
      .where(
         LeaderboardHistory.period == period,
         LeaderboardHistory.date == target_date
     ).order_by(LeaderboardHistory.rank).limit(limit)
 
-    res = await db.execute(q)
+    # Top snapshot (session request) song song với xác thực (session riêng)
+    res, user = await asyncio.gather(db.execute(q), _auth_user(auth))
+    if isinstance(user, JSONResponse):
+        return user
     players = res.all()
-
-    leaderboard = [
-        {
-            "rank": row.rank,
-            "user_id": row.user_id,
-            "name": extract_name(row.statement_json),
-            "avatar": extract_avatar(row.statement_json),
-            "msisdn": mask_msisdn(row.msisdn),
-            "coins": row.coins,
-            "scores": row.scores,
-            "level_played": row.level_played,
-            "play_count": row.play_count,
-            "max_level": row.max_level or 0,
-            "avg_stars": round(float(row.avg_stars or 0), 2),
-            "total_duration": row.total_duration
-        }
-        for row in players
-    ]
+    profiles = await fetch_profiles(db, [p.user_id for p in players])
+
+    leaderboard = []
+    for (user_id, rank, scores, coins, level_played, play_count, max_level,
+         avg_stars, total_duration, masked_msisdn) in players:
+        name, avatar = profiles.get(user_id, DEFAULT_PROFILE)
+        leaderboard.append(dict(zip(_SNAPSHOT_KEYS, (
+            rank, user_id, name, avatar, masked_msisdn, coins, scores,
+            level_played, play_count, max_level or 0,
+            round(float(avg_stars or 0), 2), total_duration
+        ))))
 
     # --- Tính your_rank nếu có auth ---
     your_rank = None
     your_stats = None
-    if auth:
-        user = await get_user_from_auth(auth, db)
-        if isinstance(user, JSONResponse):
-            return user
-        user_id = user.id
-
+    if user:
         rank_q = sa_select(LeaderboardHistory.rank).where(
-            LeaderboardHistory.user_id == user_id,
+            LeaderboardHistory.user_id == user.id,
             LeaderboardHistory.period == period,
             LeaderboardHistory.date == target_date
         )
@@ -392,7 +473,34 @@ async def get_my_rank(
         target_date = datetime.now(UTC).date()
 
     if period == "all":
-        return {"status": "error", "message": "Use /leaderboard?period=all with auth for all-time rank"}
+        # 1 + số user đứng trên trong leaderboard_best_per_level, không dựng top-N
+        me = await _my_rank_row(db, _ALL_TIME_STMTS, {}, user.id)
+        if not me:
+            return {
+                "status": "success",
+                "period": "all",
+                "date": None,
+                "rank": None,
+                "message": "No gameplay data for this period"
+            }
+        # Cùng shape stats với daily/weekly/monthly; all-time không có
+        # lượt chơi/coins/thời điểm chơi đầu -> None
+        return {
+            "status": "success",
+            "period": "all",
+            "date": None,
+            "rank": me.rank,
+            "stats": {
+                "scores": int(me.total_scores or 0),
+                "play_count": None,
+                "max_level": me.max_level or 0,
+                "avg_stars": round(float(me.avg_stars or 0), 2),
+                "total_duration": int(me.total_duration or 0),
+                "first_played_at": None,
+                "coins": None,
+                "level_played": int(me.games_played or 0)
+            }
+        }
 
     # Lấy thông tin từ LeaderboardHistory
     q = sa_select(
@@ -1,12 +1,16 @@
 # routers/myid_web_charge.py - Updated for new models/schemas
-from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi import APIRouter, HTTPException, Depends, Query, BackgroundTasks
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel, Field
+from sqlalchemy import select, and_
 from sqlalchemy.ext.asyncio import AsyncSession
-from database import get_db
-from datetime import datetime, timedelta, timezone
+from database import get_db, db_session
+from config_sys import MYANMAR_TZ
+from datetime import datetime, timedelta
 import httpx
 import logging
 from typing import Optional, Literal
+from types import MappingProxyType
 from models.myid_models import MyIDCustomer, MyIDLogCharging, MyIDCustomerHistory, MyIDCustomerCancel
 from models.models import User
 import secrets
@@ -17,8 +21,9 @@ from services.myid_crypto import (
     sign_data_v2,
     decrypt_with_mps_private_key_v2
 )
-from urllib.parse import quote
+from urllib.parse import quote, parse_qsl
 import time, random
+import asyncio
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -36,14 +41,48 @@ MPS_HEADERS = {
     "Accept": "*/*"
 }
 
-MYANMAR_TZ = timezone(timedelta(hours=6, minutes=30))
+# Phần cố định của URL charge (base_url, PRO, SER) dựng 1 lần lúc import
+_MPS_URL_PREFIX = (
+    f"{MPS_CONFIG['base_url']}?PRO={MPS_CONFIG['cp_code']}"
+    f"&SER={MPS_CONFIG['service_name']}&SUB="
+)
+
+# Client HTTP dùng chung cho mọi lần gọi MPS: giữ keep-alive + TLS session,
+# không bắt tay TLS lại với mpsapi mỗi lượt charge. Tạo lazy, đóng khi app shutdown
+_mps_client: Optional[httpx.AsyncClient] = None
+# Pool rộng cho charge đồng thời (mặc định httpx chỉ 100 connection / 20 keep-alive),
+# connection rảnh giữ 60s để lượt charge sau dùng lại
+MPS_LIMITS = httpx.Limits(max_connections=200, max_keepalive_connections=100, keepalive_expiry=60)
+
+
+def get_mps_client() -> httpx.AsyncClient:
+    """httpx.AsyncClient dùng chung, tạo lazy lần đầu gọi"""
+    global _mps_client
+    if _mps_client is None or _mps_client.is_closed:
+        _mps_client = httpx.AsyncClient(timeout=MPS_CONFIG["timeout"], limits=MPS_LIMITS)
+    return _mps_client
+
+
+async def close_mps_client() -> None:
+    """Đóng client MPS (gọi lúc app shutdown)"""
+    global _mps_client
+    if _mps_client is not None:
+        await _mps_client.aclose()
+        _mps_client = None
+
+
+# Số lần thử ghi customer/history ở task nền sau charge
+CHARGE_RECORD_RETRIES = 3
+
 
 # ====== Request/Response Models ======
 class WebChargeRequest(BaseModel):
-    msisdn: str = Field(..., description="Số điện thoại (959xxxxxxxxx)")
+    # max_length theo cột DB (msisdn VARCHAR(20), myid_customer_history.channel VARCHAR(10)):
+    # chặn ngay từ request thay vì để lượt ghi DB sau khi MPS đã charge bị DataError
+    msisdn: str = Field(..., min_length=1, max_length=20, description="Số điện thoại (959xxxxxxxxx)")
     cmd: Literal["REGISTER", "CANCEL", "CHARGE"] = Field(..., description="Lệnh thực hiện")
     package_name: str = Field(..., description="Tên gói: DAILY, WEEKLY, MONTHLY, etc")
-    channel: str = Field(default="WEB", description="Kênh: WEB hoặc WAP")
+    channel: str = Field(default="WEB", min_length=1, max_length=10, description="Kênh: WEB hoặc WAP")
     sub_service_name: Optional[str] = Field(None, description="Tên sub-service cụ thể")
     
 class WebChargeResponse(BaseModel):
@@ -57,7 +96,8 @@ class WebChargeResponse(BaseModel):
     data: Optional[dict] = None
 
 # ====== Package Configuration ======
-PACKAGE_CONFIG = {
+# Bảng tra cố định, chỉ đọc: MappingProxyType để không module nào sửa nhầm lúc runtime
+PACKAGE_CONFIG = MappingProxyType({
     "DAILY": {"price": 169, "duration_days": 1, "sub_service": "SUPER_MATINO_DAILY"},
     "WEEKLY": {"price": 599, "duration_days": 7, "sub_service": "SUPER_MATINO_WEEKLY"},
     "MONTHLY": {"price": 1799, "duration_days": 30, "sub_service": "SUPER_MATINO_MONTHLY"},
@@ -67,10 +107,10 @@ PACKAGE_CONFIG = {
     "BUY4": {"price": 1500, "duration_days": 1, "sub_service": "SUPER_MATINO_BUY4"},
     "BUY5": {"price": 2250, "duration_days": 1, "sub_service": "SUPER_MATINO_BUY5"},
     "BUY6": {"price": 3750, "duration_days": 1, "sub_service": "SUPER_MATINO_BUY6"}
-}
+})
 
 # ====== StaticCode Mapping ======
-MPS_CODE_MAP = {
+MPS_CODE_MAP = MappingProxyType({
     "0": "Transaction success",
     "100": "Transaction was processed",
     "1": "msisdn not found",
@@ -116,27 +156,49 @@ MPS_CODE_MAP = {
     "204": "MPS account exist but msisdn not register CP service",
     "205": "MPS account exist and registed CP service",
     "503": "MPS was error",
-}
+})
+
+# Mã MPS -> status nội bộ, mã không có trong bảng là failed
+_MPS_STATUS = MappingProxyType({
+    "0": "success",
+    "416": "user_cancel",
+    "417": "timeout",
+})
 
 # ====== Helper Functions ======
-async def ensure_user_exists(db: AsyncSession, msisdn: str, channel: str = "WEB") -> User:
-    """Đảm bảo user tồn tại trong database"""
-    from sqlalchemy import select
-    result = await db.execute(select(User).where(User.msisdn == msisdn))
-    user = result.scalar_one_or_none()
-
-    if not user:
-        user = User(
-            msisdn=msisdn,
-            display_name=f"user_{msisdn[-4:]}",
-            email=None,
-            country="MM",
-            api_token=secrets.token_hex(32)
-        )
-        db.add(user)
-        await db.commit()
-        await db.refresh(user)
-    return user
+def _new_user(msisdn: str) -> User:
+    """User mới cho số chưa có tài khoản (chưa add vào session)"""
+    return User(
+        msisdn=msisdn,
+        display_name=f"user_{msisdn[-4:]}",
+        email=None,
+        country="MM",
+        api_token=secrets.token_hex(32)
+    )
+
+
+async def _load_user_and_customer(db: AsyncSession, msisdn: str, package_name: str):
+    """
+    (user, customer của gói) bằng 1 SELECT users LEFT JOIN myid_customer
+    Chưa có user -> thêm 1 SELECT riêng cho customer (số đăng ký từ kênh khác)
+    """
+    row = (await db.execute(
+        select(User, MyIDCustomer)
+        .outerjoin(MyIDCustomer, and_(
+            MyIDCustomer.msisdn == User.msisdn,
+            MyIDCustomer.package_name == package_name
+        ))
+        .where(User.msisdn == msisdn)
+        .limit(1)
+    )).first()
+    if row is not None:
+        return row[0], row[1]
+
+    result = await db.execute(select(MyIDCustomer).where(
+        MyIDCustomer.msisdn == msisdn,
+        MyIDCustomer.package_name == package_name
+    ).limit(1))
+    return None, result.scalar_one_or_none()
 
 
 # async def call_mps_charge(msisdn: str, cmd: str, sub_service_name: str, price: int):
@@ -256,9 +318,6 @@ async def call_mps_charge(msisdn: str, cmd: str, sub_service_name: str, price: i
     Call MPS API, handle encryption and decryption (Java EncryptUtil compatible)
     """
     try:
-        import time, random, httpx
-        from urllib.parse import quote
-
         session_id = str(int(time.time() * 1000))
         request_id = str(random.randint(10000000000, 99999999999))
 
@@ -283,19 +342,14 @@ async def call_mps_charge(msisdn: str, cmd: str, sub_service_name: str, price: i
         signature = quote(signature_result["signature_base64"], safe='')
 
         full_url = (
-            f"{MPS_CONFIG['base_url']}?PRO={MPS_CONFIG['cp_code']}"
-            f"&SER={MPS_CONFIG['service_name']}"
-            f"&SUB={sub_service_name}"
-            f"&CMD={cmd}"
-            f"&DATA={quote(encrypted_data, safe='')}"
-            f"&SIG={signature}"
+            f"{_MPS_URL_PREFIX}{sub_service_name}&CMD={cmd}"
+            f"&DATA={quote(encrypted_data, safe='')}&SIG={signature}"
         )
 
         logger.info(f"🔗 step 6. url send mps: {full_url}")
 
         # STEP 5: Send request
-        async with httpx.AsyncClient(timeout=MPS_CONFIG["timeout"]) as client:
-            response = await client.get(full_url, headers=MPS_HEADERS)
+        response = await get_mps_client().get(full_url, headers=MPS_HEADERS)
 
         response_text = response.text.strip()
         logger.info(f"📩 step 7: data receive from MPS -> {response_text[:200]}")
@@ -314,7 +368,8 @@ async def call_mps_charge(msisdn: str, cmd: str, sub_service_name: str, price: i
 
         if decrypted_text:
             # Example: REQ=11111111111111&RES=417&MOBILE=9686368706&PRICE=0&CMD=MOBILE...
-            pairs = dict(item.split("=") for item in decrypted_text.split("&") if "=" in item)
+            # parse_qsl tách theo "=" đầu tiên: giá trị có "=" không làm hỏng cả lượt parse
+            pairs = dict(parse_qsl(decrypted_text, keep_blank_values=True))
             mps_code = pairs.get("RES", "500")
             mps_message = MPS_CODE_MAP.get(mps_code, "Unknown error")
             transaction_id = pairs.get("REQ", request_id)
@@ -346,12 +401,77 @@ def map_mps_status(mps_code: str) -> str:
     - 416, 417: timeout or user cancel
     - others: failed
     """
-    if mps_code == "0":
-        return "success"
-    elif mps_code in ["416", "417"]:
-        return "timeout" if mps_code == "417" else "user_cancel"
-    else:
-        return "failed"
+    return _MPS_STATUS.get(mps_code, "failed")
+
+def build_charge_log(
+    msisdn: str,
+    package_name: str,
+    cmd: str,
+    mps_result: dict,
+    channel: str,
+    now: datetime
+) -> MyIDLogCharging:
+    """Dòng myid_log_chargings cho 1 lượt gọi MPS (thành công hoặc thất bại)"""
+    package_info = PACKAGE_CONFIG.get(package_name, {})
+    status = map_mps_status(mps_result["code"])
+    common = dict(
+        msisdn=msisdn,
+        package_code=package_name,
+        reg_datetime=now,
+        channel=channel,
+        transaction_id=mps_result.get("transaction_id"),
+        mps_command=cmd,
+        mode="REAL"
+    )
+
+    if status != "success":
+        return MyIDLogCharging(
+            action='register' if cmd == "REGISTER" else 'cancel',
+            charge_price=package_info.get("price", 0) if cmd == "REGISTER" else None,
+            is_success=1,  # 1 = failed
+            **common
+        )
+    if cmd == "CANCEL":
+        return MyIDLogCharging(action='cancel', is_success=0, **common)
+
+    expire_dt = now + timedelta(days=package_info.get("duration_days", 1))
+    return MyIDLogCharging(
+        action='register' if cmd == "REGISTER" else 'one_time',
+        sta_datetime=now,
+        end_datetime=expire_dt,
+        expire_datetime=expire_dt,
+        charge_price=package_info.get("price", 0),
+        is_success=0,  # 0 = success in new schema
+        **common
+    )
+
+
+async def persist_charge_log(
+    db: AsyncSession,
+    msisdn: str,
+    package_name: str,
+    cmd: str,
+    mps_result: dict,
+    channel: str,
+    now: datetime
+) -> bool:
+    """
+    Ghi ngay myid_log_chargings (1 INSERT) trong request: còn dấu vết đối soát
+    kể cả khi task nền cập nhật customer/history lỗi. Lỗi -> False, để task nền ghi lại
+    """
+    try:
+        db.add(build_charge_log(msisdn, package_name, cmd, mps_result, channel, now))
+        await db.commit()
+        return True
+    except Exception as e:
+        await db.rollback()
+        logger.error(
+            f"Charge log insert failed: msisdn={msisdn}, package={package_name}, "
+            f"cmd={cmd}, mps_result={mps_result}: {str(e)}",
+            exc_info=True
+        )
+        return False
+
 
 async def update_customer_record(
     db: AsyncSession,
@@ -359,27 +479,31 @@ async def update_customer_record(
     package_name: str,
     cmd: str,
     mps_result: dict,
-    channel: str
+    channel: str,
+    now: Optional[datetime] = None,
+    with_charge_log: bool = True
 ) -> None:
-    """Update database after charge - Updated for new schema"""
-    from sqlalchemy import select
-    
+    """
+    Update database after charge - Updated for new schema
+    1 transaction: 1 SELECT user + customer, các row mới gom lại add_all, commit 1 lần
+    with_charge_log=False khi myid_log_chargings đã được ghi riêng (persist_charge_log)
+    """
     try:
-        now = datetime.now(MYANMAR_TZ)
+        now = now or datetime.now(MYANMAR_TZ)
         package_info = PACKAGE_CONFIG.get(package_name, {})
-        await ensure_user_exists(db, msisdn, channel)
+        user, customer = await _load_user_and_customer(db, msisdn, package_name)
         status = map_mps_status(mps_result["code"])
+
+        # Row mới (user, customer, log, history...) add 1 lần trước commit
+        pending = []
+        if user is None:
+            pending.append(_new_user(msisdn))
         
         # ✅ REGISTER SUCCESS
         if cmd == "REGISTER" and status == "success":
             expire_dt = now + timedelta(days=package_info.get("duration_days", 1))
             
-            stmt = select(MyIDCustomer).where(
-                MyIDCustomer.msisdn == msisdn,
-                MyIDCustomer.package_name == package_name
-            )
-            result = await db.execute(stmt)
-            existing = result.scalar_one_or_none()
+            existing = customer
             
             if existing:
                 # Update existing customer
@@ -404,25 +528,8 @@ async def update_customer_record(
                     price=package_info.get("price", 0),
                     note="Web charge - New registration"
                 )
-                db.add(new_customer)
+                pending.append(new_customer)
             
-            # Log charging
-            log_entry = MyIDLogCharging(
-                action='register',
-                msisdn=msisdn,
-                package_code=package_name,
-                reg_datetime=now,
-                sta_datetime=now,
-                end_datetime=expire_dt,
-                expire_datetime=expire_dt,
-                channel=channel,
-                charge_price=package_info.get("price", 0),
-                transaction_id=mps_result.get("transaction_id"),
-                mps_command=cmd,
-                mode="REAL",
-                is_success=0  # 0 = success in new schema
-            )
-            db.add(log_entry)
             
             # History
             history = MyIDCustomerHistory(
@@ -441,18 +548,13 @@ async def update_customer_record(
                 action='register',
                 result=0  # 0 = success
             )
-            db.add(history)
+            pending.append(history)
             
         elif cmd == "CHARGE" and status == "success":
             expire_dt = now + timedelta(days=package_info.get("duration_days", 1))
 
             # Cập nhật hoặc tạo mới MyIDCustomer
-            stmt = select(MyIDCustomer).where(
-                MyIDCustomer.msisdn == msisdn,
-                MyIDCustomer.package_name == package_name
-            )
-            result = await db.execute(stmt)
-            existing = result.scalar_one_or_none()
+            existing = customer
 
             if existing:
                 existing.current_charged_date = now
@@ -473,25 +575,8 @@ async def update_customer_record(
                     price=package_info.get("price", 0),
                     note="Web charge - New charge"
                 )
-                db.add(new_customer)
+                pending.append(new_customer)
 
-            # Log charging
-            log_entry = MyIDLogCharging(
-                action='one_time',
-                msisdn=msisdn,
-                package_code=package_name,
-                reg_datetime=now,
-                sta_datetime=now,
-                end_datetime=expire_dt,
-                expire_datetime=expire_dt,
-                channel=channel,
-                charge_price=package_info.get("price", 0),
-                transaction_id=mps_result.get("transaction_id"),
-                mps_command=cmd,
-                mode="REAL",
-                is_success=0  # 0 = success
-            )
-            db.add(log_entry)
 
             # History
             history = MyIDCustomerHistory(
@@ -510,17 +595,10 @@ async def update_customer_record(
                 action='one_time',
                 result=0
             )
-            db.add(history)
+            pending.append(history)
             
         # ✅ CANCEL SUCCESS
         elif cmd == "CANCEL" and status == "success":
-            stmt = select(MyIDCustomer).where(
-                MyIDCustomer.msisdn == msisdn,
-                MyIDCustomer.package_name == package_name
-            )
-            result = await db.execute(stmt)
-            customer = result.scalar_one_or_none()
-            
             if customer:
                 # Move to cancel table
                 cancel_record = MyIDCustomerCancel(
@@ -539,24 +617,11 @@ async def update_customer_record(
                     cancel_reason="Web cancellation",
                     transaction_id=mps_result.get("transaction_id")
                 )
-                db.add(cancel_record)
+                pending.append(cancel_record)
                 
                 # Delete from active customers
                 await db.delete(customer)
             
-            # Log charging
-            log_entry = MyIDLogCharging(
-                action='cancel',
-                msisdn=msisdn,
-                package_code=package_name,
-                reg_datetime=now,
-                channel=channel,
-                transaction_id=mps_result.get("transaction_id"),
-                mps_command=cmd,
-                mode="REAL",
-                is_success=0  # 0 = success
-            )
-            db.add(log_entry)
             
             # History
             history = MyIDCustomerHistory(
@@ -572,7 +637,7 @@ async def update_customer_record(
                 action='cancel',
                 result=0  # 0 = success
             )
-            db.add(history)
+            pending.append(history)
         
         # ✅ FAILED REQUESTS
         if status != "success":
@@ -590,23 +655,13 @@ async def update_customer_record(
                 result=1,  # 1 = failed
                 note=f"Web charge failed - {mps_result.get('message', 'Unknown error')}"
             )
-            db.add(history)
+            pending.append(history)
             
-            # Log charging failed
-            log_entry = MyIDLogCharging(
-                action='register' if cmd == "REGISTER" else 'cancel',
-                msisdn=msisdn,
-                package_code=package_name,
-                reg_datetime=now,
-                channel=channel,
-                charge_price=package_info.get("price", 0) if cmd == "REGISTER" else None,
-                transaction_id=mps_result.get("transaction_id"),
-                mps_command=cmd,
-                mode="REAL",
-                is_success=1  # 1 = failed
-            )
-            db.add(log_entry)
         
+        if with_charge_log:
+            pending.append(build_charge_log(msisdn, package_name, cmd, mps_result, channel, now))
+
+        db.add_all(pending)
         await db.commit()
         
     except Exception as e:
@@ -614,25 +669,73 @@ async def update_customer_record(
         await db.rollback()
         raise
 
+
+async def record_charge_in_background(
+    msisdn: str,
+    package_name: str,
+    cmd: str,
+    mps_result: dict,
+    channel: str,
+    now: datetime,
+    with_charge_log: bool
+) -> None:
+    """
+    Ghi DB sau charge, chạy bằng BackgroundTasks sau khi đã trả response
+    - Session riêng mỗi lần thử: session của request (Depends) đã đóng khi task chạy
+    - update_customer_record là 1 transaction (lỗi thì rollback hết) nên thử lại được,
+      tối đa CHARGE_RECORD_RETRIES lần, chờ tăng dần giữa các lần
+    """
+    for attempt in range(1, CHARGE_RECORD_RETRIES + 1):
+        try:
+            async with db_session() as db:
+                await update_customer_record(
+                    db=db,
+                    msisdn=msisdn,
+                    package_name=package_name,
+                    cmd=cmd,
+                    mps_result=mps_result,
+                    channel=channel,
+                    now=now,
+                    with_charge_log=with_charge_log
+                )
+            return
+        except Exception as e:
+            if attempt == CHARGE_RECORD_RETRIES:
+                # MPS đã charge xong -> log đủ để đối soát với myid_log_chargings
+                logger.error(
+                    f"Background customer update failed: msisdn={msisdn}, package={package_name}, "
+                    f"cmd={cmd}, mps_result={mps_result}: {str(e)}",
+                    exc_info=True
+                )
+                return
+            logger.warning(
+                f"Retry background customer update ({attempt}/{CHARGE_RECORD_RETRIES}): "
+                f"msisdn={msisdn}, package={package_name}: {e}"
+            )
+            await asyncio.sleep(attempt)
+
 # ====== API Endpoints ======
 @router.post("/web/charge", response_model=WebChargeResponse)
 async def web_charge(
     request: WebChargeRequest,
+    background_tasks: BackgroundTasks,
     db: AsyncSession = Depends(get_db)
 ):
     """
     Web charge endpoint - Updated for new models/schemas
+    Log charge ghi ngay trong request; customer/history chạy nền sau khi trả response
+    (MPS đã xử lý xong charge)
     """
     try:
-        logger.info(f"Web charge request: {request.dict()}")
+        logger.info("Web charge request: %s", request.model_dump())
         
-        if request.package_name not in PACKAGE_CONFIG:
+        package_info = PACKAGE_CONFIG.get(request.package_name)
+        if package_info is None:
             raise HTTPException(
                 status_code=400,
                 detail=f"Invalid package: {request.package_name}"
             )
         
-        package_info = PACKAGE_CONFIG[request.package_name]
         sub_service = request.sub_service_name or package_info["sub_service"]
         
         # Call MPS API
@@ -645,25 +748,30 @@ async def web_charge(
         
         # Map status
         internal_status = map_mps_status(mps_result["code"])
-        
-        # Update database
-        await update_customer_record(
-            db=db,
+        now = datetime.now(MYANMAR_TZ)
+
+        # Log charge: 1 INSERT đồng bộ; customer/history: chạy nền, không chặn response
+        charge_logged = await persist_charge_log(
+            db, request.msisdn, request.package_name, request.cmd, mps_result, request.channel, now
+        )
+        background_tasks.add_task(
+            record_charge_in_background,
             msisdn=request.msisdn,
             package_name=request.package_name,
             cmd=request.cmd,
             mps_result=mps_result,
-            channel=request.channel
+            channel=request.channel,
+            now=now,
+            with_charge_log=not charge_logged
         )
         
         # Calculate expire datetime
         expire_dt = None
         if internal_status == "success":
-            now = datetime.now(MYANMAR_TZ)
             expire_dt = now + timedelta(days=package_info["duration_days"])
         
-        # Build response
-        response = WebChargeResponse(
+        # Build response: dữ liệu do server tự tạo -> model_construct, không chạy validator
+        response = WebChargeResponse.model_construct(
             status=internal_status,
             message=get_user_message(request.cmd, internal_status),
             mps_code=mps_result["code"],
@@ -678,8 +786,12 @@ async def web_charge(
             }
         )
         
-        logger.info(f"Web charge response: {response.dict()}")
-        return response
+        # Trả Response trực tiếp: FastAPI bỏ qua validate lại response_model + jsonable_encoder
+        # (response_model giữ lại cho OpenAPI docs); orjson tự serialize datetime
+        # background_tasks vẫn được FastAPI gắn vào response này
+        content = response.model_dump()
+        logger.info(f"Web charge response: {content}")
+        return ORJSONResponse(content=content)
         
     except HTTPException:
         raise
@@ -687,19 +799,22 @@ async def web_charge(
         logger.error(f"Error in web_charge: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+# (cmd, status) -> thông báo cho user, dựng 1 lần lúc import
+_USER_MESSAGES = MappingProxyType({
+    ("REGISTER", "success"): "Đăng ký gói thành công!",
+    ("REGISTER", "failed"): "Đăng ký thất bại. Vui lòng thử lại.",
+    ("REGISTER", "user_cancel"): "Bạn đã hủy đăng ký.",
+    ("REGISTER", "timeout"): "Yêu cầu hết thời gian. Vui lòng thử lại.",
+    ("CANCEL", "success"): "Hủy gói thành công!",
+    ("CANCEL", "failed"): "Hủy gói thất bại. Vui lòng thử lại.",
+    ("CHARGE", "success"): "Gia hạn gói thành công!",
+    ("CHARGE", "failed"): "Gia hạn thất bại. Vui lòng kiểm tra tài khoản.",
+})
+
+
 def get_user_message(cmd: str, status: str) -> str:
     """Generate user-friendly message"""
-    messages = {
-        ("REGISTER", "success"): "Đăng ký gói thành công!",
-        ("REGISTER", "failed"): "Đăng ký thất bại. Vui lòng thử lại.",
-        ("REGISTER", "user_cancel"): "Bạn đã hủy đăng ký.",
-        ("REGISTER", "timeout"): "Yêu cầu hết thời gian. Vui lòng thử lại.",
-        ("CANCEL", "success"): "Hủy gói thành công!",
-        ("CANCEL", "failed"): "Hủy gói thất bại. Vui lòng thử lại.",
-        ("CHARGE", "success"): "Gia hạn gói thành công!",
-        ("CHARGE", "failed"): "Gia hạn thất bại. Vui lòng kiểm tra tài khoản.",
-    }
-    return messages.get((cmd, status), "Xử lý yêu cầu thất bại.")
+    return _USER_MESSAGES.get((cmd, status), "Xử lý yêu cầu thất bại.")
 
 @router.get("/web/check-subscription")
 async def check_subscription(
@@ -707,7 +822,6 @@ async def check_subscription(
     db: AsyncSession = Depends(get_db)
 ):
     """Check user subscription status - Updated for new schema"""
-    from sqlalchemy import select
     
     try:
         stmt = select(MyIDCustomer).where(
@@ -717,7 +831,8 @@ async def check_subscription(
         result = await db.execute(stmt)
         subscriptions = result.scalars().all()
         
-        return {
+        # ORJSONResponse trực tiếp, không qua jsonable_encoder của FastAPI
+        return ORJSONResponse(content={
             "msisdn": msisdn,
             "has_subscription": len(subscriptions) > 0,
             "subscriptions": [
@@ -730,7 +845,7 @@ async def check_subscription(
                 }
                 for sub in subscriptions
             ]
-        }
+        })
         
     except Exception as e:
         logger.error(f"Error checking subscription: {str(e)}")
@@ -16,7 +16,9 @@ from schemas.shop_package import (
     ShopPackageCreate,
     ShopPackageUpdate
 )
+from fastapi.responses import Response
 from typing import List, Optional
+from utils import json_utils
 import logging
 
 logger = logging.getLogger(__name__)
@@ -217,6 +219,19 @@ async def delete_item(
 
 # ==================== PACKAGES ENDPOINTS ====================
 
+# Chỉ các cột có trong ShopPackageResponse, select bằng Core để serialize thẳng bằng orjson
+PACKAGE_LIST_COLUMNS = (
+    ShopPackage.id,
+    ShopPackage.package_name,
+    ShopPackage.package_type,
+    ShopPackage.duration_days,
+    ShopPackage.price,
+    ShopPackage.benefits,
+    ShopPackage.description,
+    ShopPackage.is_active,
+    ShopPackage.sort_order,
+)
+
 @router.get("/packages", response_model=List[ShopPackageResponse])
 async def get_all_packages(
     package_type: Optional[str] = Query(None, description="Filter by type: subscription or onetime"),
@@ -224,7 +239,7 @@ async def get_all_packages(
 ):
     """Lấy tất cả packages (có thể filter theo type)"""
     try:
-        query = select(ShopPackage).where(ShopPackage.is_active == True)
+        query = select(*PACKAGE_LIST_COLUMNS).where(ShopPackage.is_active == True)
         
         if package_type:
             query = query.where(ShopPackage.package_type == package_type)
@@ -232,10 +247,11 @@ async def get_all_packages(
         query = query.order_by(ShopPackage.sort_order, ShopPackage.id)
         
         result = await db.execute(query)
-        packages = result.scalars().all()
+        packages = [dict(r) for r in result.mappings()]
         
         logger.info(f"Retrieved {len(packages)} packages (type: {package_type or 'all'})")
-        return packages
+        # Trả Response thô: bỏ qua validate/serialize của Pydantic, orjson encode ở tầng C
+        return Response(content=json_utils.dumps(packages), media_type="application/json")
         
     except Exception as e:
         logger.error(f"Error fetching packages: {str(e)}")
@@ -2,15 +2,15 @@ import random
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from datetime import datetime, timedelta, timezone
+from datetime import datetime
 
 from models.models import User, GameStatementSummary, SpinReward
 from database import get_db
+from config_sys import MYANMAR_TZ
 from typing import List
 from pydantic import BaseModel
 
 router = APIRouter()
-MYANMAR_TZ = timezone(timedelta(hours=6, minutes=30))
 
 class SpinRewardPartialUpdate(BaseModel):
     id: int
@@ -2,7 +2,6 @@ from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from redis.asyncio import Redis
-import json
 import asyncio
 from datetime import datetime
 
@@ -11,6 +10,8 @@ from database import get_db
 import config_sys
 from fastapi.responses import JSONResponse
 from utils.auth_helper import get_user_from_auth
+from utils import json_utils
+from utils.profile_helper import extract_profile
 
 # =============================
 # Redis setup
@@ -61,12 +62,15 @@ async def upsert_statement_and_summary(
 ) -> int:
     """Insert if no statement; otherwise update JSON + summary. Returns statement_id."""
     if existing_stmt is None:
+        name, avatar = extract_profile(merged_data)
         stmt = GameStatement(
             user_id=user_id,
             session_id=None,
             file_name=None,
             payload_version=1,
-            statement_json=json.dumps(merged_data)
+            statement_json=json_utils.dumps(merged_data),
+            name=name,
+            avatar=avatar
         )
         db.add(stmt)
         await db.flush()
@@ -87,11 +91,12 @@ async def upsert_statement_and_summary(
         db.add(summary)
     else:
         try:
-            current_data = json.loads(existing_stmt.statement_json) if existing_stmt.statement_json else {}
-        except json.JSONDecodeError:
+            current_data = json_utils.loads(existing_stmt.statement_json) if existing_stmt.statement_json else {}
+        except json_utils.JSONDecodeError:
             current_data = {}
         current_data.update(merged_data)
-        existing_stmt.statement_json = json.dumps(current_data)
+        existing_stmt.statement_json = json_utils.dumps(current_data)
+        existing_stmt.name, existing_stmt.avatar = extract_profile(current_data)
 
         result = await db.execute(select(GameStatementSummary).where(GameStatementSummary.statement_id == existing_stmt.id))
         summary = result.scalars().first()
@@ -154,20 +159,20 @@ async def rt_update_game_statement(payload: dict, db: AsyncSession = Depends(get
         base = {}
         if stmt and stmt.statement_json:
             try:
-                base = json.loads(stmt.statement_json)
-            except json.JSONDecodeError:
+                base = json_utils.loads(stmt.statement_json)
+            except json_utils.JSONDecodeError:
                 base = {}
     else:
         try:
-            base = json.loads(raw)
-        except json.JSONDecodeError:
+            base = json_utils.loads(raw)
+        except json_utils.JSONDecodeError:
             base = {}
 
     base.update(patch)
 
     pipe = r.pipeline()
     pipe.hset(key, mapping={
-        "data": json.dumps(base),
+        "data": json_utils.dumps(base),
         "updated_at": datetime.utcnow().isoformat()
     })
     pipe.hincrby(key, "version", 1)
@@ -196,25 +201,25 @@ async def save_game_statement(payload: dict, db: AsyncSession = Depends(get_db))
     key = rt_key(user_id)
 
     raw = await r.hget(key, "data")
+    # Statement mới nhất chỉ đọc 1 lần, dùng cho cả fallback dữ liệu lẫn upsert
+    existing_stmt = await get_latest_statement(db, user_id)
     data: dict
     if raw:
         try:
-            data = json.loads(raw)
-        except json.JSONDecodeError:
+            data = json_utils.loads(raw)
+        except json_utils.JSONDecodeError:
             data = json_data or {}
     else:
         if not isinstance(json_data, dict):
-            stmt = await get_latest_statement(db, user_id)
-            if not stmt:
+            if not existing_stmt:
                 raise HTTPException(status_code=400, detail="No Redis state. Provide json_data for first-time save.")
             try:
-                data = json.loads(stmt.statement_json or "{}")
-            except json.JSONDecodeError:
+                data = json_utils.loads(existing_stmt.statement_json or "{}")
+            except json_utils.JSONDecodeError:
                 data = {}
         else:
             data = json_data
 
-    existing_stmt = await get_latest_statement(db, user_id)
     stmt_id = await upsert_statement_and_summary(db, user_id, data, existing_stmt)
 
     await r.hset(key, mapping={"last_flush_version": await r.hget(key, "version") or 0})
@@ -231,9 +236,9 @@ async def get_game_statement(user_id: int, db: AsyncSession = Depends(get_db)):
     raw = await r.hget(key, "data")
     if raw:
         try:
-            data = json.loads(raw)
+            data = json_utils.loads(raw)
             source = "redis"
-        except json.JSONDecodeError:
+        except json_utils.JSONDecodeError:
             data = None
             source = "redis-invalid"
     else:
@@ -245,8 +250,8 @@ async def get_game_statement(user_id: int, db: AsyncSession = Depends(get_db)):
         if not stmt:
             raise HTTPException(status_code=404, detail="No statements found for this user")
         try:
-            data = json.loads(stmt.statement_json)
-        except json.JSONDecodeError:
+            data = json_utils.loads(stmt.statement_json)
+        except json_utils.JSONDecodeError:
             raise HTTPException(status_code=500, detail="Invalid JSON data stored")
         return {"status": "success", "source": source, "statement_id": stmt.id, "user_id": stmt.user_id, "json_data": data}
 
@@ -263,8 +268,8 @@ async def admin_flush_realtime(user_id: int, db: AsyncSession = Depends(get_db))
     if not raw:
         raise HTTPException(status_code=404, detail="No realtime state in Redis")
     try:
-        data = json.loads(raw)
-    except json.JSONDecodeError:
+        data = json_utils.loads(raw)
+    except json_utils.JSONDecodeError:
         raise HTTPException(status_code=400, detail="Bad JSON in Redis")
 
     existing_stmt = await get_latest_statement(db, user_id)
@@ -7,13 +7,14 @@ from sqlalchemy import text
 from datetime import datetime, timedelta
 import secrets
 import httpx
-import json
 import base64
 from fastapi.responses import JSONResponse, RedirectResponse
 
 from models.models import User, GameStatement
 from utils.auth_helper import get_user_from_auth
 from utils.response_helper import response_ok, response_error
+from utils import json_utils
+from utils.profile_helper import extract_profile
 from database import get_db
 
 router = APIRouter()
@@ -168,7 +169,7 @@ async def check_status(
             "user_id": user.id,
             "token": user.api_token,
             "status": status_message,
-            "statement_json": json.loads(statement.statement_json or "{}"),
+            "statement_json": json_utils.loads(statement.statement_json or "{}"),
             "subscription_source": "myid_customers"  # Để debug
         }
         
@@ -290,7 +291,14 @@ async def login_myid(
         user = result.scalars().first()
 
         if not user:
-            display_name = username or f"user_{msisdn[-4:]}"
+            # Header/query do client gửi: cắt/kẹp về giới hạn cột như lúc save statement
+            # (DataError ở đây làm hỏng cả lượt login đầu vì user + statement commit chung)
+            display_name, avatar_id = extract_profile({
+                "name": username or f"user_{msisdn[-4:]}",
+                "avatar": avatar
+            })
+            display_name = display_name or f"user_{msisdn[-4:]}"
+            avatar_id = avatar_id or 0
             logger.info(f"Creating new user: {display_name}")
             
             user = User(
@@ -301,18 +309,21 @@ async def login_myid(
                 api_token=secrets.token_hex(32)
             )
             db.add(user)
-            await db.commit()
-            await db.refresh(user)
+            # flush để có user.id (LAST_INSERT_ID), commit chung với statement bên dưới
+            # -> không cần refresh đọc lại user, không còn user thiếu statement
+            await db.flush()
 
             # Tạo default statement
             statement = GameStatement(
                 user_id=user.id,
-                statement_json=json.dumps({
+                statement_json=json_utils.dumps({
                     "coins": 100,
                     "scores": 0,
                     "name": display_name,
-                    "avatar": int(avatar) if avatar and avatar.isdigit() else 0,
-                })
+                    "avatar": avatar_id,
+                }),
+                name=display_name,
+                avatar=avatar_id
             )
             db.add(statement)
             await db.commit()
@@ -1,13 +1,21 @@
 # scheduler_setup.py - Cấu hình APScheduler cho leaderboard ETL
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
-from datetime import datetime, timezone
-from database import AsyncSessionLocal
-from tasks.leaderboard_etl import snapshot_daily, snapshot_weekly, snapshot_monthly
+from apscheduler.triggers.interval import IntervalTrigger
+from datetime import datetime, timezone, timedelta
+from database import db_session
+from config_sys import MYANMAR_TZ
+from tasks.leaderboard_etl import apply_leaderboard_mlog, snapshot_finished_periods, MLOG_BATCH_SIZE
+from tasks.myid_partitions import ensure_monthly_partitions
 import logging
+import os
 
 logger = logging.getLogger(__name__)
-scheduler = AsyncIOScheduler()
+# coalesce + max_instances=1: không chạy chồng snapshot, lượt lỡ gộp thành 1
+JOB_DEFAULTS = {"coalesce": True, "max_instances": 1, "misfire_grace_time": 3600}
+scheduler = AsyncIOScheduler(job_defaults=JOB_DEFAULTS)
+# Chu kỳ (phút) áp dụng gameplay_history_mlog vào leaderboard_history
+LB_MLOG_INTERVAL_MIN = int(os.getenv("LB_MLOG_INTERVAL_MIN", 5))
 
 # Myanmar timezone offset: UTC+6:30
 # Để chuyển từ Myanmar time sang UTC, trừ đi 6h30
@@ -15,79 +23,94 @@ scheduler = AsyncIOScheduler()
 # Myanmar 23:50 = UTC 17:20
 # Myanmar 23:55 = UTC 17:25
 
-async def snapshot_job(period: str):
+async def leaderboard_mlog_job():
     """
-    Wrapper job để chạy snapshot với async session
+    Áp dụng hết gameplay_history_mlog đang chờ vào leaderboard_history (theo lô)
     """
-    async with AsyncSessionLocal() as db:
+    async with db_session() as db:
         try:
-            logger.info(f"🚀 Starting {period} leaderboard snapshot...")
             start_time = datetime.now(timezone.utc)
-            
-            if period == "daily":
-                count = await snapshot_daily(db)
-            elif period == "weekly":
-                count = await snapshot_weekly(db)
-            elif period == "monthly":
-                count = await snapshot_monthly(db)
-            else:
-                logger.error(f"Unknown period: {period}")
-                return
-            
-            elapsed = (datetime.now(timezone.utc) - start_time).total_seconds()
-            logger.info(f"✅ {period.capitalize()} snapshot completed in {elapsed:.2f}s, processed {count} records")
-            
+            total = 0
+            while True:
+                count = await apply_leaderboard_mlog(db)
+                total += count
+                if count < MLOG_BATCH_SIZE:
+                    break
+
+            if total:
+                elapsed = (datetime.now(timezone.utc) - start_time).total_seconds()
+                logger.info(f"✅ Leaderboard mlog applied in {elapsed:.2f}s, processed {total} rows")
+
+        except Exception as e:
+            logger.error(f"❌ Error applying leaderboard mlog: {str(e)}", exc_info=True)
+
+async def best_snapshot_job():
+    """Chốt leaderboard_snapshot (best-per-level) cho các kỳ kết thúc hôm qua (Myanmar time)"""
+    async with db_session() as db:
+        try:
+            yesterday = datetime.now(MYANMAR_TZ).date() - timedelta(days=1)
+            count = await snapshot_finished_periods(db, yesterday)
+            logger.info(f"✅ Best-per-level snapshot for periods ending {yesterday}: {count} rows")
+        except Exception as e:
+            logger.error(f"❌ Error in best-per-level snapshot: {str(e)}", exc_info=True)
+
+async def partition_job():
+    """Tách sẵn partition tháng tới cho các bảng lịch sử MyID"""
+    async with db_session() as db:
+        try:
+            count = await ensure_monthly_partitions(db)
+            logger.info(f"✅ Partition maintenance done, created {count} partitions")
         except Exception as e:
-            logger.error(f"❌ Error in {period} snapshot: {str(e)}", exc_info=True)
-        finally:
-            await db.close()
+            logger.error(f"❌ Error in partition maintenance: {str(e)}", exc_info=True)
 
 def setup_leaderboard_scheduler():
     """
     Thiết lập lịch chạy ETL cho leaderboard
-    Chạy vào khung giờ ít người chơi (23:45-23:59 Myanmar time)
     """
     
-    # Daily snapshot: 23:45 Myanmar time = 17:15 UTC
+    # BXH daily/weekly/monthly: cập nhật incremental từ mlog mỗi vài phút
+    # thay cho snapshot tính lại toàn kỳ cuối ngày/tuần/tháng
     scheduler.add_job(
-        snapshot_job,
-        CronTrigger(hour=17, minute=15, timezone='UTC'),
-        args=["daily"],
-        id="daily_snapshot",
-        name="Daily Leaderboard Snapshot",
+        leaderboard_mlog_job,
+        IntervalTrigger(minutes=LB_MLOG_INTERVAL_MIN),
+        id="leaderboard_mlog",
+        name="Leaderboard Incremental Refresh",
         replace_existing=True
     )
-    logger.info("📅 Scheduled daily leaderboard snapshot at 23:45 Myanmar time (17:15 UTC)")
-    
-    # Weekly snapshot: Sunday 23:50 Myanmar time = Sunday 17:20 UTC
+    logger.info(f"📅 Scheduled incremental leaderboard refresh every {LB_MLOG_INTERVAL_MIN} minutes")
+
+    # Chốt BXH admin các kỳ vừa kết thúc: 00:15 Myanmar time = 17:45 UTC
     scheduler.add_job(
-        snapshot_job,
-        CronTrigger(day_of_week='sun', hour=17, minute=20, timezone='UTC'),
-        args=["weekly"],
-        id="weekly_snapshot",
-        name="Weekly Leaderboard Snapshot",
+        best_snapshot_job,
+        CronTrigger(hour=17, minute=45, timezone='UTC'),
+        id="leaderboard_best_snapshot",
+        name="Admin Leaderboard Period Snapshot",
         replace_existing=True
     )
-    logger.info("📅 Scheduled weekly leaderboard snapshot at Sunday 23:50 Myanmar time (17:20 UTC)")
-    
-    # Monthly snapshot: Last day of month 23:55 Myanmar time = 17:25 UTC
+    logger.info("📅 Scheduled admin leaderboard period snapshot at 00:15 Myanmar time (17:45 UTC)")
+
+    # Partition maintenance: ngày 20 hàng tháng 03:00 Myanmar time = 20:30 UTC ngày 19
     scheduler.add_job(
-        snapshot_job,
-        CronTrigger(day='last', hour=17, minute=25, timezone='UTC'),
-        args=["monthly"],
-        id="monthly_snapshot",
-        name="Monthly Leaderboard Snapshot",
+        partition_job,
+        CronTrigger(day=19, hour=20, minute=30, timezone='UTC'),
+        id="myid_partition_maintenance",
+        name="MyID History Partition Maintenance",
         replace_existing=True
     )
-    logger.info("📅 Scheduled monthly leaderboard snapshot at last day 23:55 Myanmar time (17:25 UTC)")
+    logger.info("📅 Scheduled MyID partition maintenance on day 20 03:00 Myanmar time (19th 20:30 UTC)")
 
 def start_scheduler():
-    """Khởi động scheduler"""
+    """Khởi động scheduler (bỏ qua nếu đã chạy)"""
+    if scheduler.running:
+        logger.info("⏰ APScheduler already running, skip start")
+        return
     setup_leaderboard_scheduler()
     scheduler.start()
     logger.info("⏰ APScheduler started successfully")
 
 def shutdown_scheduler():
     """Dừng scheduler"""
+    if not scheduler.running:
+        return
     scheduler.shutdown()
-    logger.info("⏰ APScheduler shut down")
\ No newline at end of file
+    logger.info("⏰ APScheduler shut down")
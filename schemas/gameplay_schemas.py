@@ -102,8 +102,8 @@ class GameplayHistoryItem(BaseModel):
     items_used: Optional[Dict[str, int]]
     items_earned: Optional[Dict[str, int]]
     game_mode: str
-    started_at: Optional[str]
-    created_at: Optional[str]
+    started_at: Optional[datetime]
+    created_at: Optional[datetime]
 
 
 class GameplayHistoryResponse(BaseModel):
@@ -112,6 +112,7 @@ class GameplayHistoryResponse(BaseModel):
     limit: int
     offset: int
     data: list[GameplayHistoryItem]
+    next_cursor: Optional[str] = Field(None, description="Cursor cho trang kế tiếp (None nếu hết)")
 
 
 class GameplayStatsResponse(BaseModel):
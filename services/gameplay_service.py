@@ -1,17 +1,52 @@
 # services/gameplay_service.py - Service layer for gameplay logging
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import func, and_, desc
+from sqlalchemy import func, and_, desc, literal
+from sqlalchemy.dialects.mysql import insert
+from sqlalchemy.exc import IntegrityError, OperationalError
 from datetime import datetime, timezone
 from typing import Optional, Dict, Any
-import json
 import logging
 
-from models.models import GameplayHistory, User
+from models.models import (
+    GameplayHistory, GameplayBestPerLevel, LeaderboardBestPerLevel, GameplayHistoryLog, User
+)
+from utils import json_utils
 
 logger = logging.getLogger(__name__)
 UTC = timezone.utc
 
+# Số lần thử lại khi 2 lượt chơi cùng (user, level) ghi đồng thời
+INSERT_RETRIES = 3
+MYSQL_DEADLOCK = 1213
+
+
+def best_per_level_merge(stmt) -> Dict[str, Any]:
+    """
+    Mapping ON DUPLICATE KEY UPDATE cho bảng rollup best-per-level
+    (gameplay_best_per_level / leaderboard_best_per_level), dùng chung cho upsert
+    lúc log gameplay và các job backfill
+    GREATEST/LEAST trên COALESCE để cột NULL (stars, duration) không làm mất giá trị cũ
+    """
+    t = stmt.table.c
+    new = stmt.inserted
+    merge = {
+        "best_score": func.greatest(t.best_score, new.best_score),
+        "best_stars": func.greatest(
+            func.coalesce(t.best_stars, new.best_stars),
+            func.coalesce(new.best_stars, t.best_stars)
+        ),
+        "best_duration": func.least(
+            func.coalesce(t.best_duration, new.best_duration),
+            func.coalesce(new.best_duration, t.best_duration)
+        )
+    }
+    # Chỉ gameplay_best_per_level có coins / thời điểm chơi gần nhất
+    for col in ("best_coins", "last_played_at"):
+        if col in t:
+            merge[col] = func.greatest(t[col], new[col])
+    return merge
+
 
 class GameplayService:
     """
@@ -39,6 +74,98 @@ class GameplayService:
         result = await db.execute(query)
         return result.scalar() or 1
 
+    @staticmethod
+    async def insert_gameplay(db: AsyncSession, values: Dict[str, Any]) -> int:
+        """
+        Insert 1 lượt chơi, play_attempt = MAX(play_attempt) + 1 tính ngay trong câu
+        INSERT ... SELECT (1 round-trip, không đọc rồi mới ghi)
+        - 2 request đồng thời trùng unique (user_id, level_code, play_attempt) hoặc
+          deadlock -> rollback rồi thử lại, nên gọi ở đầu transaction
+        - Không commit, trả về id vừa insert
+        """
+        columns = GameplayHistory.__table__.c
+        next_attempt = select(
+            *[literal(value, columns[key].type) for key, value in values.items()],
+            func.coalesce(func.max(GameplayHistory.play_attempt), 0) + 1
+        ).where(
+            and_(
+                GameplayHistory.user_id == values["user_id"],
+                GameplayHistory.level_code == values["level_code"]
+            )
+        )
+        stmt = insert(GameplayHistory).from_select(
+            [*values.keys(), "play_attempt"], next_attempt
+        )
+
+        for attempt in range(1, INSERT_RETRIES + 1):
+            try:
+                result = await db.execute(stmt)
+                return result.lastrowid
+            except (IntegrityError, OperationalError) as e:
+                await db.rollback()
+                retryable = isinstance(e, IntegrityError) or (
+                    getattr(e.orig, "args", (None,))[0] == MYSQL_DEADLOCK
+                )
+                if not retryable or attempt == INSERT_RETRIES:
+                    raise
+                logger.warning(
+                    f"Retry gameplay insert ({attempt}/{INSERT_RETRIES}): "
+                    f"user={values['user_id']}, level={values['level_code']}: {e}"
+                )
+
+    @staticmethod
+    async def upsert_best_per_level(db: AsyncSession, values: Dict[str, Any]) -> None:
+        """
+        Cập nhật rollup gameplay_best_per_level (+ leaderboard_best_per_level nếu normal)
+        cho lượt chơi vừa ghi (không commit)
+        """
+        if not values.get("level_code"):
+            return
+
+        stmt = insert(GameplayBestPerLevel).values(
+            user_id=values["user_id"],
+            played_date=values["started_at"].date(),
+            level_code=values["level_code"],
+            best_score=values["score"],
+            best_coins=values["coins_earned"],
+            best_stars=values.get("stars"),
+            best_duration=values.get("duration_seconds"),
+            last_played_at=values["started_at"]
+        )
+        stmt = stmt.on_duplicate_key_update(best_per_level_merge(stmt))
+        await db.execute(stmt)
+
+        # BXH all-time chỉ tính game_mode normal
+        if values.get("game_mode", "normal") != "normal":
+            return
+
+        stmt = insert(LeaderboardBestPerLevel).values(
+            user_id=values["user_id"],
+            level_code=values["level_code"],
+            best_score=values["score"],
+            best_stars=values.get("stars"),
+            best_duration=values.get("duration_seconds")
+        )
+        stmt = stmt.on_duplicate_key_update(best_per_level_merge(stmt))
+        await db.execute(stmt)
+
+    @staticmethod
+    async def append_change_log(db: AsyncSession, gameplay_id: int, values: Dict[str, Any]) -> None:
+        """
+        Ghi lượt chơi vào gameplay_history_mlog (không commit, cùng transaction với insert)
+        để job nền cập nhật leaderboard_history theo delta
+        """
+        await db.execute(insert(GameplayHistoryLog).values(
+            gameplay_id=gameplay_id,
+            user_id=values["user_id"],
+            level_code=values.get("level_code"),
+            score=values["score"],
+            coins_earned=values["coins_earned"],
+            stars=values.get("stars"),
+            duration_seconds=values.get("duration_seconds"),
+            started_at=values["started_at"]
+        ))
+
     @staticmethod
     async def log_gameplay(
         db: AsyncSession,
@@ -53,49 +180,39 @@ class GameplayService:
         items_used: Optional[Dict[str, int]] = None,
         items_earned: Optional[Dict[str, int]] = None,
         game_mode: str = "normal"
-    ) -> GameplayHistory:
+    ) -> int:
         """
-        Ghi log gameplay - chỉ insert, không tính delta
+        Ghi log gameplay - chỉ insert, không tính delta. Trả về id lượt chơi
         """
-        # Tính play_attempt
-        next_attempt = await GameplayService.calculate_next_attempt(
-            db, user_id, level_code
-        )
-
-        # Prepare JSON fields
-        items_start_json = json.dumps(items_start) if items_start else None
-        items_used_json = json.dumps(items_used) if items_used else None
-        items_earned_json = json.dumps(items_earned) if items_earned else None
-
-        # Tạo record
+        # JSON fields: JSONText tự encode bằng orjson khi bind
         now = datetime.now(UTC)
-        gameplay = GameplayHistory(
+        values = dict(
             user_id=user_id,
             msisdn=msisdn,
             level_code=level_code,
-            play_attempt=next_attempt,
             score=score,
             coins_earned=coins_earned,
             stars=stars,
             started_at=now,
             duration_seconds=duration_seconds,
-            items_start=items_start_json,
-            items_used=items_used_json,
-            items_earned=items_earned_json,
+            items_start=items_start or None,
+            items_used=items_used or None,
+            items_earned=items_earned or None,
             game_mode=game_mode,
             created_at=now
         )
 
-        db.add(gameplay)
+        gameplay_id = await GameplayService.insert_gameplay(db, values)
+        await GameplayService.upsert_best_per_level(db, values)
+        await GameplayService.append_change_log(db, gameplay_id, values)
         await db.commit()
-        await db.refresh(gameplay)
 
         logger.info(
-            f"Logged gameplay: user={user_id}, level={level_code}, "
-            f"attempt={next_attempt}, score={score}, coins={coins_earned}"
+            f"Logged gameplay: id={gameplay_id}, user={user_id}, level={level_code}, "
+            f"score={score}, coins={coins_earned}"
         )
 
-        return gameplay
+        return gameplay_id
 
     @staticmethod
     async def get_user_stats(
@@ -182,7 +299,7 @@ class GameplayService:
         if isinstance(val, (dict, list)):
             return val
         try:
-            return json.loads(val)
+            return json_utils.loads(val)
         except Exception as e:
             logger.warning(f"Failed to parse JSON: {e}")
             return None
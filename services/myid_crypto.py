@@ -12,6 +12,7 @@ import logging
 from pathlib import Path
 from urllib.parse import unquote
 from Crypto.Util.Padding import unpad
+from functools import lru_cache
 import re
 
 logger = logging.getLogger(__name__)
@@ -32,6 +33,9 @@ KEY_MAPPING = {
 }
 
 # ====== Load Keys from .pem files ======
+# Key đã parse được cache theo sub_service (đọc file + parse PEM/ASN.1 chỉ 1 lần),
+# file lỗi/thiếu thì không cache (lru_cache không lưu exception)
+@lru_cache(maxsize=64)
 def load_private_key(sub_service_name: str):
     """
     Load private key for signing from PRIVATE_CP.pem
@@ -52,6 +56,7 @@ def load_private_key(sub_service_name: str):
     logger.debug(f"Loaded private key from {key_file}")
     return private_key
 
+@lru_cache(maxsize=64)
 def load_public_vt_key_for_encryption(sub_service_name: str):
     """
     Load PUBLIC_VT_CP.pem for RSA encryption
@@ -71,6 +76,36 @@ def load_public_vt_key_for_encryption(sub_service_name: str):
     
     return rsa_public_key
 
+@lru_cache(maxsize=64)
+def load_private_key_for_decryption(sub_service_name: str):
+    """
+    Load PRIVATE_CP.pem for RSA decryption of MPS responses
+    Uses PyCrypto (PKCS#1 v1.5 cipher)
+    """
+    key_file = KEY_BASE_PATH / sub_service_name / "PRIVATE_CP.pem"
+
+    if not key_file.exists():
+        raise FileNotFoundError(f"Private key not found: {key_file}")
+
+    with open(key_file, "rb") as f:
+        return RSA.import_key(f.read())
+
+def preload_keys(sub_service_names) -> int:
+    """
+    Nạp sẵn key của các sub_service vào cache (gọi lúc app startup)
+    Thiếu key thì chỉ log, lượt charge sau sẽ báo lỗi như cũ
+    """
+    loaded = 0
+    for name in sub_service_names:
+        try:
+            load_private_key(name)
+            load_public_vt_key_for_encryption(name)
+            load_private_key_for_decryption(name)
+            loaded += 1
+        except Exception as e:
+            logger.warning(f"Preload keys for {name} failed: {e}")
+    return loaded
+
 # ====== Step 2: AES Encryption ======
 def encrypt_aes(data: str, aes_key: bytes) -> str:
     """
@@ -477,13 +512,8 @@ def decrypt_with_mps_private_key_v2(sub_service_name: str, response_text: str) -
         if len(data_encrypted) % 4:
             data_encrypted += "=" * (4 - len(data_encrypted) % 4)
 
-        # --- STEP 2: Load private key ---
-        base_dir = KEY_BASE_PATH / sub_service_name
-        private_cp_path = base_dir / "PRIVATE_CP.pem"
-        if not private_cp_path.exists():
-            raise FileNotFoundError(f"Private key not found: {private_cp_path}")
-
-        private_key = RSA.import_key(open(private_cp_path, "rb").read())
+        # --- STEP 2: Load private key (cached) ---
+        private_key = load_private_key_for_decryption(sub_service_name)
 
         # --- STEP 3: RSA decrypt using PKCS#1 v1.5 ---
         cipher_rsa = PKCS1_v1_5.new(private_key)
@@ -554,6 +584,8 @@ def decrypt_mps_response(sub_service_name: str, response_text: str) -> str:
 __all__ = [
     'load_private_key',
     'load_public_vt_key_for_encryption',
+    'load_private_key_for_decryption',
+    'preload_keys',
     'encrypt_aes',
     'encrypt_rsa',
     'create_msg_signature',
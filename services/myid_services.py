@@ -10,7 +10,10 @@ import string
 import logging
 import os
 
-from models.myid_models import MyIDCustomer, MyIDCustomerHistory, MyIDCustomerCancel, MyIDLogCharging
+from models.myid_models import (
+    MyIDCustomer, MyIDCustomerHistory, MyIDCustomerCancel, MyIDLogCharging,
+    INSERT_LOG_CHARGING_STMT
+)
 from schemas.myid_schemas import SubRequest, ResultRequest, ContentRequest, ChargingAction
 
 load_dotenv()
@@ -137,25 +140,29 @@ class MyIDService:
     ) -> None:
         """Ghi log charging - KHÔNG commit ở đây"""
         try:
-            log_entry = MyIDLogCharging(
-                action=action,  # ✅ THÊM action vào log
-                msisdn=msisdn,
-                package_code=package_code,
-                reg_datetime=charge_time,
-                channel=channel,
-                charge_price=charge_price,
-                transaction_id=transaction_id,
-                mps_command=mps_command,
-                mode=mode,
-                is_success=is_success  # ✅ 0=success, 1=failed
-            )
-            db.add(log_entry)
+            await self.log_charging_many(db, [{
+                "action": action,  # ✅ THÊM action vào log
+                "msisdn": msisdn,
+                "package_code": package_code,
+                "reg_datetime": charge_time,
+                "channel": channel,
+                "charge_price": charge_price,
+                "transaction_id": transaction_id,
+                "mps_command": mps_command,
+                "mode": mode,
+                "is_success": is_success  # ✅ 0=success, 1=failed
+            }])
             logger.info(f"Log charging prepared: action={action}, txn={transaction_id}, is_success={is_success} (0=success,1=failed)")
             
         except Exception as e:
             logger.exception(f"Error creating log_charging: {e}")
             raise
     
+    async def log_charging_many(self, db: AsyncSession, rows: List[Dict[str, Any]]) -> None:
+        """Ghi nhiều log charging bằng Core INSERT (không qua ORM flush) - KHÔNG commit ở đây"""
+        if rows:
+            await db.execute(INSERT_LOG_CHARGING_STMT, rows)
+    
     # ✅ LOẠI BỎ log_charging_failure riêng - dùng chung log_charging với is_success=0
     
     async def process_sub_request(self, db: AsyncSession, request: SubRequest) -> dict:
@@ -467,7 +474,7 @@ class MyIDService:
             stmt = select(MyIDCustomer).where(
                 MyIDCustomer.msisdn == request.msisdn,
                 MyIDCustomer.package_name == package_name
-            )
+            ).limit(1)
             result = await db.execute(stmt)
             customer = result.scalar_one_or_none()
             
@@ -535,7 +542,7 @@ class MyIDService:
             stmt = select(MyIDCustomer).where(
                 MyIDCustomer.msisdn == request.msisdn,
                 MyIDCustomer.package_name == package_name
-            )
+            ).limit(1)
             result = await db.execute(stmt)
             customer = result.scalar_one_or_none()
             
@@ -597,7 +604,7 @@ class MyIDService:
             stmt = select(MyIDCustomer).where(
                 MyIDCustomer.msisdn == request.msisdn,
                 MyIDCustomer.package_name == package_name
-            )
+            ).limit(1)
             result = await db.execute(stmt)
             customer = result.scalar_one_or_none()
             
@@ -677,7 +684,7 @@ class MyIDService:
             stmt = select(MyIDCustomer).where(
                 MyIDCustomer.msisdn == request.msisdn,
                 MyIDCustomer.package_name == package_name
-            )
+            ).limit(1)
             result = await db.execute(stmt)
             customer = result.scalar_one_or_none()
             
@@ -1,187 +1,518 @@
-# tasks/leaderboard_etl.py - Updated với win/loss tracking
+# tasks/leaderboard_etl.py - ETL leaderboard_history (mlog incremental + rebuild toàn kỳ)
 from datetime import datetime, date, timedelta, timezone
 from typing import Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import func, and_, case, cast, Integer
+from sqlalchemy import func, cast, literal, Integer, update, delete
 from sqlalchemy.dialects.mysql import insert
-from models.models import GameplayHistory, LeaderboardHistory
+from models.models import (
+    GameplayHistory, GameplayHistoryLog, GameplayBestPerLevel, LeaderboardBestPerLevel,
+    LeaderboardHistory, LeaderboardSnapshot
+)
+from database import db_session
+from services.gameplay_service import best_per_level_merge
+from utils.period_utils import period_range, period_bounds
+from utils.redis_cache import cache_incr
+import asyncio
 import logging
+import re
 
 logger = logging.getLogger(__name__)
 MY_TZ = timezone.utc
 
+# Số snapshot backfill chạy đồng thời (nhỏ hơn pool_size của engine)
+BACKFILL_CONCURRENCY = 8
+# Tăng mỗi lần ghi leaderboard_history -> ETag của /leaderboard (snapshot) đổi theo
+LB_SNAPSHOT_VERSION_KEY = "lb:snapshot_version"
+# Số user mỗi lô khi backfill leaderboard_best_per_level (mỗi lô 1 transaction)
+BEST_BACKFILL_USER_CHUNK = 2000
+# Số dòng gameplay_history_mlog áp dụng mỗi lô
+MLOG_BATCH_SIZE = 5000
+MLOG_PERIODS = ("daily", "weekly", "monthly")
+# Named lock MySQL: rebuild toàn kỳ và job mlog không chạy chồng lên nhau
+LB_MLOG_LOCK = "lb:mlog"
+# Rebuild chờ job mlog đang chạy tối đa (giây)
+LB_MLOG_LOCK_TIMEOUT = 300
+# Cùng điều kiện với cột level_num (models): chỉ level_<số>, mã khác -> 0
+_LEVEL_CODE_RE = re.compile(r"level_([0-9]{1,9})")
+
 
 def extract_level_number(level_code: str) -> int:
-    """Trích xuất số level từ level_code (ví dụ: 'level_038' -> 38)"""
-    try:
-        if level_code and '_' in level_code:
-            return int(level_code.split('_')[-1])
-        return 0
-    except (ValueError, IndexError):
-        return 0
+    """
+    Trích xuất số level từ level_code (ví dụ: 'level_038' -> 38)
+    Khớp cột level_num: mã không phải level_<số> -> 0 (max_level của mlog và rebuild giống nhau)
+    """
+    m = _LEVEL_CODE_RE.fullmatch(level_code or "")
+    return int(m.group(1)) if m else 0
+
+
+async def _acquire_mlog_lock(db: AsyncSession, timeout: int) -> bool:
+    """GET_LOCK trên connection của transaction hiện tại (timeout 0 = không chờ)"""
+    return bool((await db.execute(select(func.get_lock(LB_MLOG_LOCK, timeout)))).scalar())
+
+
+async def _release_mlog_lock(db: AsyncSession) -> None:
+    """
+    Nhả named lock, gọi TRƯỚC commit/rollback: sau commit session trả connection về pool,
+    RELEASE_LOCK chạy trên connection khác sẽ không nhả được lock
+    Nhả trước commit vẫn an toàn: bên kia ghi vào cùng dòng leaderboard_history sẽ chờ row lock
+    """
+    await db.execute(select(func.release_lock(LB_MLOG_LOCK)))
 
 
 async def snapshot_leaderboard(db: AsyncSession, period: str, target_date: Optional[date] = None):
     """
-    Tính toán và lưu leaderboard dựa trên GameplayHistory
-    
-    Tiêu chí xếp hạng (theo thứ tự ưu tiên):
+    Tính lại toàn kỳ leaderboard_history từ GameplayHistory (backfill / admin / seed kỳ đang chạy)
+
+    Tiêu chí xếp hạng giống apply_leaderboard_mlog (cùng dùng _rerank_period):
     1. Tổng điểm (sum(score)) → cao hơn xếp trước
-    2. Win rate (win_count/total_games) → cao hơn xếp trước
-    3. Số lượt chơi (count) → ít hơn xếp trước
-    4. Level cao nhất (max) → cao hơn xếp trước
-    5. Mức độ hoàn thành (avg(stars)) → cao hơn xếp trước
-    6. Thời gian chơi (sum(duration)) → thấp hơn xếp trước
-    7. Thời gian bắt đầu (min(started_at)) → sớm hơn xếp trước
+    2. Số lượt chơi (count) → ít hơn xếp trước
+    3. Level cao nhất (max) → cao hơn xếp trước
+    4. Mức độ hoàn thành (avg(stars)) → cao hơn xếp trước
+    5. Thời gian chơi (sum(duration)) → thấp hơn xếp trước
+    6. Thời gian bắt đầu (min(started_at)) → sớm hơn xếp trước
+
+    Chạy được lúc job mlog đang hoạt động. Kỳ còn dòng mlog chờ (hoặc chưa kết thúc),
+    trong 1 transaction:
+    1. Giữ named lock LB_MLOG_LOCK (job mlog bỏ qua lượt khi lock bận)
+    2. Đọc id các dòng mlog của kỳ (câu đọc đầu tiên -> mở read view) rồi khóa theo PK:
+       các dòng này đều nằm trong read view nên đã có trong aggregate bên dưới
+    3. Áp dụng chúng cho các period KHÁC (1 lượt chơi thuộc cả daily/weekly/monthly)
+    4. Aggregate lại kỳ, ghi đè leaderboard_history, xếp hạng lại, xóa các dòng mlog đã khóa
+    Lượt chơi commit sau read view không có trong aggregate và vẫn còn trong mlog
+    -> job mlog cộng sau, không bị đếm trùng
     """
     if target_date is None:
-        dt = datetime.now(MY_TZ)
-        target_date = dt.date()
-
-    # Xác định khoảng thời gian
-    if period == "weekly":
-        weekday = target_date.weekday()
-        start_date = target_date - timedelta(days=weekday)
-        end_date = start_date + timedelta(days=6)
-        snapshot_date = start_date
-    elif period == "monthly":
-        start_date = target_date.replace(day=1)
-        if target_date.month == 12:
-            end_date = date(target_date.year + 1, 1, 1) - timedelta(days=1)
-        else:
-            end_date = date(target_date.year, target_date.month + 1, 1) - timedelta(days=1)
-        snapshot_date = start_date
-    else:  # daily
-        start_date = target_date
-        end_date = target_date
-        snapshot_date = target_date
+        target_date = datetime.now(MY_TZ).date()
 
-    logger.info(f"Snapshot leaderboard period={period} from {start_date} to {end_date}")
+    # Nửa mở [start_dt, end_dt): end_dt = 00:00 ngày kế tiếp, lưu theo ngày bắt đầu kỳ
+    start_dt, end_dt, start_date, end_date = period_bounds(period, target_date)
+    logger.info(f"Rebuild leaderboard period={period} from {start_date} to {end_date}")
 
-    start_dt = datetime.combine(start_date, datetime.min.time())
-    end_dt = datetime.combine(end_date, datetime.max.time())
+    log = GameplayHistoryLog
+    window = (log.started_at >= start_dt, log.started_at < end_dt)
+    running = end_dt > datetime.now(MY_TZ).replace(tzinfo=None)
+    needs_lock = running or (
+        await db.execute(select(log.id).where(*window).limit(1))
+    ).first() is not None
+    # Kết thúc transaction của câu kiểm tra: read view phải mở SAU khi có lock
+    await db.commit()
 
-    # Query aggregate với win/loss tracking
-    query = select(
-        GameplayHistory.user_id,
-        func.sum(GameplayHistory.score).label('total_score'),
-        func.count(GameplayHistory.id).label('play_count'),
-        func.sum(case((GameplayHistory.result == 0, 1), else_=0)).label('win_count'),
-        func.sum(case((GameplayHistory.result == 1, 1), else_=0)).label('loss_count'),
-        # func.max(
-        #     case(
-        #         (GameplayHistory.level_code.like('level_%'),
-        #          cast(func.substring_index(GameplayHistory.level_code, '_', -1), Integer)),
-        #         else_=0
-        #     )
-        # ).label('max_level'),
-        func.avg(GameplayHistory.stars).label('avg_stars'),
-        func.sum(GameplayHistory.duration_seconds).label('total_duration'),
-        func.min(GameplayHistory.started_at).label('first_played_at'),
-        func.sum(GameplayHistory.coins_earned).label('total_coins'),
-        func.count(func.distinct(GameplayHistory.level_code)).label('level_played')
-    ).where(
-        and_(
-            GameplayHistory.started_at >= start_dt,
-            GameplayHistory.started_at <= end_dt
-        )
-    ).group_by(GameplayHistory.user_id)
+    if needs_lock and not await _acquire_mlog_lock(db, LB_MLOG_LOCK_TIMEOUT):
+        raise RuntimeError(f"Timeout waiting for {LB_MLOG_LOCK} lock")
+    try:
+        locked_ids = []
+        if needs_lock:
+            pending_ids = (await db.execute(
+                select(log.id).where(*window).order_by(log.id)
+            )).scalars().all()
+            if pending_ids:
+                rows = (await db.execute(
+                    select(*_MLOG_COLUMNS).where(log.id.in_(pending_ids))
+                    .order_by(log.id).with_for_update()
+                )).all()
+                locked_ids = [r[0] for r in rows]
+                await _apply_mlog_rows(db, rows, tuple(p for p in MLOG_PERIODS if p != period))
 
-    result = await db.execute(query)
-    rows = result.all()
+        count = await _rebuild_period(db, period, start_date, start_dt, end_dt)
+
+        if locked_ids:
+            await db.execute(delete(log).where(log.id.in_(locked_ids)))
+    finally:
+        if needs_lock:
+            await _release_mlog_lock(db)
+    await db.commit()
+    await cache_incr(LB_SNAPSHOT_VERSION_KEY)
+
+    logger.info(
+        f"✅ Rebuilt {count} leaderboard rows for period={period} date={start_date} "
+        f"(consumed {len(locked_ids)} mlog rows)"
+    )
+    return count
 
-    if not rows:
-        logger.info("No gameplay data found for this period, skipping snapshot")
-        return 0
 
-    # Chuyển đổi sang list of dict và tính win_rate
-    players = []
-    for row in rows:
-        play_count = int(row.play_count or 0)
-        win_count = int(row.win_count or 0)
-        win_rate = (win_count / play_count * 100) if play_count > 0 else 0.0
-        
-        players.append({
-            'user_id': row.user_id,
-            'total_score': int(row.total_score or 0),
-            'play_count': play_count,
-            'win_count': win_count,
-            'loss_count': int(row.loss_count or 0),
-            'win_rate': win_rate,
-            'max_level': int(row.max_level or 0),
-            'avg_stars': float(row.avg_stars or 0),
-            'total_duration': int(row.total_duration or 0),
-            'first_played_at': row.first_played_at,
-            'total_coins': int(row.total_coins or 0),
-            'level_played': int(row.level_played or 0)
-        })
-
-    # Sắp xếp theo 7 tiêu chí
-    sorted_players = sorted(players, key=lambda p: (
-        -p['total_score'],          # 1. Điểm cao hơn → trước
-        -p['win_rate'],             # 2. Win rate cao hơn → trước
-        p['play_count'],            # 3. Ít lượt chơi hơn → trước
-        -p['max_level'],            # 4. Level cao hơn → trước
-        -p['avg_stars'],            # 5. Sao nhiều hơn → trước
-        p['total_duration'],        # 6. Thời gian ít hơn → trước
-        p['first_played_at'] if p['first_played_at'] else datetime.max  # 7. Chơi sớm hơn → trước
-    ))
-
-    # Gán thứ hạng và chuẩn bị insert
-    inserts = []
-    for rank, player in enumerate(sorted_players, start=1):
-        inserts.append({
-            "user_id": player['user_id'],
-            "date": snapshot_date,
+async def _rebuild_period(
+    db: AsyncSession, period: str, start_date: date, start_dt: datetime, end_dt: datetime
+) -> int:
+    """Aggregate 1 kỳ từ gameplay_history, ghi đè leaderboard_history rồi xếp hạng lại (không commit)"""
+    g = GameplayHistory
+    query = select(
+        g.user_id,
+        func.sum(g.score),
+        func.count(g.id),
+        func.coalesce(func.max(g.level_num), 0),
+        func.sum(g.stars),
+        func.count(g.stars),
+        func.sum(g.duration_seconds),
+        func.min(g.started_at),
+        func.sum(g.coins_earned),
+        func.count(func.distinct(g.level_code))
+    ).where(g.started_at >= start_dt, g.started_at < end_dt).group_by(g.user_id)
+
+    # Stream theo lô 500 row (server-side cursor) thay vì result.all() giữ hết Row cùng lúc;
+    # unpack tuple theo vị trí cột, không qua attribute proxy của Row
+    result = await db.stream(query.execution_options(yield_per=500))
+    inserts = [
+        {
+            "user_id": user_id,
+            "date": start_date,
             "period": period,
-            "scores": player['total_score'],
-            "play_count": player['play_count'],
-            "win_count": player['win_count'],
-            "loss_count": player['loss_count'],
-            "win_rate": player['win_rate'],
-            "max_level": player['max_level'],
-            "avg_stars": player['avg_stars'],
-            "total_duration": player['total_duration'],
-            "first_played_at": player['first_played_at'],
-            "rank": rank,
-            "coins": player['total_coins'],
-            "level_played": player['level_played']
-        })
-
-    # Use ON DUPLICATE KEY UPDATE (MySQL / MariaDB)
+            "scores": int(total_score or 0),
+            "play_count": int(play_count or 0),
+            "max_level": int(max_level or 0),
+            "avg_stars": float(stars_sum) / stars_count if stars_count else None,
+            "stars_sum": int(stars_sum or 0),
+            "stars_count": int(stars_count or 0),
+            "total_duration": int(total_duration or 0),
+            "first_played_at": first_played_at,
+            "coins": int(total_coins or 0),
+            "level_played": int(level_played or 0),
+            "rank": 0
+        }
+        async for (user_id, total_score, play_count, max_level, stars_sum, stars_count,
+                   total_duration, first_played_at, total_coins, level_played) in result
+    ]
+    if not inserts:
+        logger.info("No gameplay data found for this period, skipping rebuild")
+        return 0
+
+    # Ghi đè giá trị (không cộng dồn như mlog), thứ hạng tính lại bằng SQL bên dưới
     stmt = insert(LeaderboardHistory).values(inserts)
+    new = stmt.inserted
+    stmt = stmt.on_duplicate_key_update(
+        scores=new.scores,
+        play_count=new.play_count,
+        max_level=new.max_level,
+        avg_stars=new.avg_stars,
+        stars_sum=new.stars_sum,
+        stars_count=new.stars_count,
+        total_duration=new.total_duration,
+        first_played_at=new.first_played_at,
+        coins=new.coins,
+        level_played=new.level_played
+    )
+    await db.execute(stmt)
+    await _rerank_period(db, period, start_date)
+    return len(inserts)
+
+
+def best_per_level_agg(start_dt: Optional[datetime] = None, end_dt: Optional[datetime] = None):
+    """
+    Subquery aggregate theo user, mỗi level chỉ lấy điểm cao nhất (game_mode normal)
+    Cột: user_id, total_scores, games_played, max_level, avg_stars, total_duration
+    start_dt/end_dt: mốc thời gian hoặc bindparam (statement dựng sẵn của API BXH);
+    bỏ trống cả hai -> all-time
+    """
+    conds = [GameplayHistory.game_mode == 'normal']
+    if start_dt is not None:
+        conds.append(GameplayHistory.started_at >= start_dt)
+    if end_dt is not None:
+        conds.append(GameplayHistory.started_at < end_dt)
+
+    # --- Subquery 1: best score per level per user ---
+    best_score_q = select(
+        GameplayHistory.user_id.label("user_id"),
+        GameplayHistory.level_code.label("level_code"),
+        func.max(GameplayHistory.level_num).label("level_num"),
+        func.max(GameplayHistory.score).label("best_score"),
+        func.max(GameplayHistory.stars).label("best_stars"),
+        func.min(GameplayHistory.duration_seconds).label("best_duration")
+    ).where(*conds).group_by(GameplayHistory.user_id, GameplayHistory.level_code).subquery()
+
+    # --- Subquery 2: aggregate by user ---
+    # COALESCE/CAST ngay trong SQL để DBAPI trả int/số sẵn, không phải `or 0` + int() từng row
+    return select(
+        best_score_q.c.user_id,
+        cast(func.coalesce(func.sum(best_score_q.c.best_score), 0), Integer).label("total_scores"),
+        func.count(best_score_q.c.level_code).label("games_played"),
+        # level_num NULL với mã không phải level_xxx -> MAX tự bỏ qua, không cần CASE.
+        # Không lọc các row đó ở best_score_q vì chúng vẫn tính vào total_scores/games_played
+        func.coalesce(func.max(best_score_q.c.level_num), 0).label("max_level"),
+        func.coalesce(func.avg(best_score_q.c.best_stars), 0).label("avg_stars"),
+        cast(func.coalesce(func.sum(best_score_q.c.best_duration), 0), Integer).label("total_duration")
+    ).group_by(best_score_q.c.user_id).subquery()
+
+
+async def snapshot_best_per_level(
+    db: AsyncSession, period: str, start_date: date, start_dt: datetime, end_dt: datetime
+) -> int:
+    """
+    Chốt BXH best-per-level của một kỳ vào leaderboard_snapshot
+    INSERT ... SELECT chạy hoàn toàn trong MySQL, không kéo row về Python
+    """
+    agg = best_per_level_agg(start_dt, end_dt)
+    src = select(
+        literal(period), literal(start_date), agg.c.user_id, agg.c.total_scores,
+        agg.c.games_played, agg.c.max_level, agg.c.avg_stars, agg.c.total_duration
+    )
+    stmt = insert(LeaderboardSnapshot).from_select(
+        ["period", "date", "user_id", "total_scores", "games_played",
+         "max_level", "avg_stars", "total_duration"],
+        src
+    )
     stmt = stmt.on_duplicate_key_update(
-        scores=stmt.inserted.scores,
-        play_count=stmt.inserted.play_count,
-        win_count=stmt.inserted.win_count,
-        loss_count=stmt.inserted.loss_count,
-        win_rate=stmt.inserted.win_rate,
+        total_scores=stmt.inserted.total_scores,
+        games_played=stmt.inserted.games_played,
         max_level=stmt.inserted.max_level,
         avg_stars=stmt.inserted.avg_stars,
-        total_duration=stmt.inserted.total_duration,
-        first_played_at=stmt.inserted.first_played_at,
-        rank=stmt.inserted.rank,
-        coins=stmt.inserted.coins,
-        level_played=stmt.inserted.level_played
+        total_duration=stmt.inserted.total_duration
     )
+    result = await db.execute(stmt)
+    await db.commit()
+    logger.info(f"Best-per-level snapshot period={period} date={start_date}: {result.rowcount} rows")
+    return result.rowcount
+
+
+async def snapshot_finished_periods(db: AsyncSession, day: date) -> int:
+    """
+    Chốt leaderboard_snapshot cho các kỳ kết thúc đúng ngày `day` (job chạy sau nửa đêm)
+    -> GET /admin/leaderboard/full chỉ đọc, không tự materialize
+    Kỳ không có lượt chơi nào thì không có dòng snapshot: GET aggregate trực tiếp
+    trên range rỗng của index, rẻ
+    """
+    total = 0
+    for period in MLOG_PERIODS:
+        start_dt, end_dt, start_date, end_date = period_bounds(period, day)
+        if end_date == day:
+            total += await snapshot_best_per_level(db, period, start_date, start_dt, end_dt)
+    return total
+
+
+async def backfill_gameplay_best_per_level(db: AsyncSession, start_date: date, end_date: date) -> int:
+    """
+    Nạp rollup gameplay_best_per_level từ gameplay_history cho các ngày [start_date, end_date]
+    - INSERT ... SELECT từng ngày một, commit mỗi ngày (transaction ngắn, không khóa lâu)
+    - ON DUPLICATE KEY gộp bằng GREATEST/LEAST như upsert lúc log gameplay
+      -> idempotent, chạy lại hoặc chạy song song với lượt chơi mới vẫn đúng
+    """
+    g = GameplayHistory
+    t = GameplayBestPerLevel
+    total = 0
+    day = start_date
+    while day <= end_date:
+        src = select(
+            g.user_id, g.started_date, g.level_code,
+            func.max(g.score), func.max(g.coins_earned), func.max(g.stars),
+            func.min(g.duration_seconds), func.max(g.started_at)
+        ).where(
+            g.started_date == day, g.level_code.isnot(None)
+        ).group_by(g.user_id, g.started_date, g.level_code)
+        stmt = insert(t).from_select(
+            ["user_id", "played_date", "level_code", "best_score", "best_coins",
+             "best_stars", "best_duration", "last_played_at"],
+            src
+        )
+        stmt = stmt.on_duplicate_key_update(best_per_level_merge(stmt))
+        result = await db.execute(stmt)
+        await db.commit()
+        total += result.rowcount
+        day += timedelta(days=1)
+
+    logger.info(f"Backfilled gameplay_best_per_level {start_date} → {end_date}: {total} rows")
+    return total
 
+
+async def backfill_leaderboard_best_per_level(
+    db: AsyncSession, user_chunk: int = BEST_BACKFILL_USER_CHUNK
+) -> int:
+    """
+    Nạp leaderboard_best_per_level (nguồn BXH period=all) từ toàn bộ gameplay_history normal
+    - INSERT ... SELECT theo từng khoảng user_id, commit mỗi lô (transaction ngắn)
+    - ON DUPLICATE KEY gộp bằng GREATEST/LEAST như upsert lúc log gameplay
+      -> idempotent, chạy lại hoặc chạy song song với lượt chơi mới vẫn đúng
+    """
+    g = GameplayHistory
+    t = LeaderboardBestPerLevel
+    lo, hi = (await db.execute(select(func.min(g.user_id), func.max(g.user_id)))).one()
+    if lo is None:
+        return 0
+
+    total = 0
+    for start in range(lo, hi + 1, user_chunk):
+        src = select(
+            g.user_id, g.level_code,
+            func.max(g.score), func.max(g.stars), func.min(g.duration_seconds)
+        ).where(
+            g.user_id >= start, g.user_id < start + user_chunk,
+            g.game_mode == 'normal', g.level_code.isnot(None)
+        ).group_by(g.user_id, g.level_code)
+        stmt = insert(t).from_select(
+            ["user_id", "level_code", "best_score", "best_stars", "best_duration"], src
+        )
+        stmt = stmt.on_duplicate_key_update(best_per_level_merge(stmt))
+        result = await db.execute(stmt)
+        await db.commit()
+        total += result.rowcount
+
+    logger.info(f"Backfilled leaderboard_best_per_level users {lo} → {hi}: {total} rows")
+    return total
+
+
+# Cột đọc từ gameplay_history_mlog, thứ tự khớp phép unpack trong _apply_mlog_rows
+_MLOG_COLUMNS = (
+    GameplayHistoryLog.id, GameplayHistoryLog.user_id, GameplayHistoryLog.level_code,
+    GameplayHistoryLog.score, GameplayHistoryLog.coins_earned, GameplayHistoryLog.stars,
+    GameplayHistoryLog.duration_seconds, GameplayHistoryLog.started_at
+)
+
+
+def _mlog_delta(started_at: datetime) -> dict:
+    return {
+        "scores": 0, "play_count": 0, "coins": 0, "total_duration": 0, "max_level": 0,
+        "stars_sum": 0, "stars_n": 0, "first_played_at": started_at
+    }
+
+
+async def _levels_played(db: AsyncSession, deltas: dict) -> dict:
+    """
+    Số level khác nhau mỗi (user, period, ngày bắt đầu kỳ) trong deltas, đếm trên
+    gameplay_best_per_level (1 dòng / user-ngày-level, đã có cả lượt chơi của lô này)
+    -> level_played (DISTINCT) không cộng dồn được nên gán lại giá trị đúng
+    """
+    user_ids = {user_id for user_id, _, _ in deltas}
+    since = min(start for _, _, start in deltas)
+    until = max(period_range(period, start)[1] for _, period, start in deltas) + timedelta(days=1)
+    b = GameplayBestPerLevel
+    result = await db.execute(
+        select(b.user_id, b.played_date, b.level_code).where(
+            b.user_id.in_(user_ids), b.played_date >= since, b.played_date < until
+        )
+    )
+    levels = {}
+    for user_id, played_date, level_code in result:
+        for period in MLOG_PERIODS:
+            key = (user_id, period, period_range(period, played_date)[0])
+            if key in deltas:
+                levels.setdefault(key, set()).add(level_code)
+    return {key: len(codes) for key, codes in levels.items()}
+
+
+async def _rerank_period(db: AsyncSession, period: str, start: date) -> None:
+    """Xếp hạng lại 1 kỳ bằng ROW_NUMBER trên leaderboard_history (dùng chung mlog + rebuild)"""
+    lh = LeaderboardHistory
+    ranked = select(
+        lh.id,
+        func.row_number().over(order_by=[
+            lh.scores.desc(), lh.play_count.asc(), lh.max_level.desc(),
+            lh.avg_stars.desc(), lh.total_duration.asc(), lh.first_played_at.asc(),
+            lh.user_id.asc()
+        ]).label("rn")
+    ).where(lh.period == period, lh.date == start).subquery()
+    await db.execute(update(lh).where(lh.id == ranked.c.id).values(rank=ranked.c.rn))
+
+
+async def _apply_mlog_rows(db: AsyncSession, rows, periods) -> int:
+    """
+    Cộng delta của các dòng mlog (cột theo _MLOG_COLUMNS) vào leaderboard_history cho `periods`
+    rồi xếp hạng lại các kỳ bị ảnh hưởng. Không xóa mlog, không commit
+    avg_stars = stars_sum / stars_count sau khi cộng dồn (khớp AVG(stars) của rebuild)
+    Trả về số dòng leaderboard_history được ghi
+    """
+    deltas = {}
+    for (_, user_id, level_code, score, coins, stars, duration, started_at) in rows:
+        played = started_at.date()
+        level_num = extract_level_number(level_code)
+        for period in periods:
+            key = (user_id, period, period_range(period, played)[0])
+            d = deltas.get(key)
+            if d is None:
+                d = deltas[key] = _mlog_delta(started_at)
+            d["scores"] += score or 0
+            d["play_count"] += 1
+            d["coins"] += coins or 0
+            d["total_duration"] += duration or 0
+            d["max_level"] = max(d["max_level"], level_num)
+            if stars is not None:
+                d["stars_sum"] += stars
+                d["stars_n"] += 1
+            d["first_played_at"] = min(d["first_played_at"], started_at)
+    if not deltas:
+        return 0
+
+    levels = await _levels_played(db, deltas)
+    inserts = [
+        {
+            "user_id": user_id,
+            "period": period,
+            "date": start,
+            "scores": d["scores"],
+            "play_count": d["play_count"],
+            "coins": d["coins"],
+            "total_duration": d["total_duration"],
+            "max_level": d["max_level"],
+            "avg_stars": d["stars_sum"] / d["stars_n"] if d["stars_n"] else None,
+            "stars_sum": d["stars_sum"],
+            "stars_count": d["stars_n"],
+            "first_played_at": d["first_played_at"],
+            "level_played": levels.get((user_id, period, start), 0),
+            "rank": 0
+        }
+        for (user_id, period, start), d in deltas.items()
+    ]
+
+    lh = LeaderboardHistory
+    stmt = insert(lh).values(inserts)
+    new = stmt.inserted
+    # MySQL gán ODKU từ trái sang phải, vế sau thấy giá trị MỚI của vế trước
+    # -> avg_stars đứng sau stars_sum/stars_count để chia trên tổng đã cộng dồn
+    stmt = stmt.on_duplicate_key_update([
+        ("stars_sum", func.coalesce(lh.stars_sum, 0) + new.stars_sum),
+        ("stars_count", func.coalesce(lh.stars_count, 0) + new.stars_count),
+        ("avg_stars", func.coalesce(lh.stars_sum / func.nullif(lh.stars_count, 0), lh.avg_stars)),
+        ("scores", func.coalesce(lh.scores, 0) + new.scores),
+        ("play_count", func.coalesce(lh.play_count, 0) + new.play_count),
+        ("coins", func.coalesce(lh.coins, 0) + new.coins),
+        ("total_duration", func.coalesce(lh.total_duration, 0) + new.total_duration),
+        ("max_level", func.greatest(func.coalesce(lh.max_level, 0), new.max_level)),
+        ("first_played_at", func.least(
+            func.coalesce(lh.first_played_at, new.first_played_at), new.first_played_at
+        )),
+        ("level_played", new.level_played)
+    ])
     await db.execute(stmt)
-    await db.commit()
 
-    logger.info(f"✅ Inserted/Updated {len(inserts)} leaderboard rows for period={period} date={snapshot_date}")
-    
-    # Log top 3 players with win rate
-    if len(inserts) >= 3:
-        top3_info = [
-            f"#{p['rank']}:user_{p['user_id']}({p['total_score']}pts, {p['win_rate']:.1f}%WR)" 
-            for p in inserts[:3]
-        ]
-        logger.info(f"   Top 3: {', '.join(top3_info)}")
-    
+    # Xếp hạng lại từng kỳ bị ảnh hưởng (thường chỉ 1 ngày / 1 tuần / 1 tháng mỗi lô)
+    for period, start in {(period, start) for _, period, start in deltas}:
+        await _rerank_period(db, period, start)
     return len(inserts)
 
 
+async def apply_leaderboard_mlog(db: AsyncSession, batch_size: int = MLOG_BATCH_SIZE) -> int:
+    """
+    Cập nhật leaderboard_history daily/weekly/monthly từ 1 lô gameplay_history_mlog
+    (thay cho tính lại toàn kỳ): chi phí tỉ lệ với số lượt chơi mới
+    1. Giữ named lock LB_MLOG_LOCK (rebuild toàn kỳ đang chạy -> bỏ qua lượt này)
+    2. Khóa lô mlog (SKIP LOCKED: nhiều worker không áp dụng trùng)
+    3. Gộp delta theo (user, period, ngày bắt đầu kỳ) rồi ON DUPLICATE KEY UPDATE cộng dồn
+    4. Xếp hạng lại các kỳ bị ảnh hưởng (ROW_NUMBER trên leaderboard_history, không đụng gameplay_history)
+    5. Xóa các dòng mlog đã áp dụng, commit 1 lần
+    Trả về số dòng mlog đã xử lý
+    """
+    if not await _acquire_mlog_lock(db, 0):
+        logger.info(f"{LB_MLOG_LOCK} is held by a leaderboard rebuild, skip this run")
+        await db.rollback()
+        return 0
+
+    log = GameplayHistoryLog
+    try:
+        rows = (await db.execute(
+            select(*_MLOG_COLUMNS).order_by(log.id).limit(batch_size).with_for_update(skip_locked=True)
+        )).all()
+        written = 0
+        if rows:
+            written = await _apply_mlog_rows(db, rows, MLOG_PERIODS)
+            await db.execute(delete(log).where(log.id.in_([r[0] for r in rows])))
+    finally:
+        await _release_mlog_lock(db)
+    await db.commit()
+    if not rows:
+        return 0
+    await cache_incr(LB_SNAPSHOT_VERSION_KEY)
+
+    logger.info(f"Applied {len(rows)} mlog rows -> {written} leaderboard_history rows")
+    return len(rows)
+
+
 async def snapshot_daily(db: AsyncSession, target_date: Optional[date] = None):
     """Snapshot leaderboard hàng ngày"""
     return await snapshot_leaderboard(db, "daily", target_date)
@@ -197,31 +528,62 @@ async def snapshot_monthly(db: AsyncSession, target_date: Optional[date] = None)
     return await snapshot_leaderboard(db, "monthly", target_date)
 
 
+async def seed_current_periods(db: AsyncSession, target_date: Optional[date] = None) -> int:
+    """
+    Tính lại các kỳ daily/weekly/monthly đang chạy từ gameplay_history
+    Chạy 1 lần sau khi deploy mlog: leaderboard_history kỳ hiện tại khi đó mới chỉ có
+    lượt chơi ghi sau deploy. Rebuild tự khóa + tiêu thụ các dòng mlog của kỳ nên không
+    cần dừng job mlog; các kỳ đã kết thúc trước đó dùng backfill_leaderboard
+    """
+    total = 0
+    for period in MLOG_PERIODS:
+        total += await snapshot_leaderboard(db, period, target_date)
+    return total
+
+
 async def backfill_leaderboard(
     db: AsyncSession, 
     start_date: date, 
     end_date: date,
-    periods: list = ["daily", "weekly", "monthly"]
+    periods: list = ["daily", "weekly", "monthly"],
+    concurrency: int = BACKFILL_CONCURRENCY
 ):
     """
     Tính lại leaderboard cho nhiều ngày
-    Warning: Có thể mất nhiều thời gian với range lớn
+    - Mỗi (period, kỳ) chỉ tính một lần (weekly/monthly không tính lại cho từng ngày trong kỳ)
+    - Các snapshot độc lập nên chạy song song, mỗi task một session riêng
+      (AsyncSession không dùng chung đồng thời được), giới hạn bằng semaphore
+    `db` giữ lại cho tương thích chữ ký, không dùng trong các task song song
     """
+    jobs = {}
     current_date = start_date
-    total_processed = 0
-
     while current_date <= end_date:
-        logger.info(f"📅 Backfilling leaderboard for {current_date}")
-
         for period in periods:
-            try:
-                count = await snapshot_leaderboard(db, period, current_date)
-                total_processed += count
-                logger.info(f"   ✓ {period}: {count} records")
-            except Exception as e:
-                logger.error(f"   ✗ Error backfilling {period} for {current_date}: {str(e)}")
-
+            jobs.setdefault((period, period_range(period, current_date)[0]), current_date)
         current_date += timedelta(days=1)
 
+    sem = asyncio.Semaphore(concurrency)
+
+    async def run(period: str, target_date: date) -> int:
+        async with sem:
+            async with db_session() as task_db:
+                count = await snapshot_leaderboard(task_db, period, target_date)
+        logger.info(f"   ✓ {period} {target_date}: {count} records")
+        return count
+
+    logger.info(f"📅 Backfilling leaderboard {start_date} → {end_date}: {len(jobs)} snapshots")
+    keys = list(jobs)
+    results = await asyncio.gather(
+        *(run(period, jobs[(period, start)]) for period, start in keys),
+        return_exceptions=True
+    )
+
+    total_processed = 0
+    for (period, start), res in zip(keys, results):
+        if isinstance(res, Exception):
+            logger.error(f"   ✗ Error backfilling {period} for {start}: {str(res)}")
+        else:
+            total_processed += res
+
     logger.info(f"🎉 Backfill completed. Total records: {total_processed}")
-    return total_processed
\ No newline at end of file
+    return total_processed
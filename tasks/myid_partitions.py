@@ -0,0 +1,88 @@
+# tasks/myid_partitions.py - Partition theo tháng cho bảng lịch sử MyID
+"""
+myid_customer_history là bảng append-only, truy vấn chủ yếu theo khoảng thời gian
+-> RANGE partition theo tháng trên created_at để MySQL prune partition,
+   dọn dữ liệu cũ bằng DROP PARTITION thay vì DELETE
+
+Chuyển đổi một lần (MySQL yêu cầu cột partition nằm trong mọi unique key, kể cả PK):
+
+    ALTER TABLE myid_customer_history
+        MODIFY created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        DROP PRIMARY KEY, ADD PRIMARY KEY (id, created_at);
+    ALTER TABLE myid_customer_history PARTITION BY RANGE (TO_DAYS(created_at)) (
+        PARTITION p202510 VALUES LESS THAN (TO_DAYS('2025-11-01')),
+        PARTITION pmax VALUES LESS THAN MAXVALUE
+    );
+
+ORM vẫn map PK là `id` (auto increment nên vẫn unique), không cần đổi model.
+
+myid_log_chargings KHÔNG partition: unique(transaction_id) là chốt chống xử lý trùng
+giao dịch MPS, partition sẽ buộc phải nới thành unique(transaction_id, reg_datetime).
+
+Sau khi chuyển đổi, job hàng tháng gọi ensure_monthly_partitions() để tách sẵn
+partition cho các tháng tới từ pmax.
+"""
+from datetime import date
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+import logging
+
+logger = logging.getLogger(__name__)
+
+# table -> cột partition
+PARTITIONED_TABLES = {
+    "myid_customer_history": "created_at",
+}
+
+MONTHS_AHEAD = 3
+
+
+def _add_months(d: date, months: int) -> date:
+    """Ngày 1 của tháng d + months"""
+    total = d.year * 12 + (d.month - 1) + months
+    return date(total // 12, total % 12 + 1, 1)
+
+
+async def _existing_partitions(db: AsyncSession, table: str) -> set:
+    result = await db.execute(
+        text(
+            "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table "
+            "AND PARTITION_NAME IS NOT NULL"
+        ),
+        {"table": table}
+    )
+    return {row[0] for row in result}
+
+
+async def ensure_monthly_partitions(db: AsyncSession, months_ahead: int = MONTHS_AHEAD) -> int:
+    """
+    Tách partition cho tháng hiện tại + `months_ahead` tháng tới từ pmax
+    Bảng chưa được partition thì bỏ qua. Trả về số partition đã tạo
+    """
+    created = 0
+    first_of_month = date.today().replace(day=1)
+
+    for table in PARTITIONED_TABLES:
+        existing = await _existing_partitions(db, table)
+        if "pmax" not in existing:
+            logger.warning(f"{table} chưa được partition theo tháng, bỏ qua")
+            continue
+
+        for i in range(months_ahead + 1):
+            month = _add_months(first_of_month, i)
+            name = f"p{month:%Y%m}"
+            if name in existing:
+                continue
+            upper = _add_months(month, 1)
+            # Tên bảng/partition lấy từ hằng số và ngày tháng, không từ input
+            await db.execute(text(
+                f"ALTER TABLE {table} REORGANIZE PARTITION pmax INTO ("
+                f"PARTITION {name} VALUES LESS THAN (TO_DAYS('{upper:%Y-%m-%d}')), "
+                f"PARTITION pmax VALUES LESS THAN MAXVALUE)"
+            ))
+            existing.add(name)
+            created += 1
+            logger.info(f"📦 Created partition {table}.{name}")
+
+    return created
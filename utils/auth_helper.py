@@ -1,12 +1,16 @@
 import base64
-from fastapi.responses import JSONResponse
+import secrets
+from fastapi import Header, HTTPException
+# ORJSONResponse kế thừa JSONResponse: các chỗ gọi vẫn check isinstance(user, JSONResponse)
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.future import select
 from models.models import User
 from utils.response_helper import response_error  # 👈 import từ file mới
+import config_sys
 
 async def get_user_from_auth(auth: str, db):
     if not auth:
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=400,
             content=response_error(400, "Missing parameter: auth")
         )
@@ -15,7 +19,7 @@ async def get_user_from_auth(auth: str, db):
         decoded = base64.urlsafe_b64decode(auth.encode()).decode()
         msisdn, token = decoded.split(":", 1)
     except Exception:
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=400,
             content=response_error(400, "Invalid auth format")
         )
@@ -24,15 +28,25 @@ async def get_user_from_auth(auth: str, db):
     user = result.scalars().first()
 
     if not user:
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=404,
             content=response_error(404, "User not found")
         )
 
     if user.api_token != token:
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=401,
             content=response_error(401, "Invalid token")
         )
 
     return user
+
+
+async def require_admin(x_admin_token: str = Header(None)) -> None:
+    """
+    Dependency cho endpoint CMS/admin: header X-Admin-Token phải khớp ADMIN_TOKEN
+    So sánh hằng thời gian; server chưa cấu hình ADMIN_TOKEN thì từ chối tất cả
+    """
+    expected = config_sys.ADMIN_TOKEN
+    if not expected or not x_admin_token or not secrets.compare_digest(x_admin_token, expected):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
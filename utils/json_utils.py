@@ -0,0 +1,15 @@
+# utils/json_utils.py - JSON encode/decode dùng chung (orjson)
+import orjson
+
+# orjson.JSONDecodeError kế thừa json.JSONDecodeError / ValueError
+JSONDecodeError = orjson.JSONDecodeError
+
+
+def dumps(obj) -> str:
+    """Serialize obj sang JSON string (orjson trả bytes nên decode lại)"""
+    return orjson.dumps(obj).decode()
+
+
+def loads(data):
+    """Parse JSON từ str/bytes"""
+    return orjson.loads(data)
@@ -1,9 +1,8 @@
 from sqlalchemy import event, inspect, Table
 from sqlalchemy.sql import Select
-from datetime import datetime, timedelta, timezone
+from datetime import datetime
 
-# Myanmar timezone offset
-MYANMAR_TZ = timezone(timedelta(hours=6, minutes=30))
+from config_sys import MYANMAR_TZ
 
 # Giờ launch theo server (đã ở Myanmar)
 # ⚠️ Không thêm tzinfo để tránh mismatch
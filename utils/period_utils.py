@@ -0,0 +1,47 @@
+# utils/period_utils.py - Khoảng ngày (start_date, end_date) / mốc datetime cho daily/weekly/monthly
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+
+
+def _daily_range(d: date) -> tuple:
+    return d, d
+
+
+def _weekly_range(d: date) -> tuple:
+    start = d - timedelta(days=d.weekday())
+    return start, start + timedelta(days=6)
+
+
+def _monthly_range(d: date) -> tuple:
+    start = d.replace(day=1)
+    if d.month == 12:
+        next_month = date(d.year + 1, 1, 1)
+    else:
+        next_month = date(d.year, d.month + 1, 1)
+    return start, next_month - timedelta(days=1)
+
+
+PERIOD_RANGE = {
+    "daily": _daily_range,
+    "weekly": _weekly_range,
+    "monthly": _monthly_range,
+}
+
+
+@lru_cache(maxsize=1024)
+def period_range(period: str, target_date: date) -> tuple:
+    """(start_date, end_date) của kỳ chứa target_date, period lạ thì coi như daily"""
+    return PERIOD_RANGE.get(period, _daily_range)(target_date)
+
+
+@lru_cache(maxsize=4096)
+def period_bounds(period: str, target_date: date) -> tuple:
+    """
+    (start_dt, end_dt, start_date, end_date) của kỳ chứa target_date
+    Nửa mở [start_dt, end_dt): end_dt = 00:00 ngày sau end_date
+    datetime/date bất biến nên trả chung 1 tuple cho mọi request cùng ngày
+    """
+    start_date, end_date = period_range(period, target_date)
+    start_dt = datetime.combine(start_date, time.min)
+    end_dt = datetime.combine(end_date + timedelta(days=1), time.min)
+    return start_dt, end_dt, start_date, end_date
@@ -0,0 +1,47 @@
+# utils/profile_helper.py - Tên/avatar người chơi cho BXH, lấy theo lô user_id
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models.models import GameStatement
+
+DEFAULT_PROFILE = ("Player", 0)  # (name, avatar) khi user chưa có statement
+
+# Giới hạn cột GameStatement.name (String(100)) / avatar (SMALLINT signed)
+PROFILE_NAME_MAX_LEN = 100
+SMALLINT_MIN, SMALLINT_MAX = -32768, 32767
+
+def extract_profile(data: dict) -> tuple:
+    """
+    (name, avatar) để lưu vào cột riêng của GameStatement
+    JSON do client gửi: ép kiểu/cắt về đúng giới hạn cột, giá trị không hợp lệ -> None
+    (strict mode sẽ báo DataError làm hỏng cả lượt save statement)
+    """
+    name = data.get("name")
+    if isinstance(name, (str, int, float)) and not isinstance(name, bool):
+        name = str(name)[:PROFILE_NAME_MAX_LEN]
+    else:
+        name = None
+
+    avatar = data.get("avatar")
+    try:
+        avatar = int(avatar) if avatar is not None else None
+    except (TypeError, ValueError, OverflowError):
+        avatar = None
+    if avatar is not None and not SMALLINT_MIN <= avatar <= SMALLINT_MAX:
+        avatar = None
+    return name, avatar
+
+
+async def fetch_profiles(db: AsyncSession, user_ids: list) -> dict:
+    """
+    {user_id: (name, avatar)} bằng 1 query IN (...) cho đúng các user cần hiển thị,
+    thay vì LEFT JOIN game_statements vào mọi row aggregate
+    """
+    if not user_ids:
+        return {}
+    result = await db.execute(
+        select(GameStatement.user_id, GameStatement.name, GameStatement.avatar)
+        .where(GameStatement.user_id.in_(user_ids))
+        .order_by(GameStatement.id)  # nhiều statement -> giữ bản mới nhất
+    )
+    return {r.user_id: (r.name or "Player", r.avatar or 0) for r in result}
@@ -0,0 +1,55 @@
+# utils/redis_cache.py - Cache JSON ngắn hạn trên Redis (optional, lỗi Redis thì bỏ qua)
+from redis.asyncio import Redis
+from typing import Any, Optional
+import logging
+
+import config_sys
+from utils import json_utils
+
+logger = logging.getLogger(__name__)
+
+_redis: Optional[Redis] = None
+
+
+def get_redis() -> Redis:
+    """Redis client dùng chung, tạo lazy lần đầu gọi"""
+    global _redis
+    if _redis is None:
+        _redis = Redis(
+            host=config_sys.REDIS_HOST,
+            port=config_sys.REDIS_PORT,
+            db=config_sys.REDIS_DB,
+            decode_responses=True
+        )
+    return _redis
+
+
+async def cache_get_json(key: str) -> Optional[Any]:
+    """Lấy giá trị đã cache, None nếu miss hoặc Redis lỗi"""
+    try:
+        raw = await get_redis().get(key)
+    except Exception as e:
+        logger.warning(f"Redis GET {key} failed: {e}")
+        return None
+    if raw is None:
+        return None
+    try:
+        return json_utils.loads(raw)
+    except json_utils.JSONDecodeError:
+        return None
+
+
+async def cache_set_json(key: str, value: Any, ttl: int) -> None:
+    """Ghi cache với TTL (giây), Redis lỗi thì chỉ log"""
+    try:
+        await get_redis().set(key, json_utils.dumps(value), ex=ttl)
+    except Exception as e:
+        logger.warning(f"Redis SET {key} failed: {e}")
+
+
+async def cache_incr(key: str) -> None:
+    """Tăng bộ đếm (vd version dữ liệu), Redis lỗi thì chỉ log"""
+    try:
+        await get_redis().incr(key)
+    except Exception as e:
+        logger.warning(f"Redis INCR {key} failed: {e}")
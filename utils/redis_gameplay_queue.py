@@ -1,6 +1,6 @@
 # utils/redis_gameplay_queue.py - Optional Redis queue cho high-load scenarios
 import redis.asyncio as aioredis
-import json
+from utils import json_utils
 import logging
 from typing import Optional, Dict, Any
 from datetime import datetime
@@ -58,7 +58,7 @@ class GameplayRedisQueue:
             # Push to Redis list
             await self.redis.rpush(
                 self.queue_key,
-                json.dumps(gameplay_data)
+                json_utils.dumps(gameplay_data)
             )
             
             logger.debug(f"Pushed gameplay to queue: user={gameplay_data.get('user_id')}")
@@ -78,7 +78,7 @@ class GameplayRedisQueue:
         try:
             data = await self.redis.lpop(self.queue_key)
             if data:
-                return json.loads(data)
+                return json_utils.loads(data)
             return None
         except Exception as e:
             logger.error(f"Failed to pop from Redis queue: {e}")